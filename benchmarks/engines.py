@@ -0,0 +1,217 @@
+"""Comparison of the inference engines for the MUSIQ models on the CPU.
+
+Each engine runs on the same images in a fresh process, as the options of an engine
+apply to a whole process. The ratings are compared with those of the baseline engine
+("signature" in "float32") to check the accuracy drift. The models are loaded from a
+local directory (see `--model_dir` of the server), e.g.
+
+    python -m benchmarks.engines /path/to/musiq --images_folder=/path/to/photos
+"""
+
+import json
+import multiprocessing
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import fire
+import pandas as pd
+
+from benchmarks.pipeline import generate_corpus
+from imageassessmentservice.definitions import ASSESSMENT_HEADS
+from imageassessmentservice.scanner import scan_files
+from imageassessmentservice.server import (
+    configure_engine,
+    INFERENCE_ENGINES,
+    MusiqModel,
+    PRECISIONS,
+    warm_up,
+)
+
+BASELINE: Tuple[str, str] = ("signature", "float32")
+
+
+def measure_engine(
+    model_dir: str,
+    engine: str,
+    precision: str,
+    image_paths: Sequence[str],
+    repetitions: int,
+) -> Dict[str, Any]:
+    """Rate the images repeatedly with an engine and measure the throughput.
+
+    The first pass is reported separately, as it includes the compilation for each new
+    image size if the engine compiles the models.
+    """
+    configure_engine(engine, precision)
+
+    start = time.perf_counter()
+    model = MusiqModel.from_tf_hub(
+        model_dir=model_dir, engine=engine, precision=precision
+    )
+    load_s = time.perf_counter() - start
+    warm_up_s = warm_up(model)
+
+    images = [Path(image_path).read_bytes() for image_path in image_paths]
+    pass_durations_s = []
+
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        assessments = model.assess_batch(images)
+        pass_durations_s.append(time.perf_counter() - start)
+
+    return {
+        "engine": engine,
+        "precision": precision,
+        "load_s": load_s,
+        "warm_up_s": warm_up_s,
+        "first_pass_s": pass_durations_s[0],
+        "images_per_s": len(images) * (repetitions - 1) / sum(pass_durations_s[1:]),
+        "ratings": [assessment._asdict() for assessment in assessments],
+    }
+
+
+def _measure_in_fresh_process(*args: Any) -> Dict[str, Any]:
+    # Spawned rather than forked, as TensorFlow does not support forking
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        return executor.submit(measure_engine, *args).result()
+
+
+def accuracy_drift(
+    baseline_ratings: List[Dict[str, float]],
+    ratings: List[Dict[str, float]],
+    heads: Sequence[str] = ASSESSMENT_HEADS,
+) -> Dict[str, Dict[str, float]]:
+    """Absolute differences and rank correlation of the ratings of each head.
+
+    The rank correlation matters most, as the client bins images by their rank.
+    """
+    baseline = pd.DataFrame(baseline_ratings)
+    other = pd.DataFrame(ratings)
+
+    drift = {}
+
+    for head in heads:
+        differences = (other[head] - baseline[head]).abs()
+        drift[head] = {
+            "max_abs_diff": float(differences.max()),
+            "mean_abs_diff": float(differences.mean()),
+            # Spearman's correlation, without depending on scipy
+            "rank_correlation": float(baseline[head].rank().corr(other[head].rank())),
+        }
+
+    return drift
+
+
+def run_benchmark(
+    model_dir: str,
+    images_folder: Optional[str] = None,
+    num_images: int = 16,
+    width: int = 1024,
+    height: int = 768,
+    engines: Sequence[str] = INFERENCE_ENGINES,
+    precisions: Sequence[str] = PRECISIONS,
+    repetitions: int = 3,
+    min_rank_correlation: float = 0.99,
+    output_file: Optional[str] = None,
+) -> None:
+    """Compare the throughput and the ratings of the inference engines.
+
+    Parameters
+    ----------
+    model_dir
+        Directory with the MUSIQ SavedModels in the sub-directories "ava" and "paq2piq"
+    images_folder
+        Folder with images to rate, synthetic images are used if None. Photos give a
+        more meaningful accuracy drift than synthetic images.
+    num_images
+        Number of images to rate
+    width
+        Width of the synthetic images in pixels
+    height
+        Height of the synthetic images in pixels
+    engines
+        Engines to compare with the baseline (comma-separated on the command line)
+    precisions
+        Precisions to compare with the baseline (comma-separated on the command line)
+    repetitions
+        Number of passes over the images per engine, at least 2. The throughput is
+        measured without the first pass.
+    min_rank_correlation
+        Minimum rank correlation with the baseline for the ratings of an engine to be
+        considered within tolerance
+    output_file
+        JSON file to which the configuration and the results are written
+    """
+    if isinstance(engines, str):
+        engines = engines.split(",")
+
+    if isinstance(precisions, str):
+        precisions = precisions.split(",")
+
+    if repetitions < 2:
+        raise ValueError("Expect repetitions to be at least 2.")
+
+    configurations = [BASELINE] + [
+        (engine, precision)
+        for engine in engines
+        for precision in precisions
+        if (engine, precision) != BASELINE
+    ]
+
+    with tempfile.TemporaryDirectory() as corpus_folder:
+        if images_folder is not None:
+            image_paths = sorted(
+                scanned_file.path
+                for scanned_file in scan_files(Path(images_folder))
+                if scanned_file.is_image
+            )[:num_images]
+        else:
+            image_paths = generate_corpus(
+                Path(corpus_folder), num_images, width, height
+            )
+
+        results = [
+            _measure_in_fresh_process(
+                model_dir,
+                engine,
+                precision,
+                [str(image_path) for image_path in image_paths],
+                repetitions,
+            )
+            for engine, precision in configurations
+        ]
+
+    baseline_result = results[0]
+
+    for result in results[1:]:
+        result["speedup"] = result["images_per_s"] / baseline_result["images_per_s"]
+        result["drift"] = accuracy_drift(baseline_result["ratings"], result["ratings"])
+        result["within_tolerance"] = all(
+            head_drift["rank_correlation"] >= min_rank_correlation
+            for head_drift in result["drift"].values()
+        )
+
+    for result in results:
+        del result["ratings"]
+
+    config = {
+        "model_dir": model_dir,
+        "images_folder": images_folder,
+        "num_images": len(image_paths),
+        "repetitions": repetitions,
+        "min_rank_correlation": min_rank_correlation,
+    }
+    report = {"config": config, "results": results}
+    print(json.dumps(report, indent=2))
+
+    if output_file is not None:
+        Path(output_file).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    fire.Fire(run_benchmark)
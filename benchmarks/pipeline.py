@@ -0,0 +1,210 @@
+"""End-to-end benchmark of the client/server pipeline with a fake model.
+
+The benchmark needs neither network access nor a GPU: it generates a synthetic JPEG
+corpus, starts the server with a deterministic fake model (in-process or as a
+subprocess) and rates the corpus with each of the clients. Results are printed and
+optionally written as JSON, e.g.
+
+    python -m benchmarks.pipeline --num_images=500 --output_file=bench.json
+"""
+
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence
+
+import fire
+import grpc
+import numpy as np
+
+from imageassessmentservice.aio_client import rate_images_concurrently
+from imageassessmentservice.client import rate_images
+from imageassessmentservice.messages import grpc_target
+from imageassessmentservice.stats import ClientStats
+
+
+def generate_corpus(
+    folder: Path, num_images: int, width: int, height: int, seed: int = 0
+) -> List[Path]:
+    """Write synthetic JPEG images with smooth gradients and noise to a folder."""
+    import tensorflow as tf
+
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 255, width)[np.newaxis, :, np.newaxis]
+    image_paths = []
+
+    for i in range(num_images):
+        noise = rng.normal(0, 20, (height, width, 3))
+        image = np.clip(gradient * rng.uniform(0.2, 1.0, 3) + noise, 0, 255)
+
+        image_path = folder / f"image_{i:06d}.jpg"
+        image_path.write_bytes(
+            tf.io.encode_jpeg(image.astype(np.uint8), quality=90).numpy()
+        )
+        image_paths.append(image_path)
+
+    return image_paths
+
+
+def start_server(
+    server_mode: str,
+    max_batch_size: int,
+    fake_fixed_cost_ms: float,
+    fake_per_image_cost_ms: float,
+    startup_timeout_s: float = 120.0,
+) -> Callable[[], None]:
+    """Start the server with the fake model and return a function that stops it."""
+    if server_mode == "inprocess":
+        from imageassessmentservice.models import FakeModel
+        from imageassessmentservice.server import ImageAssessmentService, create_server
+
+        service = ImageAssessmentService(
+            model=FakeModel(fake_fixed_cost_ms, fake_per_image_cost_ms),
+            max_batch_size=max_batch_size,
+        )
+        server = create_server(service)
+
+        def _stop() -> None:
+            server.stop(grace=None).wait()
+            service.scheduler.stop()
+
+        return _stop
+
+    if server_mode == "subprocess":
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "imageassessmentservice.server",
+                "--model=fake",
+                f"--max_batch_size={max_batch_size}",
+                f"--fake_fixed_cost_ms={fake_fixed_cost_ms}",
+                f"--fake_per_image_cost_ms={fake_per_image_cost_ms}",
+            ],
+            stdout=subprocess.DEVNULL,
+        )
+
+        with grpc.insecure_channel(grpc_target("localhost")) as channel:
+            grpc.channel_ready_future(channel).result(timeout=startup_timeout_s)
+
+        def _stop() -> None:
+            process.terminate()
+            process.wait()
+
+        return _stop
+
+    raise ValueError(f"Unknown server mode {server_mode}.")
+
+
+def _peak_rss_mb(who: int) -> float:
+    # ru_maxrss is given in kB on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def run_benchmark(
+    num_images: int = 200,
+    width: int = 1024,
+    height: int = 768,
+    clients: Sequence[str] = ("stream", "asyncio"),
+    server_mode: str = "inprocess",
+    max_in_flight: int = 16,
+    max_batch_size: int = 8,
+    fake_fixed_cost_ms: float = 20.0,
+    fake_per_image_cost_ms: float = 5.0,
+    output_file: Optional[str] = None,
+) -> None:
+    """Rate a synthetic corpus with each client and report throughput and latency.
+
+    Parameters
+    ----------
+    num_images
+        Number of images in the synthetic corpus
+    width
+        Width of the images in pixels
+    height
+        Height of the images in pixels
+    clients
+        Clients to benchmark, "stream" (rate_images) and/or "asyncio"
+    server_mode
+        Run the server "inprocess" or as a "subprocess"
+    max_in_flight
+        Maximum number of images in flight for each client
+    max_batch_size
+        Maximum batch size of the server
+    fake_fixed_cost_ms
+        Time the fake model spends on each batch
+    fake_per_image_cost_ms
+        Additional time the fake model spends on each image of a batch
+    output_file
+        JSON file to which the configuration and the results are written
+    """
+    if isinstance(clients, str):
+        clients = clients.split(",")
+
+    config = {
+        "num_images": num_images,
+        "width": width,
+        "height": height,
+        "server_mode": server_mode,
+        "max_in_flight": max_in_flight,
+        "max_batch_size": max_batch_size,
+        "fake_fixed_cost_ms": fake_fixed_cost_ms,
+        "fake_per_image_cost_ms": fake_per_image_cost_ms,
+    }
+    results = []
+
+    with tempfile.TemporaryDirectory() as corpus_folder:
+        image_paths = generate_corpus(Path(corpus_folder), num_images, width, height)
+        stop_server = start_server(
+            server_mode, max_batch_size, fake_fixed_cost_ms, fake_per_image_cost_ms
+        )
+
+        try:
+            for client in clients:
+                stats = ClientStats()
+                start = time.perf_counter()
+
+                if client == "stream":
+                    _, images_with_issues = rate_images(
+                        image_paths, "localhost", max_in_flight, stats=stats
+                    )
+                elif client == "asyncio":
+                    _, images_with_issues = rate_images_concurrently(
+                        image_paths,
+                        "localhost",
+                        concurrency=max_in_flight,
+                        stats=stats,
+                    )
+                else:
+                    raise ValueError(f"Unknown client {client}.")
+
+                results.append(
+                    {
+                        "client": client,
+                        "wall_time_s": time.perf_counter() - start,
+                        "num_failed": len(images_with_issues),
+                        **stats.summary(),
+                        "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+                    }
+                )
+        finally:
+            stop_server()
+
+    if server_mode == "subprocess":
+        for result in results:
+            # Only known for the whole run once the server process has exited
+            result["server_peak_rss_mb"] = _peak_rss_mb(resource.RUSAGE_CHILDREN)
+
+    report = {"config": config, "results": results}
+    print(json.dumps(report, indent=2))
+
+    if output_file is not None:
+        Path(output_file).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    fire.Fire(run_benchmark)
@@ -0,0 +1,152 @@
+"""Benchmark of the client-side preprocessing of images.
+
+A sample of images is preprocessed as with `--preprocess` of the client. The bytes to
+send and the time the server spends decoding the images are compared with those of the
+original images, and with `--model_dir`, also the ratings of the MUSIQ models, e.g.
+
+    python -m benchmarks.preprocessing --images_folder=/path/to/photos --max_size=1024
+"""
+
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import fire
+import tensorflow as tf
+
+from benchmarks.engines import accuracy_drift
+from benchmarks.pipeline import generate_corpus
+from imageassessmentservice.preprocessing import Preprocessor
+from imageassessmentservice.scanner import scan_files
+from imageassessmentservice.server import MusiqModel, warm_up
+
+
+def measure_decode_s(images: List[bytes]) -> float:
+    """Time to decode the images as the MUSIQ models do, in seconds."""
+    start = time.perf_counter()
+
+    for image in images:
+        tf.io.decode_jpeg(image, channels=3)
+
+    return time.perf_counter() - start
+
+
+def measure_assessment(model: Any, images: List[bytes]) -> Dict[str, Any]:
+    start = time.perf_counter()
+    assessments = model.assess_batch(images)
+
+    return {
+        "assess_s": time.perf_counter() - start,
+        "ratings": [assessment._asdict() for assessment in assessments],
+    }
+
+
+def run_benchmark(
+    images_folder: Optional[str] = None,
+    num_images: int = 16,
+    width: int = 4000,
+    height: int = 3000,
+    max_size: int = 1024,
+    quality: int = 90,
+    workers: Optional[int] = None,
+    model_dir: Optional[str] = None,
+    min_rank_correlation: float = 0.95,
+    output_file: Optional[str] = None,
+) -> None:
+    """Measure the savings of preprocessing and the drift of the ratings.
+
+    Parameters
+    ----------
+    images_folder
+        Folder with JPEGs to preprocess, synthetic images are used if None. Photos give
+        a more meaningful drift of the ratings than synthetic images.
+    num_images
+        Number of images in the sample
+    width
+        Width of the synthetic images in pixels
+    height
+        Height of the synthetic images in pixels
+    max_size
+        Maximum length of the longer side of preprocessed images in pixels
+    quality
+        JPEG quality of preprocessed images
+    workers
+        Number of preprocessing processes, the number of CPUs if None
+    model_dir
+        Directory with the MUSIQ SavedModels in the sub-directories "ava" and
+        "paq2piq" (see `--model_dir` of the server). If given, the original and the
+        preprocessed images are rated, and the drift of the ratings is reported.
+    min_rank_correlation
+        Minimum rank correlation of the ratings of the preprocessed images with those of
+        the originals to be considered within tolerance
+    output_file
+        JSON file to which the configuration and the results are written
+    """
+    with tempfile.TemporaryDirectory() as corpus_folder:
+        if images_folder is not None:
+            image_paths = sorted(
+                scanned_file.path
+                for scanned_file in scan_files(Path(images_folder))
+                if scanned_file.is_image
+            )[:num_images]
+        else:
+            image_paths = generate_corpus(
+                Path(corpus_folder), num_images, width, height
+            )
+
+        originals = [image_path.read_bytes() for image_path in image_paths]
+
+        start = time.perf_counter()
+
+        with Preprocessor(max_size, quality, workers) as preprocessor:
+            preprocessed = [
+                preprocessor.load(image_path)
+                for image_path in preprocessor.prefetch(image_paths)
+            ]
+            summary = preprocessor.summary()
+
+        preprocessing_wall_s = time.perf_counter() - start
+
+    result: Dict[str, Any] = {
+        **summary,
+        "preprocessing_wall_s": preprocessing_wall_s,
+        "original_decode_s": measure_decode_s(originals),
+        "preprocessed_decode_s": measure_decode_s(preprocessed),
+    }
+
+    if model_dir is not None:
+        model = MusiqModel.from_tf_hub(model_dir=model_dir)
+        warm_up(model)
+
+        original_assessment = measure_assessment(model, originals)
+        preprocessed_assessment = measure_assessment(model, preprocessed)
+
+        result["original_assess_s"] = original_assessment["assess_s"]
+        result["preprocessed_assess_s"] = preprocessed_assessment["assess_s"]
+        result["drift"] = accuracy_drift(
+            original_assessment["ratings"], preprocessed_assessment["ratings"]
+        )
+        result["within_tolerance"] = all(
+            head_drift["rank_correlation"] >= min_rank_correlation
+            for head_drift in result["drift"].values()
+        )
+
+    config = {
+        "images_folder": images_folder,
+        "num_images": len(image_paths),
+        "max_size": max_size,
+        "quality": quality,
+        "model_dir": model_dir,
+        "min_rank_correlation": min_rank_correlation,
+    }
+    report = {"config": config, "result": result}
+    print(json.dumps(report, indent=2))
+
+    if output_file is not None:
+        Path(output_file).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    fire.Fire(run_benchmark)
@@ -0,0 +1,102 @@
+"""Benchmark of the import time and memory of the client-side modules.
+
+Each module is imported in a fresh interpreter, so that the measurements include all
+dependencies of the module, as on a machine that only runs the client, e.g.
+
+    python -m benchmarks.startup --repetitions=5
+"""
+
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence
+
+import fire
+
+# Runs in the fresh interpreter and reports the cost of importing the module
+_MEASURE_IMPORT = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+import_s = time.perf_counter() - start
+print(json.dumps({{
+    "import_s": import_s,
+    # ru_maxrss is given in kB on Linux
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "imports_tensorflow": "tensorflow" in sys.modules,
+}}))
+"""
+
+
+def measure_startup(module: str) -> Dict[str, Any]:
+    """Import a module in a fresh interpreter and measure time and memory."""
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-c", _MEASURE_IMPORT.format(module=module)],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    startup_s = time.perf_counter() - start
+
+    # Only the last line is the report, libraries may print to stdout when imported
+    return {
+        "module": module,
+        "startup_s": startup_s,
+        **json.loads(completed.stdout.strip().splitlines()[-1]),
+    }
+
+
+def run_benchmark(
+    modules: Sequence[str] = (
+        "imageassessmentservice.client",
+        "imageassessmentservice.process",
+    ),
+    repetitions: int = 3,
+    output_file: Optional[str] = None,
+) -> None:
+    """Measure the startup of client-side modules and print the results as JSON.
+
+    Parameters
+    ----------
+    modules
+        Modules to import (comma-separated on the command line)
+    repetitions
+        Number of fresh interpreters per module, the median is reported
+    output_file
+        File to which the results are written as JSON
+    """
+    if isinstance(modules, str):
+        modules = modules.split(",")
+
+    results = []
+
+    for module in modules:
+        measurements = [measure_startup(module) for _ in range(repetitions)]
+        results.append(
+            {
+                "module": module,
+                **{
+                    key: statistics.median(
+                        measurement[key] for measurement in measurements
+                    )
+                    for key in ("startup_s", "import_s", "peak_rss_mb")
+                },
+                "imports_tensorflow": any(
+                    measurement["imports_tensorflow"] for measurement in measurements
+                ),
+            }
+        )
+
+    report = {"repetitions": repetitions, "results": results}
+    print(json.dumps(report, indent=2))
+
+    if output_file is not None:
+        Path(output_file).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    fire.Fire(run_benchmark)
@@ -0,0 +1,346 @@
+import asyncio
+import functools
+import random
+from pathlib import Path
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Sized,
+    Tuple,
+    Union,
+)
+
+import grpc
+import pandas as pd
+from tqdm import tqdm
+
+from imageassessmentservice.balancer import Endpoint, LoadBalancer
+from imageassessmentservice.definitions import (
+    ASSESSMENT_HEADS,
+    MAX_GRPC_MESSAGE_SIZE_MB,
+    RETRY_PUSHBACK_METADATA_KEY,
+)
+from imageassessmentservice.imageassessment_pb2 import (
+    ImageAssessmentRequest,
+    ImageAssessmentResponse,
+    ImageChunk,
+)
+from imageassessmentservice.imageassessment_pb2_grpc import ImageAssessmentStub
+from imageassessmentservice.messages import (
+    build_request,
+    grpc_target,
+    iter_image_chunks,
+    rating_from_response,
+)
+from imageassessmentservice.stats import ClientStats
+
+RETRYABLE_STATUS_CODES = {grpc.StatusCode.UNAVAILABLE}
+
+# Errors after which the endpoint is ejected and the request is sent to another
+# endpoint, if there is one
+FAILOVER_STATUS_CODES = {grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED}
+
+
+def _retry_pushback_s(error: grpc.aio.AioRpcError) -> Optional[float]:
+    """Time after which an overloaded server asks to retry the request, if it does."""
+    for key, value in error.trailing_metadata() or ():
+        if key == RETRY_PUSHBACK_METADATA_KEY:
+            return int(value) / 1000
+
+    return None
+
+
+async def _read_file(
+    image_path: Path, image_loader: Callable[[Path], bytes] = Path.read_bytes
+) -> bytes:
+    # Reading happens on the default thread pool, so the event loop keeps sending
+    # requests while files are read
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, image_loader, image_path)
+
+
+async def _upload_chunks(chunks: Iterator[ImageChunk]) -> AsyncIterator[ImageChunk]:
+    # Chunks are read on the default thread pool, like whole files
+    loop = asyncio.get_running_loop()
+
+    while True:
+        chunk = await loop.run_in_executor(None, next, chunks, None)
+
+        if chunk is None:
+            return
+
+        yield chunk
+
+
+def _assess_call(
+    image_path: Path,
+    request: Optional[ImageAssessmentRequest],
+    heads: Sequence[str],
+    request_id: str,
+    chunk_size: int,
+    timeout_s: float,
+    priority: str,
+) -> Callable[[ImageAssessmentStub], Awaitable[ImageAssessmentResponse]]:
+    """Build a function that sends the request, or uploads the image in chunks if the
+    request is None."""
+
+    async def _assess(client: ImageAssessmentStub) -> ImageAssessmentResponse:
+        if request is not None:
+            return await client.Assess(request, timeout=timeout_s)
+
+        # The file is opened for each attempt, as the chunks can only be sent once
+        loop = asyncio.get_running_loop()
+        chunks = await loop.run_in_executor(
+            None,
+            functools.partial(
+                iter_image_chunks, image_path, heads, request_id, chunk_size, priority
+            ),
+        )
+
+        # The file is closed once the chunks are exhausted or garbage collected, also
+        # if the upload fails while a chunk is being read
+        return await client.AssessUpload(_upload_chunks(chunks), timeout=timeout_s)
+
+    return _assess
+
+
+async def _assess_with_retries(
+    load_balancer: LoadBalancer,
+    clients: Dict[str, ImageAssessmentStub],
+    assess: Callable[[ImageAssessmentStub], Awaitable[ImageAssessmentResponse]],
+    request_id: str,
+    num_bytes: int,
+    max_retries: int,
+    initial_backoff_s: float,
+) -> Any:
+    backoff_s = initial_backoff_s
+    tried_endpoints: List[Endpoint] = []
+
+    for attempt in range(max_retries + 1):
+        endpoint = load_balancer.pick(exclude=tried_endpoints)
+        tried_endpoints.append(endpoint)
+        load_balancer.request_started(endpoint, request_id, num_bytes)
+
+        try:
+            response = await assess(clients[endpoint.target])
+        except grpc.aio.AioRpcError as e:
+            load_balancer.request_failed(
+                endpoint, request_id, eject=e.code() in FAILOVER_STATUS_CODES
+            )
+            can_fail_over = (
+                e.code() in FAILOVER_STATUS_CODES and load_balancer.healthy_endpoints()
+            )
+            # Only overloaded servers send a retry hint, other errors with the same
+            # code (e.g. an image that is too large) are permanent
+            pushback_s = _retry_pushback_s(e)
+
+            if attempt == max_retries or not (
+                e.code() in RETRYABLE_STATUS_CODES
+                or can_fail_over
+                or pushback_s is not None
+            ):
+                raise
+
+            if pushback_s is not None:
+                await asyncio.sleep(pushback_s * random.uniform(1.0, 1.5))
+            elif not can_fail_over:
+                # Exponential backoff with jitter, so that clients do not retry in
+                # lockstep
+                await asyncio.sleep(backoff_s * random.uniform(0.5, 1.5))
+                backoff_s *= 2
+
+            continue
+        except BaseException:
+            load_balancer.request_failed(endpoint, request_id, eject=False)
+            raise
+
+        load_balancer.request_succeeded(endpoint, request_id, response.ByteSize())
+
+        return response
+
+
+async def rate_images_async(
+    image_paths: Iterable[Path],
+    address: Union[str, Sequence[str]],
+    concurrency: int = 16,
+    timeout_s: float = 60.0,
+    max_retries: int = 3,
+    initial_backoff_s: float = 0.5,
+    rating_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+    heads: Sequence[str] = ASSESSMENT_HEADS,
+    stats: Optional[ClientStats] = None,
+    load_balancing: str = "least_outstanding",
+    load_balancer: Optional[LoadBalancer] = None,
+    upload_chunk_kb: int = 0,
+    priority: str = "bulk",
+    image_loader: Callable[[Path], bytes] = Path.read_bytes,
+) -> Tuple[pd.DataFrame, List[Path]]:
+    """Obtain ratings for images with concurrent requests to the assessment service.
+
+    Requests can be spread over several servers. Servers that are unavailable or do not
+    respond within the deadline are ejected for a while and their requests are sent to
+    another server.
+
+    Parameters
+    ----------
+    image_paths
+        Paths to the images to rate
+    address
+        Host where the image assessment service is running, optionally followed by
+        ":port" (port 50051 otherwise), or a list of such hosts
+    concurrency
+        Maximum number of images that are read or rated at the same time
+    timeout_s
+        Deadline for each request in seconds
+    max_retries
+        Number of retries for requests failing with a transient error (UNAVAILABLE),
+        rejected by an overloaded server, or failing with a timeout if there are
+        further servers
+    initial_backoff_s
+        Waiting time before the first retry in seconds, doubled for each further retry
+    rating_callback
+        Function that is called with each rating as soon as it has been received
+    heads
+        Heads to run for each image, the dataframe contains one column per head
+    stats
+        Collects latencies and transferred bytes of the requests, including retries
+    load_balancing
+        Policy for spreading requests over several servers, "least_outstanding" or
+        "power_of_two"
+    load_balancer
+        Load balancer to use instead of creating one for `address` with the given
+        policy, e.g. to inspect the statistics of each server after the run
+    upload_chunk_kb
+        Upload images in chunks of this size in kB instead of sending each image in a
+        single message, which is limited in size. Disabled if 0.
+    priority
+        "bulk" or "interactive", queued interactive requests are assessed before bulk
+        requests
+    image_loader
+        Function that returns the bytes to send for an image, e.g. of a `Preprocessor`.
+        Not used for uploads in chunks, which are read from the files.
+
+    Returns
+    -------
+    Dataframe with ratings and list of images that could not be rated
+    """
+    if concurrency < 1:
+        raise ValueError("Expect concurrency to be at least 1.")
+
+    options = [
+        (
+            "grpc.max_send_message_length",
+            MAX_GRPC_MESSAGE_SIZE_MB * 1024**2,
+        ),  # Maximum message size in bytes
+    ]
+
+    if load_balancer is None:
+        addresses = [address] if isinstance(address, str) else list(address)
+        load_balancer = LoadBalancer(
+            [grpc_target(host) for host in addresses], load_balancing
+        )
+
+    ratings: List[Dict[str, Any]] = []
+    images_with_issues: List[Path] = []
+
+    channels = {
+        endpoint.target: grpc.aio.insecure_channel(endpoint.target, options=options)
+        for endpoint in load_balancer.endpoints
+    }
+
+    try:
+        clients = {
+            target: ImageAssessmentStub(channel) for target, channel in channels.items()
+        }
+        remaining_paths: Iterator[Path] = iter(image_paths)
+        progress_bar = tqdm(
+            total=len(image_paths) if isinstance(image_paths, Sized) else None
+        )
+
+        async def _worker() -> None:
+            # Workers pull from a shared iterator, so at most `concurrency` images are
+            # in memory at once, regardless of the number of images
+            for image_path in remaining_paths:
+                request_id = str(image_path)
+
+                try:
+                    if upload_chunk_kb > 0:
+                        request = None
+                        num_bytes = image_path.stat().st_size
+                    else:
+                        image_bytes = await _read_file(image_path, image_loader)
+                        request = build_request(
+                            str(image_path), image_bytes, heads, request_id, priority
+                        )
+                        num_bytes = request.ByteSize()
+
+                    if stats is not None:
+                        stats.request_sent(request_id, num_bytes)
+
+                    response = await _assess_with_retries(
+                        load_balancer,
+                        clients,
+                        _assess_call(
+                            image_path,
+                            request,
+                            heads,
+                            request_id,
+                            upload_chunk_kb * 1024,
+                            timeout_s,
+                            priority,
+                        ),
+                        request_id,
+                        num_bytes,
+                        max_retries,
+                        initial_backoff_s,
+                    )
+
+                    if stats is not None:
+                        stats.response_received(request_id, response.ByteSize())
+
+                    rating = rating_from_response(response, heads)
+                    ratings.append(rating)
+                except Exception:
+                    print(f"Cannot rate image {image_path}.")
+                    images_with_issues.append(image_path)
+                else:
+                    if rating_callback is not None:
+                        rating_callback(rating)
+
+                progress_bar.update()
+
+        print("Obtaining ratings")
+
+        with progress_bar:
+            await asyncio.gather(*(_worker() for _ in range(concurrency)))
+    finally:
+        for channel in channels.values():
+            await channel.close()
+
+    if len(load_balancer.endpoints) > 1:
+        for target, summary in load_balancer.summary().items():
+            p50_latency_ms = summary["latency_ms"]["p50"]
+            print(
+                f"Server {target}: {summary['num_responses']} images, "
+                f"{summary['images_per_s']:.1f} images/s, p50 latency "
+                f"{'-' if p50_latency_ms is None else f'{p50_latency_ms:.0f}'} ms, "
+                f"{summary['num_failures']} failures, "
+                f"{summary['num_ejections']} ejections"
+            )
+
+    return pd.DataFrame(ratings), images_with_issues
+
+
+def rate_images_concurrently(
+    image_paths: Iterable[Path], address: Union[str, Sequence[str]], **kwargs: Any
+) -> Tuple[pd.DataFrame, List[Path]]:
+    """Synchronous wrapper around `rate_images_async`."""
+    return asyncio.run(rate_images_async(image_paths, address, **kwargs))
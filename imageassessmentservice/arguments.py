@@ -0,0 +1,9 @@
+from typing import Sequence, Tuple, Union
+
+
+def as_tuple(values: Union[str, Sequence[str]]) -> Tuple[str, ...]:
+    """Split comma-separated command line values."""
+    if isinstance(values, str):
+        return tuple(value for value in values.split(",") if value)
+
+    return tuple(values)
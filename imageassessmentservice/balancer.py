@@ -0,0 +1,204 @@
+import random
+import statistics
+import time
+from typing import Any, Callable, Collection, Dict, List, Optional, Sequence
+
+from imageassessmentservice.stats import ClientStats
+
+LOAD_BALANCING_POLICIES = ("least_outstanding", "power_of_two")
+
+
+class Endpoint:
+    """State of a server endpoint as seen by the load balancer."""
+
+    def __init__(self, target: str):
+        self.target = target
+        self.outstanding = 0
+        self.ejected_until = 0.0
+        self.consecutive_failures = 0
+        self.num_failures = 0
+        self.num_ejections = 0
+
+        # Smoothed latency of the recent requests, for detecting slow endpoints
+        self.start_times: Dict[str, float] = {}
+        self.latency_ewma_s: Optional[float] = None
+        self.num_latency_samples = 0
+
+        self.stats = ClientStats()
+
+
+class LoadBalancer:
+    """Spread requests over several endpoints of the image assessment service.
+
+    Endpoints that fail with a transient error, or whose latency is much higher than
+    that of the other endpoints, are ejected for a while. Repeated failures double the
+    ejection time. If all endpoints are ejected, the endpoint that returns first is
+    used anyway.
+
+    The load balancer is not thread-safe, it is meant to be used from a single event
+    loop.
+
+    Parameters
+    ----------
+    targets
+        Endpoints in the form "host:port"
+    policy
+        "least_outstanding" sends each request to the endpoint with the fewest
+        outstanding requests, "power_of_two" to the less loaded of two random endpoints
+    ejection_s
+        Time for which an endpoint is ejected after a failure
+    max_ejection_s
+        Upper bound of the ejection time after repeated failures
+    slow_factor
+        Endpoints whose smoothed latency exceeds the median of the other endpoints by
+        this factor are ejected
+    min_latency_samples
+        Number of responses from an endpoint before it can be ejected for being slow
+    rng
+        Random number generator used to break ties and to sample endpoints
+    clock
+        Function returning the current time in seconds
+    """
+
+    def __init__(
+        self,
+        targets: Sequence[str],
+        policy: str = "least_outstanding",
+        ejection_s: float = 10.0,
+        max_ejection_s: float = 120.0,
+        slow_factor: float = 3.0,
+        min_latency_samples: int = 10,
+        rng: Optional[random.Random] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if not targets:
+            raise ValueError("Expect at least one target.")
+
+        if policy not in LOAD_BALANCING_POLICIES:
+            raise ValueError(f"Expect policy to be one of {LOAD_BALANCING_POLICIES}.")
+
+        self.endpoints = [Endpoint(target) for target in dict.fromkeys(targets)]
+        self.policy = policy
+        self.ejection_s = ejection_s
+        self.max_ejection_s = max_ejection_s
+        self.slow_factor = slow_factor
+        self.min_latency_samples = min_latency_samples
+        self._rng = rng if rng is not None else random.Random()
+        self._clock = clock
+
+    def healthy_endpoints(self) -> List[Endpoint]:
+        now = self._clock()
+        return [
+            endpoint for endpoint in self.endpoints if endpoint.ejected_until <= now
+        ]
+
+    def pick(self, exclude: Collection[Endpoint] = ()) -> Endpoint:
+        """Select the endpoint for the next request.
+
+        Parameters
+        ----------
+        exclude
+            Endpoints to avoid, e.g. those that already failed for the request. They
+            are only used if no other endpoint is healthy.
+
+        Returns
+        -------
+        Selected endpoint
+        """
+        healthy_endpoints = self.healthy_endpoints()
+        candidates = [
+            endpoint for endpoint in healthy_endpoints if endpoint not in exclude
+        ] or healthy_endpoints
+
+        if not candidates:
+            return min(self.endpoints, key=lambda endpoint: endpoint.ejected_until)
+
+        if self.policy == "power_of_two" and len(candidates) > 2:
+            candidates = self._rng.sample(candidates, 2)
+
+        return min(
+            candidates,
+            key=lambda endpoint: (
+                endpoint.outstanding,
+                endpoint.latency_ewma_s or 0.0,
+                self._rng.random(),
+            ),
+        )
+
+    def request_started(self, endpoint: Endpoint, key: str, num_bytes: int) -> None:
+        endpoint.outstanding += 1
+        endpoint.start_times[key] = self._clock()
+        endpoint.stats.request_sent(key, num_bytes)
+
+    def request_succeeded(self, endpoint: Endpoint, key: str, num_bytes: int) -> None:
+        endpoint.outstanding -= 1
+        endpoint.consecutive_failures = 0
+        endpoint.stats.response_received(key, num_bytes)
+
+        latency_s = self._clock() - endpoint.start_times.pop(key)
+        endpoint.latency_ewma_s = (
+            latency_s
+            if endpoint.latency_ewma_s is None
+            else 0.8 * endpoint.latency_ewma_s + 0.2 * latency_s
+        )
+        endpoint.num_latency_samples += 1
+
+        if self._is_slow(endpoint):
+            # The latency is measured anew once the endpoint returns
+            endpoint.latency_ewma_s = None
+            endpoint.num_latency_samples = 0
+            self._eject(endpoint, self.ejection_s)
+
+    def request_failed(self, endpoint: Endpoint, key: str, eject: bool) -> None:
+        """Record a failed request and eject the endpoint if the error is transient."""
+        endpoint.outstanding -= 1
+        endpoint.start_times.pop(key, None)
+        endpoint.num_failures += 1
+
+        if eject:
+            endpoint.consecutive_failures += 1
+            self._eject(
+                endpoint,
+                min(
+                    self.ejection_s * 2 ** (endpoint.consecutive_failures - 1),
+                    self.max_ejection_s,
+                ),
+            )
+
+    def _is_slow(self, endpoint: Endpoint) -> bool:
+        if (
+            endpoint.latency_ewma_s is None
+            or endpoint.num_latency_samples < self.min_latency_samples
+        ):
+            return False
+
+        other_latencies_s = [
+            other.latency_ewma_s
+            for other in self.healthy_endpoints()
+            if other is not endpoint
+            and other.latency_ewma_s is not None
+            and other.num_latency_samples >= self.min_latency_samples
+        ]
+
+        # The last healthy endpoint is never ejected for being slow
+        if not other_latencies_s:
+            return False
+
+        return endpoint.latency_ewma_s > self.slow_factor * statistics.median(
+            other_latencies_s
+        )
+
+    def _eject(self, endpoint: Endpoint, duration_s: float) -> None:
+        endpoint.ejected_until = self._clock() + duration_s
+        endpoint.num_ejections += 1
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Throughput, latency, failures and ejections per endpoint."""
+        return {
+            endpoint.target: {
+                **endpoint.stats.summary(),
+                "num_failures": endpoint.num_failures,
+                "num_ejections": endpoint.num_ejections,
+            }
+            for endpoint in self.endpoints
+        }
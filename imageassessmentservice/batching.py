@@ -0,0 +1,346 @@
+import itertools
+import math
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from imageassessmentservice.models import Assessment, AssessmentModel
+
+
+class _Job(NamedTuple):
+    image_bytes: bytes
+    heads: Tuple[str, ...]
+    future: "Future[Assessment]"
+    deadline: Optional[float]
+    # Bytes the job holds in the budget of pending requests
+    num_bytes: int
+
+
+_STOP = object()
+
+# Lower bound of the retry-after hint, so that rejected clients do not retry right away
+# while the throughput of the model is not known yet
+_MIN_RETRY_AFTER_S = 0.1
+
+
+class QueueFullError(RuntimeError):
+    """The scheduler cannot accept further requests at the moment."""
+
+    def __init__(self, message: str, retry_after_s: float):
+        super().__init__(message)
+        self.retry_after_s = retry_after_s
+
+
+class DeadlineExpiredError(TimeoutError):
+    """The deadline of a request passed before it was passed to the model."""
+
+
+class BatchScheduler:
+    """Group concurrent assessment requests into batches for the model.
+
+    Requests are queued in arrival order. A background thread takes the oldest request
+    and then keeps collecting requests until either `max_batch_size` requests are
+    gathered or `max_batch_wait_ms` have passed since the oldest request was taken. The
+    batch is passed to the model and the results are routed back to the callers. The
+    model runs the union of the heads requested within a batch, and each caller only
+    receives the heads it requested.
+
+    Requests with a higher priority are taken before requests with a lower priority,
+    requests of the same priority in arrival order. The number and total size of the
+    pending requests (queued or in the running batch) can be bounded, in which case
+    further requests are rejected with a `QueueFullError` until there is room again.
+    Requests whose deadline passes while they are queued are failed with a
+    `DeadlineExpiredError` instead of being passed to the model.
+
+    Room for a request can be reserved with `admit` before its image is at hand, e.g.
+    while it is uploaded, and is then held by the submitted request.
+    """
+
+    def __init__(
+        self,
+        model: AssessmentModel,
+        max_batch_size: int = 8,
+        max_batch_wait_ms: float = 5.0,
+        max_pending_requests: int = 0,
+        max_pending_mb: float = 0.0,
+    ):
+        if max_batch_size < 1:
+            raise ValueError("Expect max_batch_size to be at least 1.")
+
+        if max_batch_wait_ms < 0:
+            raise ValueError("Expect max_batch_wait_ms to be non-negative.")
+
+        if max_pending_requests < 0 or max_pending_mb < 0:
+            raise ValueError(
+                "Expect the limits of pending requests to be non-negative."
+            )
+
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait_s = max_batch_wait_ms / 1000
+        # Limits of 0 disable the bound
+        self.max_pending_requests = max_pending_requests
+        self.max_pending_bytes = int(max_pending_mb * 1024**2)
+
+        # Items are (negated priority, sequence number, job), the sequence number keeps
+        # the arrival order within a priority and avoids comparing jobs
+        self._queue: "queue.PriorityQueue[Tuple[float, int, Any]]" = (
+            queue.PriorityQueue()
+        )
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._num_pending = 0
+        self._pending_bytes = 0
+        self._num_rejected = 0
+        self._num_expired = 0
+        # Smoothed time the model needs per image, for estimating when a full queue
+        # has room again
+        self._image_time_ewma_s = 0.0
+        self._stopped = False
+        self._worker = threading.Thread(
+            target=self._run, name="BatchScheduler", daemon=True
+        )
+        self._worker.start()
+
+    def submit(
+        self,
+        image_bytes: bytes,
+        heads: Optional[Sequence[str]] = None,
+        priority: int = 0,
+        deadline: Optional[float] = None,
+        admitted_bytes: Optional[int] = None,
+    ) -> "Future[Assessment]":
+        """Queue an encoded image for assessment.
+
+        Parameters
+        ----------
+        image_bytes
+            Encoded image
+        heads
+            Heads to run for the image, all heads of the model if None
+        priority
+            Requests with a higher priority overtake queued requests with a lower one
+        deadline
+            Time (as given by `time.monotonic`) after which the assessment is of no use
+        admitted_bytes
+            Bytes reserved for the request with `admit`, which it holds instead of the
+            size of the image. The image is admitted here if None.
+
+        Returns
+        -------
+        Future that resolves to the assessment of the image
+        """
+        if self._stopped:
+            raise RuntimeError("Batch scheduler has been stopped.")
+
+        resolved_heads = self.resolve_heads(heads)
+        admitted_here = admitted_bytes is None
+
+        if admitted_bytes is None:
+            admitted_bytes = len(image_bytes)
+            self.admit(admitted_bytes)
+
+        job = _Job(image_bytes, resolved_heads, Future(), deadline, admitted_bytes)
+
+        # Jobs are only queued before the stop sentinel, so that they are not left in
+        # the queue once the background thread has finished
+        with self._lock:
+            if not self._stopped:
+                self._queue.put((-priority, next(self._sequence), job))
+                return job.future
+
+        if admitted_here:
+            self.release(admitted_bytes)
+
+        raise RuntimeError("Batch scheduler has been stopped.")
+
+    def admit(self, num_bytes: int) -> None:
+        """Reserve room for a request of `num_bytes` bytes among the pending requests.
+
+        The reservation is passed on to `submit` or returned with `release`.
+
+        Raises
+        ------
+        QueueFullError
+            If the limits of pending requests are reached
+        """
+        with self._lock:
+            # A single image larger than the byte limit is accepted if nothing else is
+            # pending, otherwise it could never be assessed
+            if (
+                self.max_pending_requests
+                and self._num_pending >= self.max_pending_requests
+            ) or (
+                self.max_pending_bytes
+                and self._num_pending > 0
+                and self._pending_bytes + num_bytes > self.max_pending_bytes
+            ):
+                self._num_rejected += 1
+                raise QueueFullError(
+                    f"{self._num_pending} requests with {self._pending_bytes} bytes "
+                    "are pending.",
+                    max(
+                        self._num_pending * self._image_time_ewma_s, _MIN_RETRY_AFTER_S
+                    ),
+                )
+
+            self._num_pending += 1
+            self._pending_bytes += num_bytes
+
+    def release(self, num_bytes: int) -> None:
+        """Return a reservation of `admit` that is not submitted."""
+        with self._lock:
+            self._num_pending -= 1
+            self._pending_bytes -= num_bytes
+
+    def resolve_heads(self, heads: Optional[Sequence[str]]) -> Tuple[str, ...]:
+        """Check that the model provides the given heads, defaulting to all heads."""
+        if heads is None:
+            return tuple(self.model.heads)
+
+        unknown_heads = set(heads) - set(self.model.heads)
+
+        if unknown_heads:
+            raise ValueError(
+                f"Model does not provide the heads {sorted(unknown_heads)}."
+            )
+
+        return tuple(heads)
+
+    def assess(
+        self,
+        image_bytes: bytes,
+        heads: Optional[Sequence[str]] = None,
+        timeout: Optional[float] = None,
+    ) -> Assessment:
+        """Assess an encoded image and block until the result is available."""
+        return self.submit(image_bytes, heads).result(timeout=timeout)
+
+    def stats(self) -> Dict[str, int]:
+        """Number of pending, rejected and expired requests."""
+        with self._lock:
+            return {
+                "pending": self._num_pending,
+                "pending_bytes": self._pending_bytes,
+                "rejected": self._num_rejected,
+                "expired": self._num_expired,
+            }
+
+    def stop(self) -> None:
+        """Finish the queued requests and stop the background thread."""
+        with self._lock:
+            if self._stopped:
+                return
+
+            self._stopped = True
+            self._put_stop()
+
+        self._worker.join()
+
+    def _put_stop(self) -> None:
+        # The sentinel sorts after all requests, which are finished first
+        self._queue.put((math.inf, next(self._sequence), _STOP))
+
+    def _release(self, jobs: Sequence[_Job]) -> None:
+        with self._lock:
+            self._num_pending -= len(jobs)
+            self._pending_bytes -= sum(job.num_bytes for job in jobs)
+
+    def _collect_batch(self, first_job: _Job) -> List[_Job]:
+        batch = [first_job]
+        deadline = time.monotonic() + self.max_batch_wait_s
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+
+            try:
+                *_, item = (
+                    self._queue.get(timeout=remaining)
+                    if remaining > 0
+                    else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+
+            if item is _STOP:
+                # Re-queue the sentinel so that the loop in _run terminates after this batch
+                self._put_stop()
+                break
+
+            batch.append(item)  # type: ignore[arg-type]
+
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            *_, item = self._queue.get()
+
+            if item is _STOP:
+                return
+
+            self._run_batch(self._collect_batch(item))
+
+    def _run_batch(self, collected: Sequence[_Job]) -> None:
+        now = time.monotonic()
+        batch = []
+        expired = []
+
+        for job in collected:
+            if not job.future.set_running_or_notify_cancel():
+                self._release([job])
+            elif job.deadline is not None and job.deadline <= now:
+                expired.append(job)
+            else:
+                batch.append(job)
+
+        if expired:
+            # Nobody waits for these results anymore
+            self._release(expired)
+
+            with self._lock:
+                self._num_expired += len(expired)
+
+            for job in expired:
+                job.future.set_exception(
+                    DeadlineExpiredError("Deadline passed before the assessment.")
+                )
+
+        if not batch:
+            return
+
+        batch_heads = [
+            head for head in self.model.heads if any(head in job.heads for job in batch)
+        ]
+
+        start = time.perf_counter()
+
+        try:
+            assessments = self.model.assess_batch(
+                [job.image_bytes for job in batch], batch_heads
+            )
+
+            if len(assessments) != len(batch):
+                raise RuntimeError(
+                    f"Model returned {len(assessments)} assessments for a batch of "
+                    f"{len(batch)} images."
+                )
+        except Exception as e:
+            # Callers may submit again as soon as their future resolves
+            self._release(batch)
+
+            for job in batch:
+                job.future.set_exception(e)
+            return
+
+        image_time_s = (time.perf_counter() - start) / len(batch)
+        self._image_time_ewma_s = (
+            image_time_s
+            if self._image_time_ewma_s == 0.0
+            else 0.8 * self._image_time_ewma_s + 0.2 * image_time_s
+        )
+        self._release(batch)
+
+        for job, assessment in zip(batch, assessments):
+            job.future.set_result(assessment.select(job.heads))
@@ -0,0 +1,145 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Union
+
+from imageassessmentservice.definitions import ASSESSMENT_HEADS
+from imageassessmentservice.models import Assessment
+
+
+def image_digest(image_bytes: bytes) -> str:
+    """Content digest of an encoded image."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class ResultCache:
+    """Cache of assessments keyed by the digest of the image and the model identity.
+
+    Assessments are kept in an in-memory LRU tier with at most `max_entries` entries.
+    If a database file is given, assessments are also stored in an SQLite database, which
+    survives restarts of the server and is consulted on misses of the in-memory tier.
+    Assessments of single heads are merged, so that an image assessed for one head and
+    later for the other head ends up with a complete entry.
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        max_entries: int = 10000,
+        database_file: Optional[Union[str, Path]] = None,
+    ):
+        if max_entries < 1:
+            raise ValueError("Expect max_entries to be at least 1.")
+
+        self.model_id = model_id
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: "OrderedDict[str, Assessment]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+        if database_file is not None:
+            # The connection is shared by the server threads and guarded by the lock
+            self._connection = sqlite3.connect(database_file, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL;")
+            self._connection.execute("PRAGMA synchronous=NORMAL;")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS Assessments (
+                    model_id TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    aesthetic REAL,
+                    technical REAL,
+                    PRIMARY KEY (model_id, digest)
+                );""")
+            self._connection.commit()
+
+    def get(
+        self, image_bytes: bytes, heads: Sequence[str] = ASSESSMENT_HEADS
+    ) -> Optional[Assessment]:
+        """Look up the assessment of an encoded image.
+
+        Parameters
+        ----------
+        image_bytes
+            Encoded image
+        heads
+            Heads that the assessment needs to contain
+
+        Returns
+        -------
+        Cached assessment or None if the image has not been assessed by this model for
+        all of the heads
+        """
+        digest = image_digest(image_bytes)
+
+        with self._lock:
+            assessment = self._lookup(digest)
+
+            if assessment is not None and assessment.has_heads(heads):
+                self.hits += 1
+                return assessment.select(heads)
+
+            self.misses += 1
+            return None
+
+    def put(self, image_bytes: bytes, assessment: Assessment) -> None:
+        """Store the assessment of an encoded image."""
+        digest = image_digest(image_bytes)
+
+        with self._lock:
+            cached_assessment = self._lookup(digest)
+
+            if cached_assessment is not None:
+                assessment = cached_assessment.merge(assessment)
+
+            self._insert(digest, assessment)
+
+            if self._connection is not None:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO Assessments VALUES (?, ?, ?, ?);",
+                    (self.model_id, digest, assessment.aesthetic, assessment.technical),
+                )
+                self._connection.commit()
+
+    def _lookup(self, digest: str) -> Optional[Assessment]:
+        assessment = self._entries.get(digest)
+
+        if assessment is not None:
+            self._entries.move_to_end(digest)
+        elif self._connection is not None:
+            row = self._connection.execute(
+                "SELECT aesthetic, technical FROM Assessments "
+                "WHERE model_id = ? AND digest = ?;",
+                (self.model_id, digest),
+            ).fetchone()
+
+            if row is not None:
+                assessment = Assessment(*row)
+                self._insert(digest, assessment)
+
+        return assessment
+
+    def stats(self) -> Dict[str, int]:
+        """Number of hits, misses and entries in the in-memory tier."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+            }
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _insert(self, digest: str, assessment: Assessment) -> None:
+        self._entries[digest] = assessment
+        self._entries.move_to_end(digest)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -1,66 +1,197 @@
+import collections
+import itertools
+import threading
 from pathlib import Path
-from typing import Any, List, Tuple
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Sized,
+    Tuple,
+    Union,
+)
 
 import fire
 import grpc
 import numpy as np
 import pandas as pd
-import tensorflow as tf
 from tqdm import tqdm
 
-from imageassessmentservice.definitions import MAX_GRPC_MESSAGE_SIZE_MB
+from imageassessmentservice.aio_client import rate_images_concurrently
+from imageassessmentservice.arguments import as_tuple
+from imageassessmentservice.dedup import (
+    choose_representatives,
+    DEDUP_MODES,
+    group_near_duplicates,
+    hash_images,
+)
+from imageassessmentservice.definitions import (
+    ASSESSMENT_HEADS,
+    DEFAULT_IMAGE_EXTENSIONS,
+    DEFAULT_PORT,
+    MAX_GRPC_MESSAGE_SIZE_MB,
+    PREPROCESSED_IMAGE_EXTENSIONS,
+    RATINGS_FILE_SUFFIXES,
+)
 from imageassessmentservice.imageassessment_pb2 import ImageAssessmentRequest
 from imageassessmentservice.imageassessment_pb2_grpc import ImageAssessmentStub
-
-physical_devices = tf.config.list_physical_devices("GPU")
-if physical_devices:
-    tf.config.experimental.set_memory_growth(physical_devices[0], True)
+from imageassessmentservice.index import RatingsIndex
+from imageassessmentservice.messages import (
+    build_request,
+    grpc_target,
+    rating_from_response,
+)
+from imageassessmentservice.output import ParquetRatingsWriter
+from imageassessmentservice.preprocessing import Preprocessor
+from imageassessmentservice.scanner import scan_files
+from imageassessmentservice.statistics import bin_ratings, normalize_and_bin_chunks
+from imageassessmentservice.stats import ClientStats
 
 
 def rate_images(
-    image_paths: List[Path], address: str
+    image_paths: Iterable[Path],
+    address: str,
+    max_in_flight: int = 16,
+    rating_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+    heads: Sequence[str] = ASSESSMENT_HEADS,
+    stats: Optional[ClientStats] = None,
+    image_loader: Callable[[Path], bytes] = Path.read_bytes,
+    show_progress: bool = True,
 ) -> Tuple[pd.DataFrame, List[Path]]:
+    """Obtain ratings for images from the image assessment service.
+
+    The images are sent over a single bidirectional stream. Up to `max_in_flight`
+    images are sent before the corresponding responses have been received, so that
+    reading, uploading and assessing images overlap.
+
+    Parameters
+    ----------
+    image_paths
+        Paths to the images to rate, which may be produced while images are rated
+    address
+        Host where the image assessment service is running, optionally followed by
+        ":port" (port 50051 otherwise)
+    max_in_flight
+        Maximum number of images that are sent but not yet rated
+    rating_callback
+        Function that is called with each rating as soon as it has been received
+    heads
+        Heads to run for each image, the dataframe contains one column per head
+    stats
+        Collects latencies and transferred bytes of the requests
+    image_loader
+        Function that returns the bytes to send for an image, e.g. of a `Preprocessor`
+    show_progress
+        Print a progress bar of the received ratings
+
+    Returns
+    -------
+    Dataframe with ratings and list of images that could not be rated
+    """
+    if max_in_flight < 1:
+        raise ValueError("Expect max_in_flight to be at least 1.")
+
     options = [
         (
             "grpc.max_send_message_length",
             MAX_GRPC_MESSAGE_SIZE_MB * 1024**2,
         ),  # Maximum message size in bytes
     ]
-    channel = grpc.insecure_channel(f"{address}:50051", options=options)
-    client = ImageAssessmentStub(channel)
 
     ratings = []
     images_with_issues = []
 
-    print("Obtaining ratings")
+    in_flight = threading.BoundedSemaphore(max_in_flight)
+    stream_closed = threading.Event()
+    paths_lock = threading.Lock()
+    remaining_paths = iter(image_paths)
+    pending_paths: Dict[str, Path] = {}
 
-    for image_path in tqdm(image_paths):
-        image_path_str = str(image_path)
-        image_bytes = tf.io.read_file(image_path_str)
+    def _requests() -> Iterator[ImageAssessmentRequest]:
+        request_id = 0
 
-        request = ImageAssessmentRequest(
-            path=image_path_str, image_bytes=image_bytes.numpy()
-        )
+        while True:
+            while not in_flight.acquire(timeout=0.1):
+                if stream_closed.is_set():
+                    return
 
-        try:
-            response = client.Assess(request)
-
-            ratings.append(
-                {
-                    "image_path": response.path,
-                    "aesthetic": response.assessment_aesthetic,
-                    "technical": response.assessment_technical,
-                }
-            )
+            with paths_lock:
+                if stream_closed.is_set():
+                    return
+
+                image_path = next(remaining_paths, None)
+
+                if image_path is None:
+                    return
+
+                pending_paths[str(request_id)] = image_path
 
-        except Exception as e:
-            print(f"Cannot rate image {image_path}.")
-            images_with_issues.append(image_path)
+            image_path_str = str(image_path)
+
+            try:
+                image_bytes = image_loader(image_path)
+            except OSError:
+                print(f"Cannot read image {image_path}.")
+                del pending_paths[str(request_id)]
+                images_with_issues.append(image_path)
+                in_flight.release()
+                continue
+
+            request = build_request(image_path_str, image_bytes, heads, str(request_id))
+
+            if stats is not None:
+                stats.request_sent(request.request_id, request.ByteSize())
+
+            yield request
+            request_id += 1
+
+    if show_progress:
+        print("Obtaining ratings")
+
+    with grpc.insecure_channel(grpc_target(address), options=options) as channel, tqdm(
+        total=len(image_paths) if isinstance(image_paths, Sized) else None,
+        disable=not show_progress,
+    ) as progress_bar:
+        try:
+            for response in ImageAssessmentStub(channel).AssessStream(_requests()):
+                image_path = pending_paths.pop(response.request_id)
+                in_flight.release()
+
+                if stats is not None:
+                    stats.response_received(response.request_id, response.ByteSize())
+
+                progress_bar.update()
+
+                if response.error:
+                    print(f"Cannot rate image {image_path}.")
+                    images_with_issues.append(image_path)
+                    continue
+
+                rating = rating_from_response(response, heads)
+                ratings.append(rating)
+
+                if rating_callback is not None:
+                    rating_callback(rating)
+        except grpc.RpcError as e:
+            print(f"Stream to image assessment service failed: {e}")
+        finally:
+            with paths_lock:
+                stream_closed.set()
+                # Images that were sent without response or that were not sent at all
+                images_with_issues.extend(pending_paths.values())
+                images_with_issues.extend(remaining_paths)
 
     return pd.DataFrame(ratings), images_with_issues
 
 
-def normalize_ratings(ratings: pd.DataFrame, rating_names: List[str]) -> pd.DataFrame:
+def normalize_ratings(
+    ratings: pd.DataFrame, rating_names: List[str], keep_raw: bool = False
+) -> pd.DataFrame:
     """Normalize ratings to have zero mean and unit variance.
 
     Parameters
@@ -69,6 +200,8 @@ def normalize_ratings(ratings: pd.DataFrame, rating_names: List[str]) -> pd.Data
         Dataframe containing ratings data
     rating_names
         Names of the ratings to normalize and combine by averaging
+    keep_raw
+        Keep the raw ratings next to the normalized ratings
 
     Returns
     -------
@@ -83,7 +216,8 @@ def normalize_ratings(ratings: pd.DataFrame, rating_names: List[str]) -> pd.Data
         [f"{rating_name}_normalized" for rating_name in rating_names]
     ].mean(axis=1)
 
-    ratings.drop(columns=rating_names, inplace=True)
+    if not keep_raw:
+        ratings.drop(columns=rating_names, inplace=True)
 
     return ratings
 
@@ -102,34 +236,132 @@ def map_ratings_to_bins(num_bins: int, ratings: pd.Series) -> pd.Series:
     -------
     Series of ratings mapped to bins
     """
+    if ratings.isna().any():
+        raise KeyError("Cannot map missing ratings to bins.")
+
     quantiles = np.linspace(0.0, 1.0, num_bins + 1, endpoint=True)
-    interval_bounds = np.array([ratings.quantile(value) for value in quantiles])
-    intervals = pd.IntervalIndex.from_arrays(
-        interval_bounds[:-1], interval_bounds[1:], closed="both"
+    interval_bounds = ratings.quantile(quantiles).to_numpy()
+
+    return bin_ratings(ratings, interval_bounds)
+
+
+def rank_groups(
+    raw_ratings: pd.DataFrame,
+    group_ids: Dict[Path, int],
+    heads: Sequence[str],
+    num_bins: int,
+) -> pd.DataFrame:
+    """Bin groups of near-duplicates by the rating of their best image.
+
+    Each group enters the binning once, so that bursts do not skew the distribution of
+    the ratings, and all images of a group are placed in the bin of the group. Images
+    that have been rated themselves are also ranked within their group.
+
+    Parameters
+    ----------
+    raw_ratings
+        Ratings of the rated images, e.g. of one image per group
+    group_ids
+        Group of each image
+    heads
+        Names of the ratings
+    num_bins
+        Number of bins to sort the groups into
+
+    Returns
+    -------
+    Dataframe with the bin, the group id and the rank in the group (1 for the best
+    image, NaN for images that have not been rated themselves) of all images of groups
+    with a rated image
+    """
+    normalized_ratings = normalize_ratings(raw_ratings.copy(), list(heads))
+    images = pd.DataFrame(
+        {
+            "image_path": [str(path) for path in group_ids],
+            "group_id": list(group_ids.values()),
+        }
+    ).merge(normalized_ratings[["image_path", "overall"]], on="image_path", how="left")
+
+    group_ratings = images.groupby("group_id")["overall"].max().dropna()
+    group_bins = map_ratings_to_bins(num_bins, group_ratings)
+
+    images = images[images["group_id"].isin(group_bins.index)].copy()
+    images["rating_new"] = images["group_id"].map(group_bins)
+    images["group_rank"] = (
+        images.groupby("group_id")["overall"]
+        .rank(ascending=False, method="first")
+        .astype("Int64")
     )
 
-    def _get_int_rating(
-        ratings_float: float,
-        intervals_for_ratings: pd.IntervalIndex,
-        ratings_int: List[int],
-    ) -> Any:
-        interval_idx = intervals_for_ratings.get_loc(ratings_float)
-        rating = ratings_int[interval_idx]
+    return images.drop(columns="overall").sort_values("image_path", ignore_index=True)
 
-        return rating if isinstance(rating, int) else rating[0]
 
-    target_ratings = list(range(1, num_bins + 1))
-    mapped_ratings = ratings.apply(
-        lambda x: _get_int_rating(x, intervals, target_ratings)
+def _write_ratings(
+    rating_chunks: Iterable[pd.DataFrame],
+    other_paths: List[Path],
+    ratings_output_file_path: Path,
+    heads: Sequence[str] = ASSESSMENT_HEADS,
+    extra_columns: Sequence[str] = (),
+) -> None:
+    files_without_ratings = pd.DataFrame(
+        {
+            "image_path": other_paths,
+            "rating_new": [-1] * len(other_paths),
+            **{column: [-1] * len(other_paths) for column in extra_columns},
+        }
     )
-    return mapped_ratings
+    chunks = itertools.chain(rating_chunks, [files_without_ratings])
+
+    if ratings_output_file_path.suffix == ".parquet":
+        with ParquetRatingsWriter(
+            ratings_output_file_path, heads, extra_columns
+        ) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+
+        return
+
+    # Chunks are appended one after the other with a continuous index, so that the
+    # result is the same as writing a single dataframe
+    num_rows = 0
+
+    for chunk in chunks:
+        chunk = chunk[["image_path", "rating_new", *extra_columns]].astype(
+            {"rating_new": int}
+        )
+        chunk.index = pd.RangeIndex(num_rows, num_rows + len(chunk))
+
+        chunk.to_csv(
+            ratings_output_file_path,
+            mode="w" if num_rows == 0 else "a",
+            header=num_rows == 0,
+        )
+        num_rows += len(chunk)
 
 
 def infer_on_images(
     input_folder: str,
     ratings_output_file: str,
-    address: str = "localhost",
+    address: Union[str, Sequence[str]] = "localhost",
+    port: int = DEFAULT_PORT,
     num_bins: int = 5,
+    max_in_flight: int = 16,
+    use_asyncio: bool = False,
+    timeout_s: float = 60.0,
+    incremental: bool = False,
+    heads: Sequence[str] = ASSESSMENT_HEADS,
+    extensions: Optional[Sequence[str]] = None,
+    include: Sequence[str] = (),
+    exclude: Sequence[str] = (),
+    scan_workers: int = 8,
+    load_balancing: str = "least_outstanding",
+    upload_chunk_kb: int = 0,
+    dedup: str = "none",
+    dedup_max_distance: int = 4,
+    preprocess: bool = False,
+    preprocess_max_size: int = 1024,
+    preprocess_quality: int = 90,
+    preprocess_workers: int = 0,
 ) -> None:
     """
     Run image assessment and sort images according to result.
@@ -139,54 +371,255 @@ def infer_on_images(
     input_folder
         Folder containing the images to be assessed
     ratings_output_file
-        File to which the ratings should be stored
+        File to which the ratings should be stored, a CSV file with the paths and bins
+        of the images or a Parquet file that additionally holds the raw and normalized
+        ratings, the size and modification time of the files and the id of the models
     address
-        Host where the image assessment service is running
+        Host where the image assessment service is running, or several hosts
+        (comma-separated on the command line) to spread the images over
+    port
+        Port on which the image assessment service listens, unless `address`
+        contains a port
     num_bins
         Number of bins in which to sort the images
+    max_in_flight
+        Maximum number of images that are sent to the service but not yet rated
+    use_asyncio
+        Rate images with concurrent unary requests from an asyncio client instead of a
+        single stream. The asyncio client is always used for several hosts.
+    timeout_s
+        Deadline for each request of the asyncio client in seconds
+    incremental
+        Keep raw ratings in an index next to the output file and only rate images that
+        are new or changed since the last run. The output file is overwritten with the
+        ratings of all images.
+    heads
+        Heads to run, a subset of "aesthetic" and "technical" (comma-separated on the
+        command line). The overall rating is based on these heads only.
+    extensions
+        File extensions of the images to rate (comma-separated on the command line),
+        JPEGs by default and further formats including RAW files if images are
+        preprocessed
+    include
+        Glob patterns of the files to consider, all files if empty
+    exclude
+        Glob patterns of files and folders to skip, e.g. "@eaDir" or "*/.thumbnails"
+    scan_workers
+        Maximum number of folders that are scanned concurrently
+    load_balancing
+        Policy for spreading images over several hosts, "least_outstanding" or
+        "power_of_two"
+    upload_chunk_kb
+        Upload images in chunks of this size in kB with the asyncio client, e.g. for
+        images exceeding the maximum message size. Disabled if 0.
+    dedup
+        Handling of near-duplicates such as bursts: "none" rates all images on their
+        own, "representative" rates only the largest image of each group and applies
+        its rating to the group, "score_all" rates all images and ranks them within
+        their group, while the group is binned by its best image. The ratings file then
+        contains the group of each image and, for "score_all", its rank in the group.
+    dedup_max_distance
+        Maximum number of bits in which the perceptual hashes of near-duplicates differ
+        (out of 64)
+    preprocess
+        Prepare the images in a process pool before sending them: apply the EXIF
+        orientation, downscale and re-encode them, and send the embedded JPEG preview
+        of RAW files (CR2, NEF, ARW, DNG). The savings in transferred bytes and in
+        pixels to decode on the server are printed at the end.
+    preprocess_max_size
+        Maximum length of the longer side of preprocessed images in pixels, 0 keeps
+        the resolution
+    preprocess_quality
+        JPEG quality of preprocessed images
+    preprocess_workers
+        Number of processes that preprocess images, the number of CPUs if 0
     """
+    heads = as_tuple(heads)
+
+    if not heads or set(heads) - set(ASSESSMENT_HEADS):
+        raise ValueError(f"Expect heads to be a subset of {ASSESSMENT_HEADS}.")
 
     source_folder_path = Path(input_folder)
     ratings_output_file_path = Path(ratings_output_file)
 
+    targets = [grpc_target(host, port) for host in as_tuple(address)]
+
+    if not targets:
+        raise ValueError("Expect at least one address.")
+
     if not source_folder_path.exists() or source_folder_path.is_file():
         raise FileNotFoundError("Input folder does not exist or is a file.")
 
-    if ratings_output_file_path.exists():
+    if ratings_output_file_path.exists() and not incremental:
         raise FileExistsError("Output file exists already. It will not be overwritten.")
 
-    if ratings_output_file_path.suffix != ".csv":
-        raise ValueError("Expect output file to have suffix 'csv'.")
+    if ratings_output_file_path.suffix not in RATINGS_FILE_SUFFIXES:
+        raise ValueError(
+            f"Expect output file to have a suffix of {RATINGS_FILE_SUFFIXES}."
+        )
 
-    file_paths = list(source_folder_path.rglob("*"))
+    if dedup not in DEDUP_MODES:
+        raise ValueError(f"Expect dedup to be one of {DEDUP_MODES}.")
 
-    image_file_endings = {".jpg", ".jpeg"}
-    image_paths = [x for x in file_paths if x.suffix.lower() in image_file_endings]
-    other_paths = [
-        x
-        for x in file_paths
-        if not (x.suffix.lower() in image_file_endings or x.is_dir())
-    ]
+    if dedup != "none" and incremental:
+        raise ValueError("Deduplication is not supported for incremental runs.")
+
+    if preprocess and upload_chunk_kb > 0:
+        raise ValueError("Preprocessed images cannot be uploaded in chunks.")
 
-    raw_ratings, images_with_issues = rate_images(image_paths, address)
+    if extensions is None:
+        extensions = (
+            PREPROCESSED_IMAGE_EXTENSIONS if preprocess else DEFAULT_IMAGE_EXTENSIONS
+        )
 
-    rating_names = ["aesthetic", "technical"]
-    normalized_ratings = normalize_ratings(raw_ratings, rating_names)
+    # Images are rated while the input folder is being scanned. All paths are kept,
+    # as they are needed for the output file.
+    image_paths: List[Path] = []
+    other_paths: List[Path] = []
+
+    def _scanned_image_paths() -> Iterator[Path]:
+        for scanned_file in scan_files(
+            source_folder_path,
+            as_tuple(extensions),
+            as_tuple(include),
+            as_tuple(exclude),
+            scan_workers,
+        ):
+            if scanned_file.is_image:
+                image_paths.append(scanned_file.path)
+                yield scanned_file.path
+            else:
+                other_paths.append(scanned_file.path)
+
+    scanned_image_paths = _scanned_image_paths()
+    image_paths_to_rate: Iterable[Path] = scanned_image_paths
+    group_ids: Optional[Dict[Path, int]] = None
+
+    if dedup != "none":
+        # Images are hashed while the folder is scanned, but can only be grouped and
+        # rated once all images are known
+        group_ids = group_near_duplicates(
+            dict(hash_images(scanned_image_paths, max_workers=scan_workers)),
+            dedup_max_distance,
+        )
+        representatives = choose_representatives(group_ids)
+        print(
+            f"Found {len(representatives)} groups of near-duplicates among "
+            f"{len(group_ids)} images."
+        )
+        image_paths_to_rate = (
+            sorted(representatives.values())
+            if dedup == "representative"
+            else sorted(group_ids)
+        )
 
-    normalized_ratings["rating_new"] = map_ratings_to_bins(
-        num_bins, normalized_ratings["overall"]
+    ratings_index = (
+        RatingsIndex(ratings_output_file_path.with_suffix(".index.sqlite"))
+        if incremental
+        else None
     )
+    paths_to_rate = (
+        ratings_index.iter_stale_paths(image_paths_to_rate, heads)
+        if ratings_index is not None
+        else image_paths_to_rate
+    )
+    rating_callback = ratings_index.add if ratings_index is not None else None
+    # Only Parquet files hold the raw ratings and the state of the files
+    keep_raw = ratings_output_file_path.suffix == ".parquet"
+    preprocessor: Optional[Preprocessor] = None
+    image_loader: Callable[[Path], bytes] = Path.read_bytes
+
+    try:
+        if preprocess:
+            preprocessor = Preprocessor(
+                preprocess_max_size, preprocess_quality, preprocess_workers or None
+            )
+            paths_to_rate = preprocessor.prefetch(paths_to_rate)
+            image_loader = preprocessor.load
+
+        if use_asyncio or len(targets) > 1 or upload_chunk_kb > 0:
+            raw_ratings, images_with_issues = rate_images_concurrently(
+                paths_to_rate,
+                targets,
+                concurrency=max_in_flight,
+                timeout_s=timeout_s,
+                rating_callback=rating_callback,
+                heads=heads,
+                load_balancing=load_balancing,
+                upload_chunk_kb=upload_chunk_kb,
+                image_loader=image_loader,
+            )
+        else:
+            raw_ratings, images_with_issues = rate_images(
+                paths_to_rate,
+                targets[0],
+                max_in_flight,
+                rating_callback,
+                heads,
+                image_loader=image_loader,
+            )
 
-    rating_data = normalized_ratings[["image_path", "rating_new"]]
+        if preprocessor is not None:
+            summary = preprocessor.summary()
+            print(
+                f"Preprocessed {summary['num_images']} images in "
+                f"{summary['preprocessing_s']:.1f} s of processing: "
+                f"{summary['original_mb']:.1f} MB reduced to "
+                f"{summary['preprocessed_mb']:.1f} MB to send "
+                f"({summary['bytes_saved']:.0%} less), "
+                f"{summary['original_megapixels']:.1f} reduced to "
+                f"{summary['megapixels']:.1f} megapixels to decode on the server "
+                f"({summary['pixels_saved']:.0%} less)."
+            )
 
-    files_without_ratings = pd.DataFrame(
-        {"image_path": other_paths, "rating_new": [-1] * len(other_paths)}
-    )
+        # Finish the scan in case rating stopped early
+        collections.deque(scanned_image_paths, maxlen=0)
+
+        if ratings_index is not None:
+            # Normalization and binning are done over all images, not only the new
+            # ones. The ratings are streamed from the index instead of being loaded
+            # at once.
+            rating_chunks: Iterable[pd.DataFrame] = normalize_and_bin_chunks(
+                lambda: ratings_index.iter_ratings(
+                    image_paths,
+                    heads,
+                    extra_columns=("size", "mtime_ns", "model_id") if keep_raw else (),
+                ),
+                heads,
+                num_bins,
+                keep_raw=keep_raw,
+            )
+        elif group_ids is not None:
+            rating_chunks = [rank_groups(raw_ratings, group_ids, heads, num_bins)]
+        else:
+            normalized_ratings = normalize_ratings(raw_ratings, list(heads), keep_raw)
 
-    all_data = pd.concat([rating_data, files_without_ratings], ignore_index=True)
-    all_data["rating_new"] = all_data["rating_new"].astype(int)
+            normalized_ratings["rating_new"] = map_ratings_to_bins(
+                num_bins, normalized_ratings["overall"]
+            )
+            rating_chunks = [normalized_ratings]
+
+        _write_ratings(
+            rating_chunks,
+            other_paths,
+            ratings_output_file_path,
+            heads,
+            extra_columns=(
+                ()
+                if group_ids is None
+                else (
+                    ("group_id", "group_rank")
+                    if dedup == "score_all"
+                    else ("group_id",)
+                )
+            ),
+        )
+    finally:
+        if preprocessor is not None:
+            preprocessor.close()
 
-    all_data.to_csv(ratings_output_file_path)
+        if ratings_index is not None:
+            ratings_index.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,251 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, NamedTuple, Optional
+
+import tensorflow as tf
+
+from imageassessmentservice.batching import DeadlineExpiredError
+from imageassessmentservice.headers import image_size
+
+# "full_resolution" passes the image to the model as it is, "dct_downscaled" decodes a
+# JPEG at a reduced scale in the DCT domain and "resized" additionally resizes the
+# decoded image. Matches the DecodePolicy enum of the protocol.
+DECODE_POLICIES = ("full_resolution", "dct_downscaled", "resized")
+
+# Scale denominators that libjpeg supports while decoding
+_DCT_RATIOS = (2, 4, 8)
+
+
+class DecodePlan(NamedTuple):
+    policy: str
+    # Format and size of the image as given by its header, None if the format is not
+    # supported
+    image_format: Optional[str] = None
+    width: int = 0
+    height: int = 0
+    # Size of the image passed to the model
+    target_width: int = 0
+    target_height: int = 0
+    dct_ratio: int = 1
+    # Estimate of the peak memory of the decoded pixels, before the image is passed on
+    decode_bytes: int = 0
+
+
+class ImageDecoder:
+    """Reduces images above a pixel budget before they are passed to the model.
+
+    The MUSIQ models decode the images they receive at full resolution, once per head,
+    so that a few very large images, e.g. panoramas, can exhaust the memory of the
+    server. Images with more than `max_pixels` pixels are decoded at a reduced size
+    instead and re-encoded as JPEG. JPEGs are downscaled in the DCT domain while they
+    are decoded, by a power of two, such that the full-resolution image is never held
+    in memory. If that does not suffice, or for PNGs, the decoded image is resized to
+    the budget. Other images are passed on unchanged.
+
+    Decoding reserves the estimated memory of the decoded pixels from a budget of
+    `max_decode_mb`, so that only a bounded number of large images are decoded at the
+    same time. A single image that exceeds the budget is decoded if no other image is.
+
+    Parameters
+    ----------
+    max_pixels
+        Maximum number of pixels of images passed to the model, unlimited if 0
+    max_decode_mb
+        Memory for the decoded pixels of the images that are reduced at the same time,
+        unlimited if 0
+    jpeg_quality
+        Quality with which reduced images are encoded
+    """
+
+    def __init__(
+        self, max_pixels: int = 0, max_decode_mb: float = 0.0, jpeg_quality: int = 95
+    ):
+        if max_pixels < 0 or max_decode_mb < 0:
+            raise ValueError("Expect the decode limits to be non-negative.")
+
+        self.max_pixels = max_pixels
+        self.max_decode_bytes = int(max_decode_mb * 1024**2)
+        self.jpeg_quality = jpeg_quality
+
+        self._condition = threading.Condition()
+        self._reserved_bytes = 0
+        self._policy_counts: Dict[str, int] = {policy: 0 for policy in DECODE_POLICIES}
+        self._num_expired = 0
+        self._peak_decode_bytes = 0
+        self._decode_s = 0.0
+
+    @property
+    def cache_id_suffix(self) -> str:
+        """Suffix of the model id in the result cache, as reduced images are rated
+        differently."""
+        return f"+max{self.max_pixels}px" if self.max_pixels else ""
+
+    def plan(self, image_bytes: bytes) -> DecodePlan:
+        """Decide how to decode an image, based on its header."""
+        size = image_size(image_bytes)
+
+        if size is None:
+            return DecodePlan("full_resolution")
+
+        image_format, width, height = size
+        pixels = width * height
+
+        if not self.max_pixels or pixels <= self.max_pixels:
+            return DecodePlan(
+                "full_resolution",
+                image_format,
+                width,
+                height,
+                width,
+                height,
+                1,
+                3 * pixels,
+            )
+
+        dct_ratio = 1
+
+        if image_format == "jpeg":
+            for dct_ratio in _DCT_RATIOS:
+                scaled_width = math.ceil(width / dct_ratio)
+                scaled_height = math.ceil(height / dct_ratio)
+
+                if scaled_width * scaled_height <= self.max_pixels:
+                    return DecodePlan(
+                        "dct_downscaled",
+                        image_format,
+                        width,
+                        height,
+                        scaled_width,
+                        scaled_height,
+                        dct_ratio,
+                        3 * scaled_width * scaled_height,
+                    )
+
+        decoded_width = math.ceil(width / dct_ratio)
+        decoded_height = math.ceil(height / dct_ratio)
+        scale = math.sqrt(self.max_pixels / (decoded_width * decoded_height))
+        target_width = max(int(decoded_width * scale), 1)
+        target_height = max(int(decoded_height * scale), 1)
+
+        return DecodePlan(
+            "resized",
+            image_format,
+            width,
+            height,
+            target_width,
+            target_height,
+            dct_ratio,
+            # The decoded image and the resized image in float32
+            3 * decoded_width * decoded_height + 12 * target_width * target_height,
+        )
+
+    @contextmanager
+    def reserve(
+        self, num_bytes: int, deadline: Optional[float] = None
+    ) -> Iterator[None]:
+        """Reserve memory for decoding from the budget, waiting until there is room.
+
+        Raises
+        ------
+        DeadlineExpiredError
+            If the deadline passes while waiting
+        """
+        with self._condition:
+            while (
+                self.max_decode_bytes
+                and self._reserved_bytes > 0
+                and self._reserved_bytes + num_bytes > self.max_decode_bytes
+            ):
+                timeout = None if deadline is None else deadline - time.monotonic()
+
+                if timeout is not None and timeout <= 0:
+                    self._num_expired += 1
+                    raise DeadlineExpiredError(
+                        "Deadline passed while waiting to decode the image."
+                    )
+
+                self._condition.wait(timeout)
+
+            self._reserved_bytes += num_bytes
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._reserved_bytes -= num_bytes
+                self._condition.notify_all()
+
+    def decode(
+        self, image_bytes: bytes, plan: DecodePlan, deadline: Optional[float] = None
+    ) -> bytes:
+        """Reduce an image according to its plan.
+
+        Returns
+        -------
+        Encoded image to pass to the model
+
+        Raises
+        ------
+        ValueError
+            If the image cannot be decoded
+        DeadlineExpiredError
+            If the deadline passes while waiting for memory to decode the image
+        """
+        if plan.policy == "full_resolution":
+            with self._condition:
+                self._policy_counts[plan.policy] += 1
+
+            return image_bytes
+
+        with self.reserve(plan.decode_bytes, deadline):
+            start = time.perf_counter()
+
+            try:
+                if plan.image_format == "jpeg":
+                    pixels = tf.io.decode_jpeg(
+                        image_bytes, channels=3, ratio=plan.dct_ratio
+                    )
+                else:
+                    pixels = tf.io.decode_png(image_bytes, channels=3)
+
+                # Pixels of the decoded image and, if any, of the resized image
+                decode_bytes = int(tf.size(pixels))
+
+                if plan.policy == "resized":
+                    resized = tf.image.resize(
+                        pixels,
+                        (plan.target_height, plan.target_width),
+                        antialias=True,
+                    )
+                    decode_bytes += 4 * int(tf.size(resized))
+                    pixels = tf.cast(
+                        tf.clip_by_value(tf.round(resized), 0, 255), tf.uint8
+                    )
+
+                reduced_bytes = tf.io.encode_jpeg(
+                    pixels, quality=self.jpeg_quality
+                ).numpy()
+            except tf.errors.OpError as e:
+                raise ValueError(f"Cannot decode image: {e.message}") from e
+
+            duration_s = time.perf_counter() - start
+
+        with self._condition:
+            self._policy_counts[plan.policy] += 1
+            self._peak_decode_bytes = max(self._peak_decode_bytes, decode_bytes)
+            self._decode_s += duration_s
+
+        return reduced_bytes
+
+    def stats(self) -> Dict[str, Any]:
+        """Number of images per policy, requests that expired while waiting to be
+        decoded, and the largest memory of the decoded pixels of a request."""
+        with self._condition:
+            return {
+                **self._policy_counts,
+                "expired": self._num_expired,
+                "peak_decode_mb": self._peak_decode_bytes / 1024**2,
+                "decode_s": self._decode_s,
+            }
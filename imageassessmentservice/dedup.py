@@ -0,0 +1,200 @@
+import io
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from PIL import ExifTags, Image, UnidentifiedImageError
+
+# "none" rates all images independently, "representative" rates one image per group of
+# near-duplicates and "score_all" rates all images but ranks each group by its best image
+DEDUP_MODES = ("none", "representative", "score_all")
+
+# Tags of the embedded JPEG thumbnail in the second image file directory of the EXIF data
+_EXIF_THUMBNAIL_OFFSET = 0x0201
+_EXIF_THUMBNAIL_LENGTH = 0x0202
+
+# Size to which images are reduced while they are decoded, if they have no thumbnail
+_DRAFT_SIZE = (160, 120)
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """Difference hash of an image.
+
+    The image is reduced to a grayscale image of `hash_size + 1` by `hash_size` pixels,
+    and each bit of the hash tells whether a pixel is brighter than its right neighbor.
+    Similar images have hashes that differ in few bits.
+    """
+    pixels = (
+        image.convert("L")
+        .resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+        .tobytes()
+    )
+    value = 0
+
+    for row in range(hash_size):
+        for column in range(hash_size):
+            offset = row * (hash_size + 1) + column
+            value = (value << 1) | int(pixels[offset] > pixels[offset + 1])
+
+    return value
+
+
+def hamming_distance(hash_1: int, hash_2: int) -> int:
+    return bin(hash_1 ^ hash_2).count("1")
+
+
+def _exif_thumbnail(image: Image.Image) -> Optional[Image.Image]:
+    """Open the JPEG thumbnail embedded in the EXIF data of an image, if it has one."""
+    raw_exif = image.info.get("exif")
+
+    if not raw_exif:
+        return None
+
+    thumbnail_tags = image.getexif().get_ifd(ExifTags.IFD.IFD1)
+    offset = thumbnail_tags.get(_EXIF_THUMBNAIL_OFFSET)
+    length = thumbnail_tags.get(_EXIF_THUMBNAIL_LENGTH)
+
+    if not offset or not length:
+        return None
+
+    # Offsets are relative to the TIFF header that follows the "Exif\0\0" marker
+    start = 6 + offset if raw_exif.startswith(b"Exif") else offset
+    thumbnail = Image.open(io.BytesIO(raw_exif[start : start + length]))
+    thumbnail.load()
+
+    return thumbnail
+
+
+def perceptual_hash(image_path: Path, hash_size: int = 8) -> Optional[int]:
+    """Compute the difference hash of an image file from a small version of the image.
+
+    The JPEG thumbnail embedded in the EXIF data is used if there is one, otherwise the
+    image is decoded at a reduced size, which JPEG supports without decoding the full
+    image.
+
+    Returns
+    -------
+    Hash of the image or None if the image cannot be read
+    """
+    try:
+        with Image.open(image_path) as image:
+            try:
+                thumbnail = _exif_thumbnail(image)
+            except (OSError, SyntaxError, ValueError):
+                # Broken EXIF data only prevents the shortcut
+                thumbnail = None
+
+            if thumbnail is None:
+                image.draft("RGB", _DRAFT_SIZE)
+                thumbnail = image
+
+            return dhash(thumbnail, hash_size)
+    except (OSError, UnidentifiedImageError, ValueError):
+        return None
+
+
+def hash_images(
+    image_paths: Iterable[Path], hash_size: int = 8, max_workers: int = 8
+) -> Iterator[Tuple[Path, Optional[int]]]:
+    """Compute the perceptual hashes of images on a thread pool, in the given order.
+
+    Pillow releases the GIL while decoding, so images are decoded in parallel. Images
+    are hashed while further paths are produced, e.g. while a folder is scanned.
+    """
+
+    def _hash(image_path: Path) -> Tuple[Path, Optional[int]]:
+        return image_path, perceptual_hash(image_path, hash_size)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from executor.map(_hash, image_paths)
+
+
+def group_near_duplicates(
+    hashes: Dict[Path, Optional[int]], max_distance: int = 4, hash_bits: int = 64
+) -> Dict[Path, int]:
+    """Group images whose hashes differ in at most `max_distance` bits.
+
+    Groups are formed by single linkage, i.e. a burst of images in which each image is
+    similar to the next forms a single group. Images without a hash form a group of
+    their own.
+
+    Two hashes within the distance agree in at least one of `max_distance + 1` bands of
+    bits, so only hashes that share a band are compared, instead of all pairs.
+
+    Parameters
+    ----------
+    hashes
+        Perceptual hash of each image, None if the image could not be hashed
+    max_distance
+        Maximum number of differing bits of near-duplicates
+    hash_bits
+        Number of bits of the hashes
+
+    Returns
+    -------
+    Group id of each image, numbered in the order of the sorted paths
+    """
+    if max_distance < 0:
+        raise ValueError("Expect max_distance to be non-negative.")
+
+    paths = sorted(hashes)
+    parents = list(range(len(paths)))
+
+    def _find(index: int) -> int:
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+
+        return index
+
+    num_bands = min(max_distance + 1, hash_bits)
+    band_bounds = [hash_bits * band // num_bands for band in range(num_bands + 1)]
+    # Indices and hashes of the images with the same bits in a band
+    buckets: Dict[Tuple[int, int], List[Tuple[int, int]]] = defaultdict(list)
+
+    for index, path in enumerate(paths):
+        image_hash = hashes[path]
+
+        if image_hash is None:
+            continue
+
+        for band, (low, high) in enumerate(zip(band_bounds, band_bounds[1:])):
+            band_value = (image_hash >> low) & ((1 << (high - low)) - 1)
+            bucket = buckets[(band, band_value)]
+
+            for other_index, other_hash in bucket:
+                if (
+                    _find(index) != _find(other_index)
+                    and hamming_distance(image_hash, other_hash) <= max_distance
+                ):
+                    parents[_find(index)] = _find(other_index)
+
+            bucket.append((index, image_hash))
+
+    group_ids: Dict[int, int] = {}
+
+    return {
+        path: group_ids.setdefault(_find(index), len(group_ids))
+        for index, path in enumerate(paths)
+    }
+
+
+def choose_representatives(group_ids: Dict[Path, int]) -> Dict[int, Path]:
+    """Select the largest file of each group as its representative.
+
+    Among near-identical frames, the sharpest one tends to compress worst, so the
+    largest file is a cheap guess for the best image of a group.
+    """
+    representatives: Dict[int, Tuple[int, Path]] = {}
+
+    for path, group_id in sorted(group_ids.items()):
+        try:
+            size = path.stat().st_size
+        except OSError:
+            size = -1
+
+        if group_id not in representatives or size > representatives[group_id][0]:
+            representatives[group_id] = (size, path)
+
+    return {group_id: path for group_id, (_, path) in representatives.items()}
@@ -1,3 +1,41 @@
-from typing import Final
+from typing import Dict, Final, Tuple
 
 MAX_GRPC_MESSAGE_SIZE_MB: Final[int] = 50
+
+# Default limit for the size of images uploaded in chunks, independent of the maximum
+# message size
+MAX_IMAGE_SIZE_MB: Final[int] = 500
+
+DEFAULT_PORT: Final[int] = 50051
+
+# Trailing metadata with which the server tells rejected clients when to retry
+RETRY_PUSHBACK_METADATA_KEY: Final[str] = "grpc-retry-pushback-ms"
+
+MUSIQ_AVA_URL: Final[str] = "https://tfhub.dev/google/musiq/ava/1"
+MUSIQ_PAQ2PIQ_URL: Final[str] = "https://tfhub.dev/google/musiq/paq2piq/1"
+
+# Sub-directories of a local model directory that hold the SavedModels of the heads
+MUSIQ_MODEL_SUBDIRS: Final[Dict[str, str]] = {
+    "aesthetic": "ava",
+    "technical": "paq2piq",
+}
+
+# Names of the assessment heads, matching the fields of the Assessment tuple and the
+# rating columns on the client
+ASSESSMENT_HEADS: Final[Tuple[str, ...]] = ("aesthetic", "technical")
+
+# Extensions of the files that are sent to the service by default
+DEFAULT_IMAGE_EXTENSIONS: Final[Tuple[str, ...]] = (".jpg", ".jpeg")
+
+# Extensions of RAW files, of which the embedded JPEG preview is sent when images are
+# preprocessed
+RAW_IMAGE_EXTENSIONS: Final[Tuple[str, ...]] = (".cr2", ".nef", ".arw", ".dng")
+
+# Extensions of the files that are sent to the service by default when images are
+# preprocessed, which converts them to JPEG
+PREPROCESSED_IMAGE_EXTENSIONS: Final[Tuple[str, ...]] = (
+    DEFAULT_IMAGE_EXTENSIONS + (".png", ".tif", ".tiff", ".webp") + RAW_IMAGE_EXTENSIONS
+)
+
+# Suffixes of the supported formats of the ratings file written by the client
+RATINGS_FILE_SUFFIXES: Final[Tuple[str, ...]] = (".csv", ".parquet")
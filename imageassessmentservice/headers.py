@@ -0,0 +1,73 @@
+import struct
+from typing import Any, Optional, Tuple
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def jpeg_frame(
+    data: Any, offset: int = 0, length: Optional[int] = None
+) -> Optional[Tuple[int, int, int]]:
+    """Find the start of frame marker of a JPEG, without decoding the image.
+
+    Parameters
+    ----------
+    data
+        Bytes (or a memory map) containing the JPEG
+    offset
+        Position of the JPEG in the data
+    length
+        Length of the JPEG, up to the end of the data if None
+
+    Returns
+    -------
+    Marker, width and height of the JPEG, None if the data is not a JPEG
+    """
+    end = len(data) if length is None else min(offset + length, len(data))
+
+    if data[offset : offset + 2] != b"\xff\xd8":
+        return None
+
+    position = offset + 2
+
+    while position + 4 <= end:
+        if data[position] != 0xFF:
+            return None
+
+        marker = data[position + 1]
+
+        # Markers may be preceded by fill bytes
+        if marker == 0xFF:
+            position += 1
+            continue
+
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if position + 9 > end:
+                return None
+
+            height, width = struct.unpack_from(">HH", data, position + 5)
+            return marker, width, height
+
+        (segment_length,) = struct.unpack_from(">H", data, position + 2)
+        position += 2 + segment_length
+
+    return None
+
+
+def image_size(data: bytes) -> Optional[Tuple[str, int, int]]:
+    """Read the size of an encoded image from its header.
+
+    Returns
+    -------
+    Format ("jpeg" or "png"), width and height of the image, None if the format is not
+    supported or the header is broken
+    """
+    frame = jpeg_frame(data)
+
+    if frame is not None:
+        return "jpeg", frame[1], frame[2]
+
+    if data[:8] == _PNG_SIGNATURE and len(data) >= 24:
+        width, height = struct.unpack_from(">II", data, 16)
+        return "png", width, height
+
+    return None
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# NO CHECKED-IN PROTOBUF GENCODE
+# source: imageassessment.proto
+# Protobuf Python Version: 7.35.1
+"""Generated protocol buffer code."""
+
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import runtime_version as _runtime_version
+from google.protobuf import symbol_database as _symbol_database
+from google.protobuf.internal import builder as _builder
+
+_runtime_version.ValidateProtobufRuntimeVersion(
+    _runtime_version.Domain.PUBLIC, 7, 35, 1, "", "imageassessment.proto"
+)
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(
+    b'\n\x15imageassessment.proto"\x8c\x01\n\x16ImageAssessmentRequest\x12\x0c\n\x04path\x18\x01 \x01(\t\x12\x13\n\x0bimage_bytes\x18\x02 \x01(\x0c\x12\x12\n\nrequest_id\x18\x03 \x01(\t\x12\x1e\n\x05heads\x18\x04 \x03(\x0e\x32\x0f.AssessmentHead\x12\x1b\n\x08priority\x18\x05 \x01(\x0e\x32\t.Priority"\xfa\x01\n\x17ImageAssessmentResponse\x12\x0c\n\x04path\x18\x01 \x01(\t\x12!\n\x14\x61ssessment_aesthetic\x18\x02 \x01(\x01H\x00\x88\x01\x01\x12!\n\x14\x61ssessment_technical\x18\x03 \x01(\x01H\x01\x88\x01\x01\x12\x12\n\nrequest_id\x18\x04 \x01(\t\x12\r\n\x05\x65rror\x18\x05 \x01(\t\x12$\n\rdecode_policy\x18\x06 \x01(\x0e\x32\r.DecodePolicy\x12\x10\n\x08model_id\x18\x07 \x01(\tB\x17\n\x15_assessment_aestheticB\x17\n\x15_assessment_technical"\x8d\x01\n\nImageChunk\x12\x0c\n\x04path\x18\x01 \x01(\t\x12\x12\n\nrequest_id\x18\x02 \x01(\t\x12\x1e\n\x05heads\x18\x03 \x03(\x0e\x32\x0f.AssessmentHead\x12\x12\n\ntotal_size\x18\x04 \x01(\x04\x12\x0c\n\x04\x64\x61ta\x18\x05 \x01(\x0c\x12\x1b\n\x08priority\x18\x06 \x01(\x0e\x32\t.Priority*O\n\x0e\x41ssessmentHead\x12\x1f\n\x1b\x41SSESSMENT_HEAD_UNSPECIFIED\x10\x00\x12\r\n\tAESTHETIC\x10\x01\x12\r\n\tTECHNICAL\x10\x02*%\n\x08Priority\x12\x08\n\x04\x42ULK\x10\x00\x12\x0f\n\x0bINTERACTIVE\x10\x01*D\n\x0c\x44\x65\x63odePolicy\x12\x13\n\x0f\x46ULL_RESOLUTION\x10\x00\x12\x12\n\x0e\x44\x43T_DOWNSCALED\x10\x01\x12\x0b\n\x07RESIZED\x10\x02\x32\xce\x01\n\x0fImageAssessment\x12;\n\x06\x41ssess\x12\x17.ImageAssessmentRequest\x1a\x18.ImageAssessmentResponse\x12\x45\n\x0c\x41ssessStream\x12\x17.ImageAssessmentRequest\x1a\x18.ImageAssessmentResponse(\x01\x30\x01\x12\x37\n\x0c\x41ssessUpload\x12\x0b.ImageChunk\x1a\x18.ImageAssessmentResponse(\x01\x62\x06proto3'
+)
+
+_globals = globals()
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, "imageassessment_pb2", _globals)
+if not _descriptor._USE_C_DESCRIPTORS:
+    DESCRIPTOR._loaded_options = None
+    _globals["_ASSESSMENTHEAD"]._serialized_start = 565
+    _globals["_ASSESSMENTHEAD"]._serialized_end = 644
+    _globals["_PRIORITY"]._serialized_start = 646
+    _globals["_PRIORITY"]._serialized_end = 683
+    _globals["_DECODEPOLICY"]._serialized_start = 685
+    _globals["_DECODEPOLICY"]._serialized_end = 753
+    _globals["_IMAGEASSESSMENTREQUEST"]._serialized_start = 26
+    _globals["_IMAGEASSESSMENTREQUEST"]._serialized_end = 166
+    _globals["_IMAGEASSESSMENTRESPONSE"]._serialized_start = 169
+    _globals["_IMAGEASSESSMENTRESPONSE"]._serialized_end = 419
+    _globals["_IMAGECHUNK"]._serialized_start = 422
+    _globals["_IMAGECHUNK"]._serialized_end = 563
+    _globals["_IMAGEASSESSMENT"]._serialized_start = 756
+    _globals["_IMAGEASSESSMENT"]._serialized_end = 962
+# @@protoc_insertion_point(module_scope)
@@ -0,0 +1,200 @@
+# Generated by the gRPC Python protocol compiler plugin. DO NOT EDIT!
+"""Client and server classes corresponding to protobuf-defined services."""
+
+import grpc
+import warnings
+
+from imageassessmentservice import imageassessment_pb2 as imageassessment__pb2
+
+GRPC_GENERATED_VERSION = "1.84.0"
+GRPC_VERSION = grpc.__version__
+_version_not_supported = False
+
+try:
+    from grpc._utilities import first_version_is_lower
+
+    _version_not_supported = first_version_is_lower(
+        GRPC_VERSION, GRPC_GENERATED_VERSION
+    )
+except ImportError:
+    _version_not_supported = True
+
+if _version_not_supported:
+    raise RuntimeError(
+        f"The grpc package installed is at version {GRPC_VERSION},"
+        + " but the generated code in imageassessment_pb2_grpc.py depends on"
+        + f" grpcio>={GRPC_GENERATED_VERSION}."
+        + f" Please upgrade your grpc module to grpcio>={GRPC_GENERATED_VERSION}"
+        + f" or downgrade your generated code using grpcio-tools<={GRPC_VERSION}."
+    )
+
+
+class ImageAssessmentStub:
+    """Missing associated documentation comment in .proto file."""
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.Assess = channel.unary_unary(
+            "/ImageAssessment/Assess",
+            request_serializer=imageassessment__pb2.ImageAssessmentRequest.SerializeToString,
+            response_deserializer=imageassessment__pb2.ImageAssessmentResponse.FromString,
+            _registered_method=True,
+        )
+        self.AssessStream = channel.stream_stream(
+            "/ImageAssessment/AssessStream",
+            request_serializer=imageassessment__pb2.ImageAssessmentRequest.SerializeToString,
+            response_deserializer=imageassessment__pb2.ImageAssessmentResponse.FromString,
+            _registered_method=True,
+        )
+        self.AssessUpload = channel.stream_unary(
+            "/ImageAssessment/AssessUpload",
+            request_serializer=imageassessment__pb2.ImageChunk.SerializeToString,
+            response_deserializer=imageassessment__pb2.ImageAssessmentResponse.FromString,
+            _registered_method=True,
+        )
+
+
+class ImageAssessmentServicer:
+    """Missing associated documentation comment in .proto file."""
+
+    def Assess(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def AssessStream(self, request_iterator, context):
+        """Responses may arrive in a different order than the requests"""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def AssessUpload(self, request_iterator, context):
+        """Upload a single image in chunks, e.g. if it exceeds the maximum message size"""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+
+def add_ImageAssessmentServicer_to_server(servicer, server):
+    rpc_method_handlers = {
+        "Assess": grpc.unary_unary_rpc_method_handler(
+            servicer.Assess,
+            request_deserializer=imageassessment__pb2.ImageAssessmentRequest.FromString,
+            response_serializer=imageassessment__pb2.ImageAssessmentResponse.SerializeToString,
+        ),
+        "AssessStream": grpc.stream_stream_rpc_method_handler(
+            servicer.AssessStream,
+            request_deserializer=imageassessment__pb2.ImageAssessmentRequest.FromString,
+            response_serializer=imageassessment__pb2.ImageAssessmentResponse.SerializeToString,
+        ),
+        "AssessUpload": grpc.stream_unary_rpc_method_handler(
+            servicer.AssessUpload,
+            request_deserializer=imageassessment__pb2.ImageChunk.FromString,
+            response_serializer=imageassessment__pb2.ImageAssessmentResponse.SerializeToString,
+        ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+        "ImageAssessment", rpc_method_handlers
+    )
+    server.add_generic_rpc_handlers((generic_handler,))
+    server.add_registered_method_handlers("ImageAssessment", rpc_method_handlers)
+
+
+# This class is part of an EXPERIMENTAL API.
+class ImageAssessment:
+    """Missing associated documentation comment in .proto file."""
+
+    @staticmethod
+    def Assess(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/ImageAssessment/Assess",
+            imageassessment__pb2.ImageAssessmentRequest.SerializeToString,
+            imageassessment__pb2.ImageAssessmentResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
+
+    @staticmethod
+    def AssessStream(
+        request_iterator,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            "/ImageAssessment/AssessStream",
+            imageassessment__pb2.ImageAssessmentRequest.SerializeToString,
+            imageassessment__pb2.ImageAssessmentResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
+
+    @staticmethod
+    def AssessUpload(
+        request_iterator,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            "/ImageAssessment/AssessUpload",
+            imageassessment__pb2.ImageChunk.SerializeToString,
+            imageassessment__pb2.ImageAssessmentResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
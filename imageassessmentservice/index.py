@@ -0,0 +1,239 @@
+import math
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+import pandas as pd
+
+from imageassessmentservice.definitions import ASSESSMENT_HEADS
+
+# Ratings of heads that are not given, and the id of the models that rated the image,
+# are kept unless the file changed
+_RATING_COLUMNS = (*ASSESSMENT_HEADS, "model_id")
+
+_UPSERT_RATING = f"""INSERT INTO Ratings
+    (image_path, size, mtime_ns, {", ".join(_RATING_COLUMNS)})
+    VALUES ({", ".join("?" * (3 + len(_RATING_COLUMNS)))})
+    ON CONFLICT (image_path) DO UPDATE SET
+    {", ".join(
+        f"{column} = COALESCE(excluded.{column}, CASE WHEN size = excluded.size "
+        f"AND mtime_ns = excluded.mtime_ns THEN {column} END)"
+        for column in _RATING_COLUMNS
+    )},
+    size = excluded.size,
+    mtime_ns = excluded.mtime_ns;"""
+
+
+class RatingsIndex:
+    """Sidecar index of raw ratings keyed by image path, file size and modification time.
+
+    Ratings are added while a run is in progress and committed every `flush_interval`
+    ratings, so that an interrupted run can be resumed. Later runs only need to rate
+    images that are not in the index, that changed since they were rated or that lack a
+    rating for one of the requested heads.
+    """
+
+    def __init__(self, index_file: Union[str, Path], flush_interval: int = 100):
+        if flush_interval < 1:
+            raise ValueError("Expect flush_interval to be at least 1.")
+
+        self.flush_interval = flush_interval
+        self._num_unflushed = 0
+
+        self._connection = sqlite3.connect(index_file)
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS Ratings (
+                image_path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                aesthetic REAL,
+                technical REAL,
+                model_id TEXT
+            );""")
+
+        # Indexes of earlier versions lack the id of the models
+        columns = {
+            row[1] for row in self._connection.execute("PRAGMA table_info(Ratings);")
+        }
+        if "model_id" not in columns:
+            self._connection.execute("ALTER TABLE Ratings ADD COLUMN model_id TEXT;")
+
+        self._connection.commit()
+
+    def stale_paths(
+        self, image_paths: Iterable[Path], heads: Sequence[str] = ASSESSMENT_HEADS
+    ) -> List[Path]:
+        """Select images that need to be rated for the given heads.
+
+        Parameters
+        ----------
+        image_paths
+            Paths to images
+        heads
+            Heads for which ratings are required
+
+        Returns
+        -------
+        Paths to images that are not in the index, changed since they were rated or
+        lack a rating for one of the heads
+        """
+        return list(self.iter_stale_paths(image_paths, heads))
+
+    def iter_stale_paths(
+        self, image_paths: Iterable[Path], heads: Sequence[str] = ASSESSMENT_HEADS
+    ) -> Iterator[Path]:
+        """Lazily select images that need to be rated, see `stale_paths`.
+
+        The index is only queried when this method is called, so the returned iterator
+        may be consumed from another thread.
+        """
+        file_states = {
+            image_path: (size, mtime_ns)
+            for image_path, size, mtime_ns in self._connection.execute(
+                "SELECT image_path, size, mtime_ns FROM Ratings "
+                f"WHERE {_rated_condition(heads)};"
+            )
+        }
+
+        def _is_stale(image_path: Path) -> bool:
+            stat = image_path.stat()
+            return file_states.get(str(image_path)) != (stat.st_size, stat.st_mtime_ns)
+
+        return filter(_is_stale, image_paths)
+
+    def is_stale(
+        self, image_path: Path, heads: Sequence[str] = ASSESSMENT_HEADS
+    ) -> bool:
+        """Check whether a single image needs to be rated, see `stale_paths`.
+
+        Only the row of the image is read, which is faster than `stale_paths` for a few
+        images in a large index.
+        """
+        row = self._connection.execute(
+            "SELECT size, mtime_ns FROM Ratings "
+            f"WHERE image_path = ? AND {_rated_condition(heads)};",
+            (str(image_path),),
+        ).fetchone()
+        stat = image_path.stat()
+
+        return row != (stat.st_size, stat.st_mtime_ns)
+
+    def count(self, heads: Sequence[str] = ASSESSMENT_HEADS) -> int:
+        """Number of images with a rating for each of the given heads."""
+        self.flush()
+
+        (num_ratings,) = self._connection.execute(
+            f"SELECT COUNT(*) FROM Ratings WHERE {_rated_condition(heads)};"
+        ).fetchone()
+
+        return num_ratings
+
+    def add(self, rating: Dict[str, Any]) -> None:
+        """Add the raw rating of an image, as obtained from `rate_images`.
+
+        Ratings of heads missing from `rating` are kept if the file did not change.
+        """
+        stat = Path(rating["image_path"]).stat()
+
+        self._connection.execute(
+            _UPSERT_RATING,
+            (
+                str(rating["image_path"]),
+                stat.st_size,
+                stat.st_mtime_ns,
+                *(_optional_rating(rating.get(head)) for head in ASSESSMENT_HEADS),
+                _optional_model_id(rating.get("model_id")),
+            ),
+        )
+        self._num_unflushed += 1
+
+        if self._num_unflushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        self._connection.commit()
+        self._num_unflushed = 0
+
+    def iter_ratings(
+        self,
+        image_paths: Optional[Iterable[Path]],
+        heads: Sequence[str] = ASSESSMENT_HEADS,
+        chunk_size: int = 10000,
+        extra_columns: Sequence[str] = (),
+    ) -> Iterator[pd.DataFrame]:
+        """Read raw ratings of the given images from the index in chunks.
+
+        Parameters
+        ----------
+        image_paths
+            Paths to images, e.g. all images currently found in the source folder, all
+            images in the index if None
+        heads
+            Heads for which ratings are loaded
+        chunk_size
+            Maximum number of ratings per chunk
+        extra_columns
+            Further columns to load, a subset of "size", "mtime_ns" and "model_id"
+
+        Returns
+        -------
+        Chunks of raw ratings of those images that are in the index
+        """
+        self.flush()
+
+        selected_paths = (
+            None if image_paths is None else {str(path) for path in image_paths}
+        )
+
+        for chunk in pd.read_sql_query(
+            f"SELECT {', '.join(['image_path', *heads, *extra_columns])} FROM Ratings;",
+            self._connection,
+            chunksize=chunk_size,
+        ):
+            if selected_paths is not None:
+                chunk = chunk[chunk["image_path"].isin(selected_paths)]
+
+            if not chunk.empty:
+                yield chunk.reset_index(drop=True)
+
+    def load_ratings(
+        self, image_paths: Iterable[Path], heads: Sequence[str] = ASSESSMENT_HEADS
+    ) -> pd.DataFrame:
+        """Load raw ratings of the given images from the index.
+
+        Parameters
+        ----------
+        image_paths
+            Paths to images, e.g. all images currently found in the source folder
+        heads
+            Heads for which ratings are loaded
+
+        Returns
+        -------
+        Dataframe with raw ratings of those images that are in the index
+        """
+        chunks = list(self.iter_ratings(image_paths, heads))
+
+        if not chunks:
+            return pd.DataFrame(columns=["image_path", *heads])
+
+        return pd.concat(chunks, ignore_index=True)
+
+    def close(self) -> None:
+        self.flush()
+        self._connection.close()
+
+
+def _rated_condition(heads: Sequence[str]) -> str:
+    return " AND ".join(f"{head} IS NOT NULL" for head in heads) or "1"
+
+
+def _optional_rating(value: Any) -> Optional[float]:
+    if value is None or math.isnan(value):
+        return None
+
+    return float(value)
+
+
+def _optional_model_id(value: Any) -> Optional[str]:
+    # Ratings loaded from a dataframe have NaN for a missing id
+    return value if isinstance(value, str) and value else None
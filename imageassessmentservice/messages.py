@@ -0,0 +1,156 @@
+import mmap
+import os
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, Sequence
+
+from imageassessmentservice.definitions import DEFAULT_PORT
+from imageassessmentservice.imageassessment_pb2 import (
+    AssessmentHead,
+    ImageAssessmentRequest,
+    ImageAssessmentResponse,
+    ImageChunk,
+    Priority,
+)
+
+DEFAULT_CHUNK_SIZE_KB = 1024
+
+
+def grpc_target(address: str, port: int = DEFAULT_PORT) -> str:
+    """Build the target of a channel, unless the address contains a port already.
+
+    Parameters
+    ----------
+    address
+        Host name or IP address, optionally followed by ":port"
+    port
+        Port used if the address does not contain one
+
+    Returns
+    -------
+    Target in the form "host:port"
+    """
+    host, separator, address_port = address.rpartition(":")
+
+    if separator and address_port.isdigit() and (host.endswith("]") or ":" not in host):
+        return address
+
+    if ":" in address and not address.startswith("["):
+        # IPv6 address
+        return f"[{address}]:{port}"
+
+    return f"{address}:{port}"
+
+
+def build_request(
+    path: str,
+    image_bytes: bytes,
+    heads: Sequence[str],
+    request_id: str = "",
+    priority: str = "bulk",
+) -> ImageAssessmentRequest:
+    """Build a request for assessing an image with the given heads and priority
+    ("bulk" or "interactive")."""
+    return ImageAssessmentRequest(
+        path=path,
+        image_bytes=image_bytes,
+        request_id=request_id,
+        heads=[AssessmentHead.Value(head.upper()) for head in heads],
+        priority=Priority.Value(priority.upper()),
+    )
+
+
+def _generate_chunks(
+    file: BinaryIO,
+    first_chunk: ImageChunk,
+    total_size: int,
+    chunk_size: int,
+) -> Iterator[ImageChunk]:
+    try:
+        if total_size == 0:
+            yield first_chunk
+            return
+
+        # Slicing the memory map copies the data straight from the page cache into the
+        # chunk, without intermediate buffers
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as image_map:
+            for offset in range(0, total_size, chunk_size):
+                chunk = first_chunk if offset == 0 else ImageChunk()
+                chunk.data = image_map[offset : offset + chunk_size]
+                yield chunk
+    finally:
+        file.close()
+
+
+def iter_image_chunks(
+    image_path: Path,
+    heads: Sequence[str],
+    request_id: str = "",
+    chunk_size: int = DEFAULT_CHUNK_SIZE_KB * 1024,
+    priority: str = "bulk",
+) -> Iterator[ImageChunk]:
+    """Split an image into chunks for uploading it with AssessUpload.
+
+    The file is opened right away, so that errors are raised by this function rather
+    than while the chunks are sent.
+
+    Parameters
+    ----------
+    image_path
+        Path to the image
+    heads
+        Heads to run for the image
+    request_id
+        Identifier of the upload
+    chunk_size
+        Maximum number of bytes per chunk
+    priority
+        Priority of the upload, "bulk" or "interactive"
+
+    Returns
+    -------
+    Chunks of the image, the first one carrying the metadata
+    """
+    if chunk_size < 1:
+        raise ValueError("Expect chunk_size to be at least 1.")
+
+    file = open(image_path, "rb")
+
+    try:
+        total_size = os.fstat(file.fileno()).st_size
+    except OSError:
+        file.close()
+        raise
+
+    first_chunk = ImageChunk(
+        path=str(image_path),
+        request_id=request_id,
+        heads=[AssessmentHead.Value(head.upper()) for head in heads],
+        total_size=total_size,
+        priority=Priority.Value(priority.upper()),
+    )
+
+    return _generate_chunks(file, first_chunk, total_size, chunk_size)
+
+
+def rating_from_response(
+    response: ImageAssessmentResponse, heads: Sequence[str]
+) -> Dict[str, Any]:
+    """Extract the ratings of the given heads from a response.
+
+    Heads that the server did not return are mapped to NaN. The id of the models is
+    only included if the server sent it.
+    """
+    rating: Dict[str, Any] = {"image_path": response.path}
+
+    if response.model_id:
+        rating["model_id"] = response.model_id
+
+    for head in heads:
+        field_name = f"assessment_{head}"
+        rating[head] = (
+            getattr(response, field_name)
+            if response.HasField(field_name)
+            else float("nan")
+        )
+
+    return rating
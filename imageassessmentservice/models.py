@@ -0,0 +1,159 @@
+import hashlib
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from imageassessmentservice.definitions import ASSESSMENT_HEADS
+
+
+class Assessment(NamedTuple):
+    # Heads that were not run are None
+    aesthetic: Optional[float] = None
+    technical: Optional[float] = None
+
+    def has_heads(self, heads: Sequence[str]) -> bool:
+        """Whether the assessment contains values for all given heads."""
+        return all(getattr(self, head) is not None for head in heads)
+
+    def select(self, heads: Sequence[str]) -> "Assessment":
+        """Restrict the assessment to the given heads."""
+        return Assessment(
+            **{
+                head: getattr(self, head) if head in heads else None
+                for head in self._fields
+            }
+        )
+
+    def merge(self, other: "Assessment") -> "Assessment":
+        """Combine with another assessment of the same image, preferring its values."""
+        return Assessment(
+            *(
+                value if value is not None else own_value
+                for own_value, value in zip(self, other)
+            )
+        )
+
+
+class AssessmentModel(ABC):
+    """Backend that rates encoded images with respect to aesthetic and technical aspects.
+
+    Implementations receive batches of encoded images from the server's batch scheduler
+    and must return one assessment per image, in the order of the input. `heads` lists the
+    heads that the model has loaded and can run.
+    """
+
+    model_id: str = "unknown"
+    heads: Tuple[str, ...] = ASSESSMENT_HEADS
+    timings: Optional["StageTimings"] = None
+
+    @abstractmethod
+    def assess_batch(
+        self, images: Sequence[bytes], heads: Sequence[str] = ASSESSMENT_HEADS
+    ) -> List[Assessment]:
+        """Assess a batch of encoded images.
+
+        Parameters
+        ----------
+        images
+            Encoded images (e.g. JPEG bytes)
+        heads
+            Heads to run, a subset of the heads of the model
+
+        Returns
+        -------
+        Assessments in the same order as the input images
+        """
+
+
+class StageTimings:
+    """Thread-safe accumulator of the time spent in the stages of the inference path."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = defaultdict(int)
+        self._totals_s: Dict[str, float] = defaultdict(float)
+        self._maxima_s: Dict[str, float] = defaultdict(float)
+
+    @contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        """Measure the time spent in the body of the with statement."""
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage: str, duration_s: float) -> None:
+        with self._lock:
+            self._counts[stage] += 1
+            self._totals_s[stage] += duration_s
+            self._maxima_s[stage] = max(self._maxima_s[stage], duration_s)
+
+    def reset(self) -> None:
+        """Discard all measurements, e.g. those of a warm-up."""
+        with self._lock:
+            self._counts.clear()
+            self._totals_s.clear()
+            self._maxima_s.clear()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Number of measurements, mean and maximum duration in ms for each stage."""
+        with self._lock:
+            return {
+                stage: {
+                    "count": count,
+                    "mean_ms": 1000 * self._totals_s[stage] / count,
+                    "max_ms": 1000 * self._maxima_s[stage],
+                }
+                for stage, count in self._counts.items()
+            }
+
+
+class FakeModel(AssessmentModel):
+    """Deterministic stand-in for the MUSIQ models with a configurable cost.
+
+    Ratings are derived from the digest of the image, so that the same image always gets
+    the same rating. Each call sleeps for `fixed_cost_ms` plus `per_image_cost_ms` for
+    every image of the batch, mimicking models with a fixed cost per call.
+    """
+
+    model_id = "fake-1"
+    timings: StageTimings
+
+    def __init__(
+        self,
+        fixed_cost_ms: float = 20.0,
+        per_image_cost_ms: float = 5.0,
+        heads: Sequence[str] = ASSESSMENT_HEADS,
+    ):
+        self.fixed_cost_ms = fixed_cost_ms
+        self.per_image_cost_ms = per_image_cost_ms
+        self.heads = tuple(heads)
+        self.timings = StageTimings()
+
+    def assess_batch(
+        self, images: Sequence[bytes], heads: Sequence[str] = ASSESSMENT_HEADS
+    ) -> List[Assessment]:
+        with self.timings.measure("batch"):
+            time.sleep(
+                (self.fixed_cost_ms + self.per_image_cost_ms * len(images)) / 1000
+            )
+
+            assessments = []
+
+            for image_bytes in images:
+                digest = hashlib.sha256(image_bytes).digest()
+                # Same value ranges as the MUSIQ models for AVA and PaQ-2-PiQ
+                ratings = {
+                    "aesthetic": 1.0 + 9.0 * digest[0] / 255,
+                    "technical": 100.0 * digest[1] / 255,
+                }
+                assessments.append(
+                    Assessment(**{head: ratings[head] for head in heads})
+                )
+
+        return assessments
@@ -0,0 +1,185 @@
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import pandas as pd
+
+
+def _import_pyarrow() -> Any:
+    """Import pyarrow, which is only needed for Parquet ratings files."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError(
+            "Parquet ratings files require pyarrow, install it with "
+            "`pip install imageassessmentservice[parquet]`."
+        ) from e
+
+    return pyarrow
+
+
+def ratings_schema(heads: Sequence[str], extra_columns: Sequence[str] = ()) -> Any:
+    """Arrow schema of a Parquet ratings file.
+
+    Paths and model ids repeat within the file and are dictionary-encoded, scores are
+    stored as float32 and bins as int16. Images without a rating have bin -1 and no
+    scores.
+
+    Parameters
+    ----------
+    heads
+        Heads whose raw and normalized ratings are stored
+    extra_columns
+        Further columns, a subset of "group_id" and "group_rank"
+    """
+    pa = _import_pyarrow()
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+
+    return pa.schema(
+        [
+            ("image_path", dictionary),
+            ("rating_new", pa.int16()),
+            *((head, pa.float32()) for head in heads),
+            *((f"{head}_normalized", pa.float32()) for head in heads),
+            ("overall", pa.float32()),
+            ("size", pa.int64()),
+            ("mtime", pa.timestamp("ns", tz="UTC")),
+            ("model_id", dictionary),
+            *((column, pa.int32()) for column in extra_columns),
+        ]
+    )
+
+
+def _file_states(image_paths: Sequence[str]) -> pd.DataFrame:
+    """Size and modification time of files, missing if a file no longer exists."""
+    states: List[Dict[str, Optional[int]]] = []
+
+    for image_path in image_paths:
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            states.append({"size": None, "mtime_ns": None})
+        else:
+            states.append({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+
+    return pd.DataFrame(states, columns=["size", "mtime_ns"], dtype="Int64")
+
+
+class ParquetRatingsWriter:
+    """Writes ratings to a Parquet file in row groups, as chunks of ratings arrive.
+
+    Only the current chunk is held in memory, so that the ratings of a large library can
+    be written while they are streamed from the index. Readers can load single columns,
+    e.g. the paths and bins, without parsing the rest of the file.
+
+    Parameters
+    ----------
+    ratings_file
+        Path of the Parquet file, which is overwritten
+    heads
+        Heads whose raw and normalized ratings are stored
+    extra_columns
+        Further columns, see `ratings_schema`
+    row_group_size
+        Maximum number of rows per row group
+    """
+
+    def __init__(
+        self,
+        ratings_file: Union[str, Path],
+        heads: Sequence[str],
+        extra_columns: Sequence[str] = (),
+        row_group_size: int = 65536,
+    ):
+        self._pa = _import_pyarrow()
+        self.schema = ratings_schema(heads, extra_columns)
+        self.row_group_size = row_group_size
+        self.num_rows = 0
+        self._writer = self._pa.parquet.ParquetWriter(
+            ratings_file, self.schema, compression="zstd"
+        )
+
+    def write(self, chunk: pd.DataFrame) -> None:
+        """Append a chunk of ratings.
+
+        Columns of the schema that are missing from the chunk are left empty, except for
+        the size and modification time of the files, which are then read from the
+        filesystem.
+        """
+        pa = self._pa
+        image_paths = [str(image_path) for image_path in chunk["image_path"]]
+        file_states = (
+            chunk[["size", "mtime_ns"]].reset_index(drop=True)
+            if "size" in chunk and "mtime_ns" in chunk
+            else _file_states(image_paths)
+        )
+
+        columns = []
+
+        for field in self.schema:
+            if field.name == "image_path":
+                values: Any = image_paths
+            elif field.name == "mtime":
+                values = pd.to_datetime(file_states["mtime_ns"], unit="ns", utc=True)
+            elif field.name == "size":
+                values = file_states["size"]
+            elif field.name in chunk:
+                values = chunk[field.name].reset_index(drop=True)
+            else:
+                columns.append(pa.nulls(len(chunk), field.type))
+                continue
+
+            if pa.types.is_dictionary(field.type):
+                array = pa.array(
+                    values, field.type.value_type, from_pandas=True
+                ).dictionary_encode()
+            else:
+                array = pa.array(values, field.type, from_pandas=True)
+
+            columns.append(array)
+
+        self._writer.write_table(
+            pa.Table.from_arrays(columns, schema=self.schema),
+            row_group_size=self.row_group_size,
+        )
+        self.num_rows += len(chunk)
+
+    def close(self) -> None:
+        self._writer.close()
+
+    def __enter__(self) -> "ParquetRatingsWriter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def read_ratings(
+    ratings_file: Union[str, Path], columns: Optional[Sequence[str]] = None
+) -> pd.DataFrame:
+    """Read a CSV or Parquet ratings file written by the client.
+
+    Parameters
+    ----------
+    ratings_file
+        Path of the ratings file, the format is chosen by its suffix
+    columns
+        Columns to load, all columns if None. Only these columns are read from Parquet
+        files.
+
+    Returns
+    -------
+    Dataframe with the ratings, with categorical paths for Parquet files
+    """
+    ratings_file_path = Path(ratings_file)
+
+    if ratings_file_path.suffix == ".parquet":
+        pa = _import_pyarrow()
+        return pa.parquet.read_table(
+            ratings_file_path, columns=None if columns is None else list(columns)
+        ).to_pandas()
+
+    return pd.read_csv(
+        ratings_file_path, usecols=None if columns is None else list(columns)
+    )
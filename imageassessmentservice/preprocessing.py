@@ -0,0 +1,413 @@
+import collections
+import io
+import mmap
+import multiprocessing
+import struct
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from PIL import Image
+
+from imageassessmentservice.definitions import RAW_IMAGE_EXTENSIONS
+from imageassessmentservice.headers import jpeg_frame
+
+_EXIF_ORIENTATION = 0x0112
+
+# Transpositions that undo each EXIF orientation
+_ORIENTATION_TRANSPOSES = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+# TIFF tags that locate embedded JPEG previews in RAW files
+_TIFF_COMPRESSION = 0x0103
+_TIFF_STRIP_OFFSETS = 0x0111
+_TIFF_STRIP_BYTE_COUNTS = 0x0117
+_TIFF_SUB_IFDS = 0x014A
+_TIFF_JPEG_OFFSET = 0x0201
+_TIFF_JPEG_LENGTH = 0x0202
+# Old-style and new-style JPEG compression
+_TIFF_JPEG_COMPRESSIONS = (6, 7)
+# Formats of the SHORT, LONG and IFD types
+_TIFF_TYPE_FORMATS = {3: "H", 4: "I", 13: "I"}
+_MAX_IFDS = 32
+
+# Start of frame markers of JPEGs that Pillow and the server can decode (baseline,
+# extended and progressive). RAW data is often stored as lossless JPEG instead.
+_DECODABLE_JPEG_FRAMES = (0xC0, 0xC1, 0xC2)
+
+
+class PreprocessedImage(NamedTuple):
+    image_bytes: bytes
+    original_bytes: int
+    original_pixels: int
+    pixels: int
+    duration_s: float
+
+
+class _JpegPreview(NamedTuple):
+    offset: int
+    length: int
+    width: int
+    height: int
+
+
+def _read_ifd(
+    data: Any, byte_order: str, offset: int
+) -> Tuple[Dict[int, Tuple[int, ...]], int]:
+    """Read the integer tags of a TIFF image file directory and the offset of the
+    next directory."""
+    (num_entries,) = struct.unpack_from(byte_order + "H", data, offset)
+    tags = {}
+
+    for index in range(num_entries):
+        tag, tag_type, count, value = struct.unpack_from(
+            byte_order + "HHI4s", data, offset + 2 + 12 * index
+        )
+        value_format = _TIFF_TYPE_FORMATS.get(tag_type)
+
+        # Long arrays, such as the strips of the raw data, are not needed
+        if value_format is None or count > 64:
+            continue
+
+        value_format = byte_order + value_format * count
+
+        if struct.calcsize(value_format) > 4:
+            (value_offset,) = struct.unpack(byte_order + "I", value)
+            tags[tag] = struct.unpack_from(value_format, data, value_offset)
+        else:
+            tags[tag] = struct.unpack_from(value_format, value)
+
+    (next_offset,) = struct.unpack_from(
+        byte_order + "I", data, offset + 2 + 12 * num_entries
+    )
+
+    return tags, next_offset
+
+
+def find_raw_previews(data: Any) -> Tuple[List[_JpegPreview], int]:
+    """Locate the JPEG previews embedded in a TIFF-based RAW file.
+
+    CR2, NEF, ARW and DNG files store one or more JPEG previews next to the raw data,
+    referenced from the image file directories of the TIFF structure.
+
+    Returns
+    -------
+    Decodable previews and the EXIF orientation of the RAW image (1 if unknown)
+    """
+    if data[:2] == b"II":
+        byte_order = "<"
+    elif data[:2] == b"MM":
+        byte_order = ">"
+    else:
+        raise ValueError("Expect a TIFF-based RAW file.")
+
+    (first_offset,) = struct.unpack_from(byte_order + "I", data, 4)
+    offsets = [first_offset]
+    visited: Set[int] = set()
+    previews = []
+    orientation = 1
+
+    while offsets and len(visited) < _MAX_IFDS:
+        offset = offsets.pop(0)
+
+        if offset == 0 or offset in visited or offset + 2 > len(data):
+            continue
+
+        visited.add(offset)
+        tags, next_offset = _read_ifd(data, byte_order, offset)
+        offsets.append(next_offset)
+        offsets.extend(tags.get(_TIFF_SUB_IFDS, ()))
+
+        if len(visited) == 1:
+            orientation = tags.get(_EXIF_ORIENTATION, (1,))[0]
+
+        locations = []
+
+        if _TIFF_JPEG_OFFSET in tags and _TIFF_JPEG_LENGTH in tags:
+            locations.append((tags[_TIFF_JPEG_OFFSET][0], tags[_TIFF_JPEG_LENGTH][0]))
+
+        if (
+            tags.get(_TIFF_COMPRESSION, (None,))[0] in _TIFF_JPEG_COMPRESSIONS
+            and len(tags.get(_TIFF_STRIP_OFFSETS, ())) == 1
+            and len(tags.get(_TIFF_STRIP_BYTE_COUNTS, ())) == 1
+        ):
+            locations.append(
+                (tags[_TIFF_STRIP_OFFSETS][0], tags[_TIFF_STRIP_BYTE_COUNTS][0])
+            )
+
+        for preview_offset, length in locations:
+            frame = jpeg_frame(data, preview_offset, length)
+
+            if frame is not None and frame[0] in _DECODABLE_JPEG_FRAMES:
+                previews.append(_JpegPreview(preview_offset, length, *frame[1:]))
+
+    return previews, orientation
+
+
+def _open_raw_preview(image_path: Path, max_size: int) -> Tuple[Image.Image, int]:
+    """Open the smallest JPEG preview of a RAW file that covers the maximum size, or
+    the largest preview if none does.
+
+    Returns
+    -------
+    Preview and the EXIF orientation of the RAW image
+    """
+    with open(image_path, "rb") as file, mmap.mmap(
+        file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        previews, orientation = find_raw_previews(data)
+
+        if not previews:
+            raise ValueError(f"No JPEG preview found in {image_path}.")
+
+        previews.sort(key=lambda preview: max(preview.width, preview.height))
+        preview = next(
+            (
+                preview
+                for preview in previews
+                if max_size > 0 and max(preview.width, preview.height) >= max_size
+            ),
+            previews[-1],
+        )
+        image = Image.open(
+            io.BytesIO(data[preview.offset : preview.offset + preview.length])
+        )
+
+    return image, orientation
+
+
+def preprocess_image(
+    image_path: Path, max_size: int = 1024, quality: int = 90
+) -> PreprocessedImage:
+    """Prepare an image for assessment.
+
+    The image is rotated according to its EXIF orientation, downscaled such that its
+    longer side is at most `max_size` pixels and encoded as JPEG. RAW files are
+    replaced with their embedded JPEG preview, without decoding the raw data. JPEGs that
+    need neither rotation nor downscaling are passed on unchanged.
+
+    Parameters
+    ----------
+    image_path
+        Path to the image
+    max_size
+        Maximum length of the longer side in pixels, 0 keeps the resolution
+    quality
+        JPEG quality of re-encoded images
+
+    Returns
+    -------
+    Encoded image and its size compared with the original
+    """
+    start = time.perf_counter()
+    original_bytes = image_path.stat().st_size
+
+    if image_path.suffix.lower() in RAW_IMAGE_EXTENSIONS:
+        # The server cannot decode RAW files, so the preview counts as the original
+        image, orientation = _open_raw_preview(image_path, max_size)
+        is_original = False
+    else:
+        image = Image.open(image_path)
+        orientation = 1
+        is_original = True
+
+    with image:
+        orientation = image.getexif().get(_EXIF_ORIENTATION, orientation)
+        original_pixels = image.width * image.height
+
+        if (
+            is_original
+            and image.format == "JPEG"
+            and orientation == 1
+            and (max_size == 0 or max(image.size) <= max_size)
+        ):
+            return PreprocessedImage(
+                image_path.read_bytes(),
+                original_bytes,
+                original_pixels,
+                original_pixels,
+                time.perf_counter() - start,
+            )
+
+        if max_size > 0:
+            # JPEGs are decoded at a reduced scale, which is much faster than decoding
+            # the full image and downscaling it afterwards
+            image.draft("RGB", (max_size, max_size))
+
+        prepared = image.convert("RGB")
+
+    if orientation in _ORIENTATION_TRANSPOSES:
+        prepared = prepared.transpose(_ORIENTATION_TRANSPOSES[orientation])
+
+    if max_size > 0:
+        prepared.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+
+    buffer = io.BytesIO()
+    prepared.save(buffer, "JPEG", quality=quality)
+
+    return PreprocessedImage(
+        buffer.getvalue(),
+        original_bytes,
+        original_pixels,
+        prepared.width * prepared.height,
+        time.perf_counter() - start,
+    )
+
+
+class Preprocessor:
+    """Prepares images on a process pool while they are sent to the service.
+
+    `prefetch` passes paths on unchanged, but starts preprocessing them ahead of time,
+    and `load` returns the prepared image of a path, which can be used in place of
+    reading the file. The transferred bytes and the pixels the server decodes are
+    recorded, so that the savings can be reported.
+
+    Parameters
+    ----------
+    max_size
+        Maximum length of the longer side of the images in pixels, 0 keeps the
+        resolution
+    quality
+        JPEG quality of re-encoded images
+    max_workers
+        Number of processes, the number of CPUs if None
+    lookahead
+        Number of images preprocessed ahead of being sent, twice the number of
+        processes if None
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        quality: int = 90,
+        max_workers: Optional[int] = None,
+        lookahead: Optional[int] = None,
+    ):
+        if max_size < 0:
+            raise ValueError("Expect max_size to be non-negative.")
+
+        if not 1 <= quality <= 100:
+            raise ValueError("Expect quality to be between 1 and 100.")
+
+        self._max_size = max_size
+        self._quality = quality
+        # Spawned rather than forked, as forking a process with gRPC channels is unsafe
+        self._executor = ProcessPoolExecutor(
+            max_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self._lookahead = (
+            lookahead
+            if lookahead is not None
+            else 2 * (max_workers or multiprocessing.cpu_count())
+        )
+        self._lock = threading.Lock()
+        self._futures: Dict[Path, "Future[PreprocessedImage]"] = {}
+
+        self.num_images = 0
+        self.original_bytes = 0
+        self.preprocessed_bytes = 0
+        self.original_pixels = 0
+        self.pixels = 0
+        self.duration_s = 0.0
+
+    def __enter__(self) -> "Preprocessor":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def _submit(self, image_path: Path) -> "Future[PreprocessedImage]":
+        return self._executor.submit(
+            preprocess_image, image_path, self._max_size, self._quality
+        )
+
+    def prefetch(self, image_paths: Iterable[Path]) -> Iterator[Path]:
+        """Pass on paths, while the images up to `lookahead` paths ahead are being
+        preprocessed."""
+        pending: Deque[Path] = collections.deque()
+
+        for image_path in image_paths:
+            with self._lock:
+                if image_path not in self._futures:
+                    self._futures[image_path] = self._submit(image_path)
+
+            pending.append(image_path)
+
+            if len(pending) > self._lookahead:
+                yield pending.popleft()
+
+        yield from pending
+
+    def load(self, image_path: Path) -> bytes:
+        """Return the preprocessed image, waiting for it if necessary.
+
+        Raises
+        ------
+        OSError
+            If the image cannot be read or preprocessed
+        """
+        with self._lock:
+            future = self._futures.pop(image_path, None)
+
+        if future is None:
+            future = self._submit(image_path)
+
+        try:
+            result = future.result()
+        except Exception as e:
+            raise OSError(f"Cannot preprocess image {image_path}: {e}") from e
+
+        with self._lock:
+            self.num_images += 1
+            self.original_bytes += result.original_bytes
+            self.preprocessed_bytes += len(result.image_bytes)
+            self.original_pixels += result.original_pixels
+            self.pixels += result.pixels
+            self.duration_s += result.duration_s
+
+        return result.image_bytes
+
+    def summary(self) -> Dict[str, Any]:
+        """Bytes and pixels of the original and the preprocessed images."""
+        with self._lock:
+            return {
+                "num_images": self.num_images,
+                "original_mb": self.original_bytes / 1024**2,
+                "preprocessed_mb": self.preprocessed_bytes / 1024**2,
+                "bytes_saved": 1
+                - self.preprocessed_bytes / max(self.original_bytes, 1),
+                "original_megapixels": self.original_pixels / 1e6,
+                "megapixels": self.pixels / 1e6,
+                "pixels_saved": 1 - self.pixels / max(self.original_pixels, 1),
+                "preprocessing_s": self.duration_s,
+            }
+
+    def close(self) -> None:
+        # Images that were prefetched but not sent, e.g. after the stream failed
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+
+            self._futures.clear()
+
+        self._executor.shutdown(wait=True)
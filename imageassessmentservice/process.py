@@ -1,108 +1,239 @@
+import os
 import shutil
 import sqlite3
-from pathlib import Path
-from typing import Any
+from concurrent.futures import as_completed, ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
 import fire
 import pandas as pd
 from tqdm import tqdm
 
+from imageassessmentservice.output import read_ratings
 
-def build_rating_update_command(image_id, rating):
-    command = f"""UPDATE ImageInformation
-    SET rating = {rating}
-    WHERE
-        imageid = {image_id};"""
-    return command
+RATING_UPDATE_COMMAND = "UPDATE ImageInformation SET rating = ? WHERE imageid = ?;"
 
 
-# TODO: Add tests
-def update_rating(connection: Any, image_id: str, rating: int) -> None:
-    """
-    Update rating of image in Digikam database
+class RatingUpdateSummary(NamedTuple):
+    updated: int
+    skipped: int
+    failed: int
 
-    Parameters
-    ----------
-    connection
-        SQLite connection to Digikam database
-    image_id
-        ID of image to update
-    rating
-        New rating of image
-    """
-    cursor = connection.cursor()
-    command = build_rating_update_command(image_id, rating)
 
-    cursor.execute(command)
+def _execute_batch(
+    connection: sqlite3.Connection, batch: List[Tuple[int, int]]
+) -> Tuple[int, int]:
+    try:
+        with connection:
+            connection.executemany(RATING_UPDATE_COMMAND, batch)
+        return len(batch), 0
+    except sqlite3.Error:
+        pass
+
+    # The transaction of the batch was rolled back, so retry row by row to find the
+    # updates that fail
+    num_updated = 0
 
-    connection.commit()
+    for rating, image_id in batch:
+        try:
+            with connection:
+                connection.execute(RATING_UPDATE_COMMAND, (rating, image_id))
+            num_updated += 1
+        except sqlite3.Error as e:
+            print(f"Failed to update rating for image {image_id}: {e}")
+
+    return num_updated, len(batch) - num_updated
 
 
-# TODO: Add tests
-def load_digikam_image_data(database_file_path: Path) -> pd.DataFrame:
+def write_ratings(
+    database_file_path: Path,
+    ratings: Iterable[Tuple[int, int, int]],
+    batch_size: int = 1000,
+    fast_pragmas: bool = False,
+) -> RatingUpdateSummary:
     """
-    Load image data from Digikam database
+    Write ratings to the Digikam database in batched transactions.
 
     Parameters
     ----------
     database_file_path
         Path to Digikam database file (digikam4.db)
+    ratings
+        Tuples of image ID, old rating and new rating. Images with negative new ratings
+        or unchanged ratings are skipped.
+    batch_size
+        Number of updates per transaction
+    fast_pragmas
+        Switch the database to WAL journaling with relaxed synchronization for the
+        duration of the import. The previous journal mode is restored afterwards.
 
     Returns
     -------
-    Dataframe with relevant information from Digikam database
+    Number of updated, skipped and failed images
     """
+    if batch_size < 1:
+        raise ValueError("Expect batch_size to be at least 1.")
+
+    num_updated = 0
+    num_skipped = 0
+    num_failed = 0
+
     connection = sqlite3.connect(database_file_path)
+    journal_mode = None
+
+    try:
+        if fast_pragmas:
+            (journal_mode,) = connection.execute("PRAGMA journal_mode;").fetchone()
+            connection.execute("PRAGMA journal_mode=WAL;")
+            connection.execute("PRAGMA synchronous=NORMAL;")
+
+        batch: List[Tuple[int, int]] = []
+
+        for image_id, rating_old, rating_new in ratings:
+            if rating_new < 0 or rating_old == rating_new:
+                num_skipped += 1
+                continue
+
+            batch.append((int(rating_new), int(image_id)))
+
+            if len(batch) == batch_size:
+                updated, failed = _execute_batch(connection, batch)
+                num_updated += updated
+                num_failed += failed
+                batch = []
+
+        if batch:
+            updated, failed = _execute_batch(connection, batch)
+            num_updated += updated
+            num_failed += failed
+    finally:
+        # Also after a failed import, so that the database is not left in WAL mode
+        if journal_mode is not None:
+            connection.rollback()
+            connection.execute(f"PRAGMA journal_mode={journal_mode};")
+
+        connection.close()
+
+    return RatingUpdateSummary(num_updated, num_skipped, num_failed)
+
+
+# The relative path of the album root itself is "/"
+_DIGIKAM_FULL_PATH = """? || AlbumRoots.specificPath
+    || RTRIM(Albums.relativePath, '/') || '/' || Images.name"""
+
+DIGIKAM_IMAGE_DATA_QUERY = f"""SELECT
+    Images.id AS image_id,
+    ImageInformation.rating AS rating_old,
+    {_DIGIKAM_FULL_PATH} AS full_path
+FROM Images
+JOIN Albums ON Images.album = Albums.id
+JOIN AlbumRoots ON Albums.albumRoot = AlbumRoots.id
+JOIN ImageInformation ON ImageInformation.imageid = Images.id"""
+
+# Candidates are found through the (indexed) file names of the selected paths, and
+# only then compared by their full path
+DIGIKAM_SELECTED_IMAGE_DATA_QUERY = f"""SELECT
+    Images.id AS image_id,
+    ImageInformation.rating AS rating_old,
+    SelectedPaths.path AS full_path
+FROM SelectedPaths
+JOIN Images ON Images.name = SelectedPaths.name
+JOIN Albums ON Images.album = Albums.id
+JOIN AlbumRoots ON Albums.albumRoot = AlbumRoots.id
+JOIN ImageInformation ON ImageInformation.imageid = Images.id
+WHERE {_DIGIKAM_FULL_PATH} = SelectedPaths.path"""
+
+
+def iter_digikam_image_data(
+    database_file_path: Path,
+    image_paths: Optional[Iterable[str]] = None,
+    album_root_prefix: str = "/home",
+    chunk_size: int = 10000,
+) -> Iterator[pd.DataFrame]:
+    """
+    Load image data from Digikam database in chunks
 
-    album_roots_table = pd.read_sql_query(
-        "SELECT id, specificPath FROM AlbumRoots;", connection
-    )
-    album_roots_table.rename(columns={"id": "album_root_id"}, inplace=True)
+    The tables are joined and the full paths are built inside SQLite.
 
-    albums_table = pd.read_sql_query(
-        "SELECT id, albumRoot, relativePath FROM Albums;", connection
-    )
-    albums_table.rename(
-        columns={"id": "album_id", "albumRoot": "album_root_id"}, inplace=True
-    )
+    Parameters
+    ----------
+    database_file_path
+        Path to Digikam database file (digikam4.db)
+    image_paths
+        Full paths of the images to load, all images if None
+    album_root_prefix
+        Prefix of the album root paths stored in the database (Digikam stores them
+        relative to the mount point of the volume)
+    chunk_size
+        Maximum number of images per chunk
 
-    images_table = pd.read_sql_query("SELECT id, album, name FROM Images;", connection)
-    images_table.rename(columns={"id": "image_id", "album": "album_id"}, inplace=True)
+    Returns
+    -------
+    Chunks with image ID, old rating and full path of the images
+    """
+    connection = sqlite3.connect(f"file:{database_file_path}?mode=ro", uri=True)
+
+    try:
+        if image_paths is None:
+            query = DIGIKAM_IMAGE_DATA_QUERY
+        else:
+            # The temporary table lives outside of the read-only database file
+            connection.execute(
+                "CREATE TEMP TABLE SelectedPaths (path TEXT PRIMARY KEY, name TEXT);"
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO SelectedPaths VALUES (?, ?);",
+                ((str(path), PurePosixPath(path).name) for path in image_paths),
+            )
+            connection.execute(
+                "CREATE INDEX temp.SelectedPathsName ON SelectedPaths (name);"
+            )
+            query = DIGIKAM_SELECTED_IMAGE_DATA_QUERY
+
+        yield from pd.read_sql_query(
+            query, connection, params=(album_root_prefix,), chunksize=chunk_size
+        )
+    finally:
+        connection.close()
 
-    image_information_table = pd.read_sql_query(
-        "SELECT imageid, rating FROM ImageInformation;", connection
-    )
-    image_information_table.rename(
-        columns={"imageid": "image_id", "rating": "rating_old"}, inplace=True
-    )
 
-    data_table = images_table.merge(
-        albums_table, left_on="album_id", right_on="album_id"
-    )
-    data_table = data_table.merge(
-        album_roots_table, left_on="album_root_id", right_on="album_root_id"
-    )
-    data_table = data_table.merge(
-        image_information_table, left_on="image_id", right_on="image_id"
-    )
+def load_digikam_image_data(
+    database_file_path: Path,
+    image_paths: Optional[Iterable[str]] = None,
+    album_root_prefix: str = "/home",
+) -> pd.DataFrame:
+    """
+    Load image data from Digikam database
 
-    data_table["full_path"] = data_table.apply(
-        lambda x: "/home" + x["specificPath"] + x["relativePath"] + "/" + x["name"],
-        axis=1,
-    )
-    # Here we can drop even more columns as only fullPath and rating are required
-    data_table.drop(
-        columns=["album_id", "name", "album_root_id", "relativePath", "specificPath"],
-        inplace=True,
+    Parameters
+    ----------
+    database_file_path
+        Path to Digikam database file (digikam4.db)
+    image_paths
+        Full paths of the images to load, all images if None
+    album_root_prefix
+        Prefix of the album root paths stored in the database
+
+    Returns
+    -------
+    Dataframe with relevant information from Digikam database
+    """
+    chunks = list(
+        iter_digikam_image_data(database_file_path, image_paths, album_root_prefix)
     )
 
-    return data_table
+    if not chunks:
+        return pd.DataFrame(columns=["image_id", "rating_old", "full_path"])
+
+    return pd.concat(chunks, ignore_index=True)
 
 
-# TODO: Add tests
 def store_to_digikam_db(
     database_file: str,
     ratings_file: str,
+    batch_size: int = 1000,
+    fast_pragmas: bool = False,
+    album_root_prefix: str = "/home",
 ):
     """Store results of image assessment in SQLite database for Digikam
 
@@ -111,7 +242,14 @@ def store_to_digikam_db(
     database_file
         Path to file containing the SQLite database (digikam4.db)
     ratings_file
-        Table containing paths to image files and ratings
+        CSV or Parquet file containing paths to image files and ratings
+    batch_size
+        Number of rating updates per transaction
+    fast_pragmas
+        Use WAL journaling with relaxed synchronization for the duration of the import
+    album_root_prefix
+        Prefix of the album root paths stored in the database, i.e. the mount point of
+        the volume containing the images
     """
     database_file_path = Path(database_file)
     ratings_file_path = Path(ratings_file)
@@ -125,30 +263,32 @@ def store_to_digikam_db(
     if not ratings_file_path.exists():
         raise FileNotFoundError("Cannot find file with ratings.")
 
-    # Load and merge tables
-    data_table = load_digikam_image_data(database_file_path)
-
     # Load ratings
-    int_ratings = pd.read_csv(ratings_file_path)
+    int_ratings = read_ratings(ratings_file_path, ["image_path", "rating_new"])
+    int_ratings = int_ratings[int_ratings["rating_new"] >= 0]
+
+    # Load data of the rated images from the database
+    data_table = load_digikam_image_data(
+        database_file_path, int_ratings["image_path"], album_root_prefix
+    )
     merged_table = int_ratings.merge(
         data_table, left_on="image_path", right_on="full_path"
     )
 
     # Update ratings
-    for _, row in merged_table.iterrows():
-        image_id, image_path, rating_new = row[["image_id", "image_path", "rating_new"]]
-
-        if rating_new < 0:
-            continue
-
-        try:
-            connection_for_update = sqlite3.connect(database_file_path)
+    summary = write_ratings(
+        database_file_path,
+        merged_table[["image_id", "rating_old", "rating_new"]].itertuples(
+            index=False, name=None
+        ),
+        batch_size,
+        fast_pragmas,
+    )
 
-            print("Updating ", image_path)
-            update_rating(connection_for_update, image_id, rating_new)
-        except Exception as e:
-            print(e)
-            print("Failed to update rating for ", image_path)
+    print(
+        f"Updated {summary.updated} ratings, skipped {summary.skipped} images "
+        f"without new or changed rating, failed to update {summary.failed} ratings."
+    )
 
 
 def build_target_path(
@@ -174,23 +314,210 @@ def build_target_path(
     return relative_target / rel_file_path
 
 
+PLACEMENT_STRATEGIES = ("copy", "hardlink", "symlink", "reflink")
+
+# ioctl request to clone a file on Linux filesystems with copy-on-write support
+# (btrfs, XFS, ...), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+class SortSummary(NamedTuple):
+    placed: int
+    skipped: int
+    failed: int
+
+
+def _reflink(source_path: Path, target_path: Path) -> None:
+    """Clone a file if the filesystem supports it and copy it otherwise."""
+    try:
+        import fcntl
+
+        with open(source_path, "rb") as source, open(target_path, "wb") as target:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+    except (ImportError, OSError):
+        shutil.copy2(source_path, target_path)
+    else:
+        shutil.copystat(source_path, target_path)
+
+
 class ImageSorter:
-    def __init__(self, source_path: Path, target_path: Path):
+    """
+    Place images in folders according to their rating.
+
+    Parameters
+    ----------
+    source_path
+        Folder relative to which the paths of the images are taken
+    target_path
+        Folder in which a sub-folder is created for each rating
+    strategy
+        How images are placed in the target folder, one of "copy", "hardlink",
+        "symlink" and "reflink" (copy-on-write clone, falls back to copying if the
+        filesystem does not support it)
+    max_workers
+        Maximum number of images that are placed concurrently
+    """
+
+    def __init__(
+        self,
+        source_path: Path,
+        target_path: Path,
+        strategy: str = "copy",
+        max_workers: int = 8,
+    ):
+        if strategy not in PLACEMENT_STRATEGIES:
+            raise ValueError(f"Expect strategy to be one of {PLACEMENT_STRATEGIES}.")
+
+        if max_workers < 1:
+            raise ValueError("Expect max_workers to be at least 1.")
+
         self.source_path = source_path
         self.target_path = target_path
+        self.strategy = strategy
+        self.max_workers = max_workers
 
-    def sort(self, image_path: Path, int_rating: int):
-
-        print(f"Image of category {int_rating}.")
-        target_path = build_target_path(
+    def _target_path(self, image_path: Path, int_rating: int) -> Path:
+        return build_target_path(
             image_path, self.source_path, self.target_path / f"{int_rating}"
         )
+
+    def _is_placed(self, image_path: Path, target_path: Path) -> bool:
+        """Check whether the target is already the result of placing the image."""
+        if self.strategy == "symlink":
+            return (
+                target_path.is_symlink()
+                and Path(os.readlink(target_path)) == image_path.absolute()
+            )
+
+        if target_path.is_symlink() or not target_path.exists():
+            return False
+
+        if self.strategy == "hardlink":
+            return target_path.samefile(image_path)
+
+        # Copies keep the modification time of the source
+        source_stat = image_path.stat()
+        target_stat = target_path.stat()
+        return (
+            source_stat.st_size == target_stat.st_size
+            and source_stat.st_mtime_ns == target_stat.st_mtime_ns
+        )
+
+    def _place(self, image_path: Path, target_path: Path) -> bool:
+        """Place image at the target path, returns False if it was already there."""
+        if self._is_placed(image_path, target_path):
+            return False
+
+        if target_path.is_symlink() or target_path.exists():
+            target_path.unlink()
+
+        if self.strategy == "hardlink":
+            os.link(image_path, target_path)
+        elif self.strategy == "symlink":
+            target_path.symlink_to(image_path.absolute())
+        elif self.strategy == "reflink":
+            _reflink(image_path, target_path)
+        else:
+            shutil.copy2(image_path, target_path)
+
+        return True
+
+    def sort(self, image_path: Path, int_rating: int) -> bool:
+        """
+        Place a single image in the folder of its rating.
+
+        Returns
+        -------
+        False if the image had already been placed, True otherwise
+        """
+        target_path = self._target_path(image_path, int_rating)
         target_path.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copy2(image_path, target_path)
+
+        return self._place(image_path, target_path)
+
+    def remove(self, image_path: Path, int_ratings: Iterable[int]) -> int:
+        """
+        Remove an image from the folders of the given ratings, e.g. after its rating
+        changed.
+
+        Returns
+        -------
+        Number of removed placements
+        """
+        num_removed = 0
+
+        for int_rating in int_ratings:
+            target_path = self._target_path(image_path, int_rating)
+
+            if target_path.is_symlink() or target_path.exists():
+                target_path.unlink()
+                num_removed += 1
+
+        return num_removed
+
+    def sort_all(
+        self, rated_images: Iterable[Tuple[Path, int]], show_progress: bool = True
+    ) -> SortSummary:
+        """
+        Place images in the folders of their ratings.
+
+        Target folders are created before any image is placed, then the images are
+        placed concurrently.
+
+        Parameters
+        ----------
+        rated_images
+            Pairs of image path and integer rating
+        show_progress
+            Print a progress bar of the placed images
+
+        Returns
+        -------
+        Numbers of placed images, images that had already been placed and images
+        that could not be placed
+        """
+        placements = [
+            (image_path, self._target_path(image_path, int_rating))
+            for image_path, int_rating in rated_images
+        ]
+
+        for target_folder in {target_path.parent for _, target_path in placements}:
+            target_folder.mkdir(parents=True, exist_ok=True)
+
+        num_placed = 0
+        num_skipped = 0
+        num_failed = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self._place, image_path, target_path): image_path
+                for image_path, target_path in placements
+            }
+
+            for future in tqdm(
+                as_completed(futures), total=len(futures), disable=not show_progress
+            ):
+                try:
+                    placed = future.result()
+                except OSError as e:
+                    print(f"Cannot place image {futures[future]}: {e}")
+                    num_failed += 1
+                    continue
+
+                if placed:
+                    num_placed += 1
+                else:
+                    num_skipped += 1
+
+        return SortSummary(num_placed, num_skipped, num_failed)
 
 
 def sort_to_folders(
-    ratings_csv_file: str, source_folder: str, target_folder: str
+    ratings_csv_file: str,
+    source_folder: str,
+    target_folder: str,
+    strategy: str = "copy",
+    max_workers: int = 8,
 ) -> None:
     """
     Sort images based on ratings to folders.
@@ -198,23 +525,39 @@ def sort_to_folders(
     Parameters
     ----------
     ratings_csv_file
-        CSV file containing ratings
+        CSV or Parquet file containing ratings
     source_folder
         Folder containing images (and relative paths in the target folder are taken with respect to this root folder).
     target_folder
         Target folder where images are sorted to.
+    strategy
+        How images are placed in the target folder, one of "copy", "hardlink",
+        "symlink" and "reflink"
+    max_workers
+        Maximum number of images that are placed concurrently
     """
-    normalized_ratings = pd.read_csv(ratings_csv_file)
+    normalized_ratings = read_ratings(ratings_csv_file, ["image_path", "rating_new"])
 
     source_folder_path = Path(source_folder)
     target_folder_path = Path(target_folder)
 
     # Sort images based on relative ratings
     print("Sorting files")
-    image_sorter = ImageSorter(source_folder_path, target_folder_path)
+    image_sorter = ImageSorter(
+        source_folder_path, target_folder_path, strategy, max_workers
+    )
 
-    for _, row in tqdm(normalized_ratings.iterrows()):
-        image_sorter.sort(Path(row["image_path"]), row["rating_new"])
+    summary = image_sorter.sort_all(
+        zip(
+            map(Path, normalized_ratings["image_path"]),
+            normalized_ratings["rating_new"],
+        )
+    )
+
+    print(
+        f"Placed {summary.placed} images, skipped {summary.skipped} images that had "
+        f"already been placed, failed to place {summary.failed} images."
+    )
 
 
 if __name__ == "__main__":
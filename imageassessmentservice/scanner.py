@@ -0,0 +1,144 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Generator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from imageassessmentservice.definitions import DEFAULT_IMAGE_EXTENSIONS
+
+
+class ScannedFile(NamedTuple):
+    path: Path
+    is_image: bool
+
+
+def _matches(relative_path: str, patterns: Sequence[str]) -> bool:
+    """Check whether a relative path or its last component matches a glob."""
+    name = relative_path.rsplit("/", 1)[-1]
+    return any(
+        fnmatch(relative_path, pattern) or fnmatch(name, pattern)
+        for pattern in patterns
+    )
+
+
+def scan_directory(directory: str) -> Tuple[List[str], List[str]]:
+    """List files and sub-directories of a directory, without following links."""
+    files = []
+    directories = []
+
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                else:
+                    files.append(entry.path)
+    except OSError as e:
+        print(f"Cannot scan folder {directory}: {e}")
+
+    return files, directories
+
+
+class FileSelector:
+    """Selects files below a root folder by glob patterns and recognizes images by their
+    extension, see `scan_files`."""
+
+    def __init__(
+        self,
+        root_folder: Path,
+        extensions: Sequence[str] = DEFAULT_IMAGE_EXTENSIONS,
+        include: Sequence[str] = (),
+        exclude: Sequence[str] = (),
+    ):
+        self.root = os.fspath(root_folder)
+        self.image_extensions = {
+            extension.lower() if extension.startswith(".") else f".{extension.lower()}"
+            for extension in extensions
+        }
+        self.include = include
+        self.exclude = exclude
+
+    def _relative_path(self, path: str) -> str:
+        return Path(os.path.relpath(path, self.root)).as_posix()
+
+    def is_excluded_folder(self, directory: str) -> bool:
+        return _matches(self._relative_path(directory), self.exclude)
+
+    def select(self, file: str) -> Optional[ScannedFile]:
+        """Classify a file, None if it is not considered at all."""
+        relative_path = self._relative_path(file)
+
+        if _matches(relative_path, self.exclude) or (
+            self.include and not _matches(relative_path, self.include)
+        ):
+            return None
+
+        return ScannedFile(
+            Path(file), os.path.splitext(file)[1].lower() in self.image_extensions
+        )
+
+
+def scan_files(
+    root_folder: Path,
+    extensions: Sequence[str] = DEFAULT_IMAGE_EXTENSIONS,
+    include: Sequence[str] = (),
+    exclude: Sequence[str] = (),
+    max_workers: int = 8,
+) -> Generator[ScannedFile, None, None]:
+    """Find files in a folder and its sub-folders.
+
+    Folders are scanned concurrently and files are yielded as soon as their folder has
+    been scanned, in no particular order.
+
+    Parameters
+    ----------
+    root_folder
+        Folder to scan
+    extensions
+        File extensions of images (case-insensitive)
+    include
+        Glob patterns of files to consider, all files if empty
+    exclude
+        Glob patterns of files and folders to skip
+    max_workers
+        Maximum number of folders that are scanned concurrently
+
+    Patterns are matched against the path relative to `root_folder` (using "/" as
+    separator) and against the name of the file or folder.
+
+    Returns
+    -------
+    Files with a flag whether they are images. Closing the generator stops the scan.
+    """
+    if max_workers < 1:
+        raise ValueError("Expect max_workers to be at least 1.")
+
+    selector = FileSelector(root_folder, extensions, include, exclude)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending: Set[Future] = set()
+
+    try:
+        pending.add(executor.submit(scan_directory, selector.root))
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                files, directories = future.result()
+
+                for directory in directories:
+                    if not selector.is_excluded_folder(directory):
+                        pending.add(executor.submit(scan_directory, directory))
+
+                for file in files:
+                    scanned_file = selector.select(file)
+
+                    if scanned_file is not None:
+                        yield scanned_file
+    finally:
+        # Stop scanning if the caller does not consume all files (cancel_futures of
+        # shutdown needs Python 3.9)
+        for future in pending:
+            future.cancel()
+
+        executor.shutdown(wait=True)
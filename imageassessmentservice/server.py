@@ -1,67 +1,1129 @@
+import functools
+import itertools
+import math
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import signal
+import sys
+import threading
+import time
 from concurrent import futures
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
 import fire
 import grpc
 
 import tensorflow as tf
 import tensorflow_hub as tf_hub
+from tensorflow.python.framework.convert_to_constants import (
+    convert_variables_to_constants_v2,
+)
 
-from imageassessmentservice.definitions import MAX_GRPC_MESSAGE_SIZE_MB
-from imageassessmentservice.imageassessment_pb2 import ImageAssessmentResponse
+from imageassessmentservice.batching import (
+    BatchScheduler,
+    DeadlineExpiredError,
+    QueueFullError,
+)
+from imageassessmentservice.cache import ResultCache
+from imageassessmentservice.decoding import DecodePlan, ImageDecoder
+from imageassessmentservice.definitions import (
+    ASSESSMENT_HEADS,
+    DEFAULT_PORT,
+    MAX_GRPC_MESSAGE_SIZE_MB,
+    MAX_IMAGE_SIZE_MB,
+    MUSIQ_AVA_URL,
+    MUSIQ_MODEL_SUBDIRS,
+    MUSIQ_PAQ2PIQ_URL,
+    RETRY_PUSHBACK_METADATA_KEY,
+)
+from imageassessmentservice.imageassessment_pb2 import (
+    AssessmentHead,
+    DecodePolicy,
+    ImageAssessmentResponse,
+    ImageChunk,
+)
 from imageassessmentservice.imageassessment_pb2_grpc import (
     ImageAssessmentServicer,
     add_ImageAssessmentServicer_to_server,
 )
+from imageassessmentservice.models import (
+    Assessment,
+    AssessmentModel,
+    FakeModel,
+    StageTimings,
+)
 
-physical_devices = tf.config.list_physical_devices("GPU")
-tf.config.experimental.set_memory_growth(physical_devices[0], True)
+# "signature" calls the signatures of the models as they are loaded, "xla" compiles
+# the parts of them that XLA supports and "frozen" folds their variables into constants
+INFERENCE_ENGINES = ("signature", "xla", "frozen")
 
+# "bfloat16" lets oneDNN run operations in reduced precision on CPUs that support it
+PRECISIONS = ("float32", "bfloat16")
 
-class ImageAssessmentService(ImageAssessmentServicer):
-    def __init__(self):
-        self.musiq_model_ava = tf_hub.load("https://tfhub.dev/google/musiq/ava/1")
-        self.predict_fn_musiq_ava = self.musiq_model_ava.signatures["serving_default"]
 
-        self.musiq_model_paq2piq = tf_hub.load(
-            "https://tfhub.dev/google/musiq/paq2piq/1"
+def _call_frozen(frozen_fn: Callable, structured_outputs: Any, inputs: tf.Tensor):
+    # Frozen functions return a flat list of tensors
+    return tf.nest.pack_sequence_as(structured_outputs, frozen_fn(inputs))
+
+
+def _load_signature(
+    handle: str, engine: str = "signature"
+) -> Callable[[tf.Tensor], Any]:
+    # The loaded model owns the variables, it must be alive while they are frozen
+    loaded_model = tf_hub.load(handle)
+    signature = loaded_model.signatures["serving_default"]
+
+    if engine != "frozen":
+        return signature
+
+    # Without variables, Grappler can fold and fuse the operations that read weights
+    return functools.partial(
+        _call_frozen,
+        convert_variables_to_constants_v2(signature),
+        signature.structured_outputs,
+    )
+
+
+def configure_engine(engine: str = "signature", precision: str = "float32") -> None:
+    """Set the process-wide TensorFlow options of an inference engine.
+
+    The options apply to all models of the process and must be set before the first
+    model runs.
+
+    Parameters
+    ----------
+    engine
+        One of `INFERENCE_ENGINES`
+    precision
+        One of `PRECISIONS`
+    """
+    if engine not in INFERENCE_ENGINES:
+        raise ValueError(f"Expect engine to be one of {INFERENCE_ENGINES}.")
+
+    if precision not in PRECISIONS:
+        raise ValueError(f"Expect precision to be one of {PRECISIONS}.")
+
+    if engine == "xla":
+        # The MUSIQ signatures take encoded images, so they cannot be compiled as a
+        # whole. Auto-clustering compiles the supported operations and leaves decoding
+        # to TensorFlow. On CPUs, it is only enabled with this flag, which is read when
+        # XLA is first used.
+        os.environ["TF_XLA_FLAGS"] = (
+            f"{os.environ.get('TF_XLA_FLAGS', '')} --tf_xla_cpu_global_jit".strip()
+        )
+        tf.config.optimizer.set_jit("autoclustering")
+
+    if precision == "bfloat16":
+        tf.config.optimizer.set_experimental_options(
+            {"auto_mixed_precision_onednn_bfloat16": True}
+        )
+
+
+class MusiqModel(AssessmentModel):
+    """MUSIQ models for aesthetic (AVA) and technical (PaQ-2-PiQ) assessment.
+
+    Only the models whose predict functions are given are available as heads. Requested
+    heads share the input tensor of an image and, if `concurrent_heads` is set, run at
+    the same time on separate threads. The time spent in each stage is recorded in
+    `timings`.
+    """
+
+    model_id = "musiq-ava-1+musiq-paq2piq-1"
+    timings: StageTimings
+
+    def __init__(
+        self,
+        predict_fn_musiq_ava: Optional[Callable[[tf.Tensor], Any]],
+        predict_fn_musiq_paq2piq: Optional[Callable[[tf.Tensor], Any]],
+        concurrent_heads: bool = True,
+        engine: str = "signature",
+        precision: str = "float32",
+    ):
+        self.predict_fns = {
+            head: predict_fn
+            for head, predict_fn in zip(
+                ASSESSMENT_HEADS, [predict_fn_musiq_ava, predict_fn_musiq_paq2piq]
+            )
+            if predict_fn is not None
+        }
+        self.heads = tuple(self.predict_fns)
+
+        if not self.heads:
+            raise ValueError("Expect at least one MUSIQ model.")
+
+        # Ratings of other engines and in reduced precision differ slightly, so they
+        # are cached separately
+        if engine != "signature":
+            self.model_id = f"{self.model_id}+{engine}"
+
+        if precision != "float32":
+            self.model_id = f"{self.model_id}+{precision}"
+
+        self.timings = StageTimings()
+        self._head_executor = (
+            futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="MusiqHead")
+            if concurrent_heads and len(self.heads) > 1
+            else None
+        )
+
+    @classmethod
+    def from_tf_hub(
+        cls,
+        heads: Sequence[str] = ASSESSMENT_HEADS,
+        concurrent_heads: bool = True,
+        model_dir: Optional[str] = None,
+        engine: str = "signature",
+        precision: str = "float32",
+    ) -> "MusiqModel":
+        """Load the MUSIQ models for the given heads from Tensorflow Hub.
+
+        Parameters
+        ----------
+        heads
+            Heads to load, a subset of `ASSESSMENT_HEADS`
+        concurrent_heads
+            Run the heads at the same time on separate threads
+        model_dir
+            Local directory with the SavedModels of the heads in the sub-directories
+            "ava" and "paq2piq". The models are loaded from this directory without
+            network access instead of from Tensorflow Hub.
+        engine
+            One of `INFERENCE_ENGINES`, whose options must have been set with
+            `configure_engine` before, which is part of the model id
+        precision
+            Precision set with `configure_engine`, which is part of the model id
+
+        Returns
+        -------
+        Model with the loaded heads
+        """
+        unknown_heads = set(heads) - set(ASSESSMENT_HEADS)
+
+        if unknown_heads:
+            raise ValueError(f"Unknown heads {sorted(unknown_heads)}.")
+
+        handles = {
+            head: (
+                str(Path(model_dir) / MUSIQ_MODEL_SUBDIRS[head])
+                if model_dir is not None
+                else url
+            )
+            for head, url in zip(ASSESSMENT_HEADS, [MUSIQ_AVA_URL, MUSIQ_PAQ2PIQ_URL])
+            if head in heads
+        }
+
+        # Loading a model is mostly spent in I/O and in restoring its graph, which
+        # releases the GIL, so the heads are loaded at the same time
+        with futures.ThreadPoolExecutor(max_workers=max(len(handles), 1)) as executor:
+            predict_fns = dict(
+                zip(
+                    handles,
+                    executor.map(
+                        functools.partial(_load_signature, engine=engine),
+                        handles.values(),
+                    ),
+                )
+            )
+
+        return cls(
+            predict_fn_musiq_ava=predict_fns.get("aesthetic"),
+            predict_fn_musiq_paq2piq=predict_fns.get("technical"),
+            concurrent_heads=concurrent_heads,
+            engine=engine,
+            precision=precision,
         )
-        self.predict_fn_musiq_paq2piq = self.musiq_model_paq2piq.signatures[
-            "serving_default"
-        ]
+
+    def _run_head(self, head: str, inputs: tf.Tensor) -> float:
+        with self.timings.measure(head):
+            return float(self.predict_fns[head](inputs)["output_0"].numpy())
+
+    def assess_batch(
+        self, images: Sequence[bytes], heads: Sequence[str] = ASSESSMENT_HEADS
+    ) -> List[Assessment]:
+        # The MUSIQ signatures take a single encoded image of arbitrary resolution, so
+        # the images of a batch are passed one after the other. Decoding and patch
+        # extraction are part of the signatures and cannot be shared between the heads.
+        assessments = []
+
+        for image_bytes in images:
+            with self.timings.measure("total"):
+                with self.timings.measure("prepare"):
+                    image_bytes_tensor = tf.constant(image_bytes)
+
+                if self._head_executor is not None and len(heads) > 1:
+                    # The first head runs on the calling thread, the others on the pool
+                    other_ratings = [
+                        self._head_executor.submit(
+                            self._run_head, head, image_bytes_tensor
+                        )
+                        for head in heads[1:]
+                    ]
+                    ratings = [self._run_head(heads[0], image_bytes_tensor)] + [
+                        future.result() for future in other_ratings
+                    ]
+                else:
+                    ratings = [
+                        self._run_head(head, image_bytes_tensor) for head in heads
+                    ]
+
+            assessments.append(Assessment(**dict(zip(heads, ratings))))
+
+        return assessments
+
+
+def warm_up(
+    model: AssessmentModel,
+    image_sizes: Sequence[Tuple[int, int]] = ((1024, 768), (768, 1024)),
+) -> float:
+    """Run the model on synthetic images with all heads.
+
+    The first images passed to a model pay one-time costs, e.g. for tracing the
+    functions and allocating memory on the GPU. Warming up the model before the server
+    accepts requests keeps these costs away from the first clients. The timings of the
+    warm-up are discarded.
+
+    Parameters
+    ----------
+    model
+        Model to warm up
+    image_sizes
+        Width and height of the synthetic images
+
+    Returns
+    -------
+    Duration of the warm-up in seconds
+    """
+    # Noise is not representative of photos, but it exercises the same code paths
+    images = [
+        tf.io.encode_jpeg(
+            tf.cast(
+                tf.random.stateless_uniform(
+                    (height, width, 3), seed=(0, index), maxval=256, dtype=tf.int32
+                ),
+                tf.uint8,
+            )
+        ).numpy()
+        for index, (width, height) in enumerate(image_sizes)
+    ]
+
+    start = time.perf_counter()
+    model.assess_batch(images, model.heads)
+    duration_s = time.perf_counter() - start
+
+    if model.timings is not None:
+        model.timings.reset()
+
+    return duration_s
+
+
+def _build_response(
+    request,
+    assessment: Assessment,
+    decode_plan: Optional[DecodePlan] = None,
+    model_id: str = "",
+) -> ImageAssessmentResponse:
+    response = ImageAssessmentResponse(
+        path=request.path, request_id=request.request_id, model_id=model_id
+    )
+
+    if decode_plan is not None:
+        response.decode_policy = DecodePolicy.Value(decode_plan.policy.upper())
+
+    for head, rating in assessment._asdict().items():
+        if rating is not None:
+            setattr(response, f"assessment_{head}", rating)
+
+    return response
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+def _assemble_chunks(
+    chunks: Iterator[ImageChunk],
+    max_image_size: int,
+    scheduler: Optional[BatchScheduler] = None,
+) -> Tuple[bytes, ImageChunk]:
+    """Join the chunks of an uploaded image.
+
+    The chunks are kept as received and joined once the upload is complete, so that
+    the image is copied once. The models only accept immutable bytes, so a buffer
+    preallocated from the announced size would have to be copied again, and the peak
+    memory is about twice the image size either way. Chunks beyond the announced size
+    are rejected as they arrive.
+
+    If a scheduler is given, the announced size is admitted to its budget of pending
+    requests before the chunks are received, and released again if the upload fails.
+    The caller passes the reservation on to the scheduler otherwise.
+
+    Returns
+    -------
+    Image and the first chunk, which carries the metadata of the image
+    """
+    first_chunk = next(chunks, None)
+
+    if first_chunk is None:
+        raise ValueError("Expect at least one chunk.")
+
+    if first_chunk.total_size > max_image_size:
+        raise ImageTooLargeError(
+            f"Image of {first_chunk.total_size} bytes exceeds the limit of "
+            f"{max_image_size} bytes."
+        )
+
+    if scheduler is not None:
+        scheduler.admit(first_chunk.total_size)
+
+    try:
+        data = []
+        num_bytes = 0
+
+        for chunk in itertools.chain([first_chunk], chunks):
+            num_bytes += len(chunk.data)
+
+            if num_bytes > first_chunk.total_size:
+                raise ValueError("Received more bytes than announced.")
+
+            data.append(chunk.data)
+
+        if num_bytes != first_chunk.total_size:
+            raise ValueError(
+                f"Received {num_bytes} of {first_chunk.total_size} announced bytes."
+            )
+    except BaseException:
+        if scheduler is not None:
+            scheduler.release(first_chunk.total_size)
+
+        raise
+
+    return b"".join(data), first_chunk
+
+
+def _abort_queue_full(context, error: QueueFullError) -> None:
+    context.set_trailing_metadata(
+        [(RETRY_PUSHBACK_METADATA_KEY, str(math.ceil(1000 * error.retry_after_s)))]
+    )
+    context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(error))
+
+
+def _requested_heads(request) -> Optional[List[str]]:
+    # An empty list of heads selects all heads of the model
+    return [AssessmentHead.Name(head).lower() for head in request.heads] or None
+
+
+def _request_deadline(context) -> Optional[float]:
+    """Deadline of the call on the monotonic clock, None if the client set none."""
+    time_remaining = context.time_remaining() if context is not None else None
+    return None if time_remaining is None else time.monotonic() + time_remaining
+
+
+class ImageAssessmentService(ImageAssessmentServicer):
+    def __init__(
+        self,
+        model: Optional[AssessmentModel] = None,
+        max_batch_size: int = 8,
+        max_batch_wait_ms: float = 5.0,
+        cache: Optional[ResultCache] = None,
+        max_image_size_mb: float = MAX_IMAGE_SIZE_MB,
+        max_pending_requests: int = 0,
+        max_pending_mb: float = 0.0,
+        decoder: Optional[ImageDecoder] = None,
+    ):
+        self.model = model if model is not None else MusiqModel.from_tf_hub()
+        self.scheduler = BatchScheduler(
+            self.model,
+            max_batch_size,
+            max_batch_wait_ms,
+            max_pending_requests,
+            max_pending_mb,
+        )
+        self.cache = cache
+        self.max_image_size = int(max_image_size_mb * 1024**2)
+        # Without limits, all images are passed to the model as received
+        self.decoder = decoder if decoder is not None else ImageDecoder()
+        # Reduced images are rated differently, see `ImageDecoder.cache_id_suffix`
+        self.model_id = self.model.model_id + self.decoder.cache_id_suffix
 
         print("Ready to assess images")
 
+    def submit(
+        self,
+        image_bytes: bytes,
+        heads: Optional[Sequence[str]] = None,
+        priority: int = 0,
+        deadline: Optional[float] = None,
+        decode_plan: Optional[DecodePlan] = None,
+        admitted: bool = False,
+        wait_for_room: Optional[Callable[[], bool]] = None,
+    ) -> "futures.Future[Assessment]":
+        """Look up the assessment of an image in the cache or queue it for the model.
+
+        Images are admitted to the queue of the model before they are decoded, so that
+        rejected requests are not decoded. Images above the pixel budget of the decoder
+        are reduced before they are queued, while the cache is keyed by the image as
+        received.
+
+        Parameters
+        ----------
+        image_bytes
+            Encoded image
+        heads
+            Heads to run for the image, all heads of the model if None
+        priority
+            Priority of the image in the queue of the model
+        deadline
+            Time (as given by `time.monotonic`) after which the assessment is of no use
+        decode_plan
+            How to decode the image, planned by the decoder if None
+        admitted
+            Whether the size of the image is already admitted to the budget of pending
+            requests, see `BatchScheduler.admit`
+        wait_for_room
+            Called while the queue is full, the request waits for room as long as it
+            returns True. Requests are rejected right away if None.
+
+        Returns
+        -------
+        Future that resolves to the assessment of the image
+
+        Raises
+        ------
+        QueueFullError
+            If the queue has no room for the image
+        DeadlineExpiredError
+            If the deadline passes before the image is admitted or decoded
+        """
+        future: "futures.Future[Assessment]" = futures.Future()
+
+        try:
+            resolved_heads = self.scheduler.resolve_heads(heads)
+
+            if self.cache is not None:
+                assessment = self.cache.get(image_bytes, resolved_heads)
+
+                if assessment is not None:
+                    if admitted:
+                        self.scheduler.release(len(image_bytes))
+
+                    future.set_result(assessment)
+                    return future
+
+            if not admitted:
+                self._admit(len(image_bytes), deadline, wait_for_room)
+                admitted = True
+
+            image_bytes_to_assess = self.decoder.decode(
+                image_bytes,
+                (
+                    decode_plan
+                    if decode_plan is not None
+                    else self.decoder.plan(image_bytes)
+                ),
+                deadline,
+            )
+            # The request holds the size of the image as received
+            scheduled = self.scheduler.submit(
+                image_bytes_to_assess,
+                resolved_heads,
+                priority,
+                deadline,
+                len(image_bytes),
+            )
+        except BaseException:
+            # The request was not queued and returns its reservation
+            if admitted:
+                self.scheduler.release(len(image_bytes))
+
+            raise
+
+        if self.cache is None:
+            return scheduled
+
+        # The assessment is stored before the returned future resolves, so that a caller
+        # sending the same image again right after the response hits the cache
+
+        def _store(done: "futures.Future[Assessment]") -> None:
+            exception = done.exception()
+
+            if exception is not None:
+                future.set_exception(exception)
+                return
+
+            # A failure of the cache must not fail or stall the request
+            if self.cache is not None:
+                try:
+                    self.cache.put(image_bytes, done.result())
+                except Exception as e:
+                    print(f"Cannot cache the assessment of an image: {e}")
+
+            future.set_result(done.result())
+
+        scheduled.add_done_callback(_store)
+
+        return future
+
+    def _admit(
+        self,
+        num_bytes: int,
+        deadline: Optional[float],
+        wait_for_room: Optional[Callable[[], bool]],
+    ) -> None:
+        while True:
+            if deadline is not None and deadline <= time.monotonic():
+                raise DeadlineExpiredError(
+                    "Deadline passed before the image was admitted."
+                )
+
+            try:
+                self.scheduler.admit(num_bytes)
+                return
+            except QueueFullError as e:
+                if wait_for_room is None or not wait_for_room():
+                    raise
+
+                time.sleep(
+                    e.retry_after_s
+                    if deadline is None
+                    else max(min(e.retry_after_s, deadline - time.monotonic()), 0.0)
+                )
+
+    def _assess_image(
+        self, request, image_bytes: bytes, context, admitted: bool = False
+    ):
+        decode_plan = self.decoder.plan(image_bytes)
+
+        # Requests are rejected right away if the queue is full, rather than waiting in
+        # the thread pool of the server with their images in memory
+        try:
+            future = self.submit(
+                image_bytes,
+                _requested_heads(request),
+                request.priority,
+                _request_deadline(context),
+                decode_plan,
+                admitted,
+            )
+        except QueueFullError as e:
+            _abort_queue_full(context, e)
+        except DeadlineExpiredError as e:
+            context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, str(e))
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+        try:
+            assessment = future.result()
+        except DeadlineExpiredError as e:
+            context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, str(e))
+
+        return _build_response(request, assessment, decode_plan, self.model_id)
+
     def Assess(self, request, context):
         print(f"Assessing {request.path}.")
 
-        image_bytes_tensor = tf.constant(request.image_bytes)
+        return self._assess_image(request, request.image_bytes, context)
+
+    def AssessUpload(self, request_iterator, context):
+        # The upload holds its size in the budget of pending requests while it is
+        # received, which is passed on to the request of the image
+        try:
+            image_bytes, first_chunk = _assemble_chunks(
+                request_iterator, self.max_image_size, self.scheduler
+            )
+        except QueueFullError as e:
+            _abort_queue_full(context, e)
+        except ImageTooLargeError as e:
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(e))
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+        print(f"Assessing {first_chunk.path}.")
+
+        return self._assess_image(first_chunk, image_bytes, context, admitted=True)
+
+    def AssessStream(self, request_iterator, context):
+        # Requests are read on a separate thread and submitted to the batch scheduler
+        # right away, so that several images of the stream are in flight at once. The
+        # responses are sent in the order in which the assessments finish.
+        responses: "queue.Queue[Any]" = queue.Queue()
+        deadline = _request_deadline(context)
+
+        def _respond(
+            request, decode_plan: DecodePlan, future: "futures.Future[Assessment]"
+        ) -> None:
+            try:
+                assessment = future.result()
+            except Exception as e:
+                print(f"Cannot assess {request.path}: {e}")
+                responses.put(
+                    ImageAssessmentResponse(
+                        path=request.path, request_id=request.request_id, error=str(e)
+                    )
+                )
+                return
+
+            responses.put(
+                _build_response(request, assessment, decode_plan, self.model_id)
+            )
+
+        def _consume_requests() -> None:
+            num_requests = 0
+
+            try:
+                for request in request_iterator:
+                    print(f"Assessing {request.path}.")
+                    image_bytes = request.image_bytes
+                    decode_plan = self.decoder.plan(image_bytes)
+
+                    try:
+                        future = self._submit_when_admitted(
+                            request, image_bytes, deadline, context, decode_plan
+                        )
+                    except (QueueFullError, DeadlineExpiredError, ValueError) as e:
+                        future = futures.Future()
+                        future.set_exception(e)
 
-        output_musiq_ava = self.predict_fn_musiq_ava(image_bytes_tensor)
-        rating_ava = output_musiq_ava["output_0"].numpy()
+                    future.add_done_callback(
+                        functools.partial(_respond, request, decode_plan)
+                    )
+                    num_requests += 1
+            finally:
+                responses.put(_EndOfRequests(num_requests))
 
-        output_musiq_paq2piq = self.predict_fn_musiq_paq2piq(image_bytes_tensor)
-        rating_paq2piq = output_musiq_paq2piq["output_0"].numpy()
+        threading.Thread(target=_consume_requests, daemon=True).start()
 
-        return ImageAssessmentResponse(
-            path=request.path,
-            assessment_aesthetic=rating_ava,
-            assessment_technical=rating_paq2piq,
+        yield from _drain_responses(responses)
+
+    def _submit_when_admitted(
+        self,
+        request,
+        image_bytes: bytes,
+        deadline: Optional[float],
+        context,
+        decode_plan: Optional[DecodePlan] = None,
+    ) -> "futures.Future[Assessment]":
+        # Images of a stream wait until the queue has room instead of being rejected.
+        # While they wait, no further requests are read, so that flow control slows
+        # down the client. The image is decoded once it is admitted.
+        return self.submit(
+            image_bytes,
+            _requested_heads(request),
+            request.priority,
+            deadline,
+            decode_plan,
+            wait_for_room=lambda: context is None or context.is_active(),
         )
 
 
-def serve():
+class _EndOfRequests:
+    def __init__(self, num_requests: int):
+        self.num_requests = num_requests
+
+
+def _drain_responses(
+    responses: "queue.Queue[Any]",
+) -> Iterator[ImageAssessmentResponse]:
+    num_requests = None
+    num_responses = 0
+
+    while num_requests is None or num_responses < num_requests:
+        item = responses.get()
+
+        if isinstance(item, _EndOfRequests):
+            num_requests = item.num_requests
+            continue
+
+        num_responses += 1
+        yield item
+
+
+def create_server(
+    service: ImageAssessmentService,
+    port: int = DEFAULT_PORT,
+    max_workers: int = 10,
+    reuse_port: bool = False,
+    max_concurrent_rpcs: int = 0,
+) -> grpc.Server:
+    """Create and start a gRPC server for the image assessment service.
+
+    Parameters
+    ----------
+    service
+        Service handling the requests
+    port
+        Port on which the server listens
+    max_workers
+        Number of threads handling requests
+    reuse_port
+        Allow other processes to listen on the same port
+    max_concurrent_rpcs
+        Number of calls that are handled or wait for a thread, further calls are
+        rejected with RESOURCE_EXHAUSTED. Unlimited if 0.
+
+    Returns
+    -------
+    Started server
+    """
     options = [
         (
             "grpc.max_receive_message_length",
             MAX_GRPC_MESSAGE_SIZE_MB * 1024**2,
         ),
+        ("grpc.so_reuseport", int(reuse_port)),
     ]
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10), options=options)
-    add_ImageAssessmentServicer_to_server(ImageAssessmentService(), server)
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=max_workers),
+        options=options,
+        maximum_concurrent_rpcs=max_concurrent_rpcs or None,
+    )
+    add_ImageAssessmentServicer_to_server(service, server)
+
+    if not server.add_insecure_port(f"[::]:{port}"):
+        raise RuntimeError(f"Cannot listen on port {port}.")
 
-    server.add_insecure_port("[::]:50051")
     server.start()
-    server.wait_for_termination()
+
+    return server
+
+
+def _configure_threads(intra_op_threads: int, inter_op_threads: int) -> None:
+    """Set the number of threads TensorFlow uses within and across operations."""
+    try:
+        if intra_op_threads > 0:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+
+        if inter_op_threads > 0:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError as e:
+        print(f"Cannot configure TensorFlow threads: {e}")
+
+
+def _configure_gpus(use_gpu: bool, gpu_memory_growth: bool) -> None:
+    """Hide the GPUs from TensorFlow or let it allocate their memory on demand."""
+    try:
+        if not use_gpu:
+            tf.config.set_visible_devices([], "GPU")
+            return
+
+        if gpu_memory_growth:
+            for gpu in tf.config.list_physical_devices("GPU"):
+                tf.config.experimental.set_memory_growth(gpu, True)
+    except RuntimeError as e:
+        print(f"Cannot configure GPUs: {e}")
+
+
+def _run_server(
+    port: int,
+    reuse_port: bool,
+    max_workers: int,
+    max_batch_size: int,
+    max_batch_wait_ms: float,
+    cache_size: int,
+    cache_file: Optional[str],
+    concurrent_heads: bool,
+    heads: Sequence[str],
+    model: str,
+    fake_fixed_cost_ms: float,
+    fake_per_image_cost_ms: float,
+    intra_op_threads: int,
+    inter_op_threads: int,
+    max_image_size_mb: float,
+    model_dir: Optional[str],
+    use_gpu: bool,
+    gpu_memory_growth: bool,
+    warm_up_model: bool,
+    ready_file: Optional[str],
+    max_pending_requests: int,
+    max_pending_mb: float,
+    max_concurrent_rpcs: int,
+    engine: str,
+    precision: str,
+    max_decode_megapixels: float,
+    max_decode_mb: float,
+) -> None:
+    """Load the model and serve requests until the server is terminated."""
+    # TensorFlow must be configured before it initializes the devices
+    _configure_threads(intra_op_threads, inter_op_threads)
+    _configure_gpus(use_gpu, gpu_memory_growth)
+    configure_engine(engine, precision)
+
+    start = time.perf_counter()
+
+    if model == "musiq":
+        assessment_model: AssessmentModel = MusiqModel.from_tf_hub(
+            heads, concurrent_heads, model_dir, engine, precision
+        )
+    elif model == "fake":
+        assessment_model = FakeModel(fake_fixed_cost_ms, fake_per_image_cost_ms, heads)
+    else:
+        raise ValueError(f"Unknown model {model}.")
+
+    print(f"Loaded the model in {time.perf_counter() - start:.1f} s.")
+
+    if warm_up_model:
+        print(f"Warmed up the model in {warm_up(assessment_model):.1f} s.")
+
+    decoder = ImageDecoder(int(max_decode_megapixels * 1e6), max_decode_mb)
+    cache = (
+        ResultCache(
+            assessment_model.model_id + decoder.cache_id_suffix, cache_size, cache_file
+        )
+        if cache_size > 0
+        else None
+    )
+
+    service = ImageAssessmentService(
+        model=assessment_model,
+        max_batch_size=max_batch_size,
+        max_batch_wait_ms=max_batch_wait_ms,
+        cache=cache,
+        max_image_size_mb=max_image_size_mb,
+        max_pending_requests=max_pending_requests,
+        max_pending_mb=max_pending_mb,
+        decoder=decoder,
+    )
+
+    # The port is only opened once the model is ready, so that clients and load
+    # balancers do not send requests to a server that is still starting
+    server = create_server(service, port, max_workers, reuse_port, max_concurrent_rpcs)
+
+    if ready_file is not None:
+        Path(ready_file).touch()
+
+    # Let the supervisor (or a process manager) stop the server gracefully, so that
+    # the statistics below are printed
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: server.stop(grace=5.0))
+
+    try:
+        server.wait_for_termination()
+    finally:
+        service.scheduler.stop()
+        print(f"Admission control: {service.scheduler.stats()}")
+        print(f"Decoding: {service.decoder.stats()}")
+
+        if assessment_model.timings is not None:
+            print(f"Inference stage timings: {assessment_model.timings.summary()}")
+
+        if cache is not None:
+            print(f"Result cache: {cache.stats()}")
+            cache.close()
+
+
+def _supervise(
+    num_processes: int,
+    port: int,
+    reuse_port: bool,
+    server_kwargs: Dict[str, Any],
+    restart_delay_s: float = 1.0,
+) -> None:
+    """Run servers in worker processes and restart workers that exit."""
+    # Workers are spawned instead of forked, as TensorFlow does not support forking
+    # after it has been initialized
+    context = multiprocessing.get_context("spawn")
+
+    def _start_worker(index: int) -> multiprocessing.process.BaseProcess:
+        worker_port = port if reuse_port else port + index
+        worker = context.Process(
+            target=_run_server,
+            kwargs=dict(server_kwargs, port=worker_port, reuse_port=reuse_port),
+            name=f"imageassessment-worker-{index}",
+        )
+        worker.start()
+        print(f"Started worker {index} (pid {worker.pid}) on port {worker_port}.")
+
+        return worker
+
+    workers = [_start_worker(index) for index in range(num_processes)]
+
+    # Stop the workers when the supervisor is terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        while True:
+            multiprocessing.connection.wait([worker.sentinel for worker in workers])
+
+            for index, worker in enumerate(workers):
+                if worker.is_alive():
+                    continue
+
+                print(f"Worker {index} exited with code {worker.exitcode}.")
+                # Avoid restarting a worker that crashes on startup in a tight loop
+                time.sleep(restart_delay_s)
+                workers[index] = _start_worker(index)
+    finally:
+        for worker in workers:
+            worker.terminate()
+
+        for worker in workers:
+            worker.join()
+
+
+def serve(
+    port: int = DEFAULT_PORT,
+    max_workers: int = 10,
+    max_batch_size: int = 8,
+    max_batch_wait_ms: float = 5.0,
+    cache_size: int = 10000,
+    cache_file: Optional[str] = None,
+    concurrent_heads: bool = True,
+    heads: Sequence[str] = ASSESSMENT_HEADS,
+    model: str = "musiq",
+    fake_fixed_cost_ms: float = 20.0,
+    fake_per_image_cost_ms: float = 5.0,
+    num_processes: int = 1,
+    reuse_port: bool = True,
+    intra_op_threads: int = 0,
+    inter_op_threads: int = 0,
+    max_image_size_mb: float = MAX_IMAGE_SIZE_MB,
+    model_dir: Optional[str] = None,
+    use_gpu: bool = True,
+    gpu_memory_growth: bool = True,
+    warm_up_model: bool = True,
+    ready_file: Optional[str] = None,
+    max_pending_requests: int = 256,
+    max_pending_mb: float = 1024.0,
+    max_concurrent_rpcs: int = 0,
+    engine: str = "signature",
+    precision: str = "float32",
+    max_decode_megapixels: float = 64.0,
+    max_decode_mb: float = 512.0,
+):
+    """Run the image assessment server.
+
+    Parameters
+    ----------
+    port
+        Port on which the server listens
+    max_workers
+        Number of threads handling requests (per process)
+    max_batch_size
+        Maximum number of images that are passed to the models at once
+    max_batch_wait_ms
+        Maximum time to wait for further images before an incomplete batch is processed
+    cache_size
+        Number of assessments kept in the in-memory result cache (0 disables the cache)
+    cache_file
+        SQLite file in which assessments are persisted across restarts
+    concurrent_heads
+        Run the aesthetic and technical models at the same time
+    heads
+        Heads to load, a subset of "aesthetic" and "technical" (comma-separated on the
+        command line). Requests can only select heads that are loaded.
+    model
+        "musiq" for the MUSIQ models or "fake" for a deterministic fake model that needs
+        neither network access nor a GPU, e.g. for benchmarks
+    fake_fixed_cost_ms
+        Time the fake model spends on each batch
+    fake_per_image_cost_ms
+        Additional time the fake model spends on each image of a batch
+    num_processes
+        Number of worker processes, each with its own copy of the model. Workers that
+        exit are restarted.
+    reuse_port
+        Let all worker processes listen on `port` (SO_REUSEPORT, Linux only) instead of
+        on consecutive ports starting at `port`
+    intra_op_threads
+        Number of threads TensorFlow uses within an operation (per process), 0 for the
+        default
+    inter_op_threads
+        Number of threads TensorFlow uses to run independent operations (per process),
+        0 for the default
+    max_image_size_mb
+        Maximum size of images uploaded in chunks. Images sent in a single message are
+        limited by the maximum message size instead.
+    model_dir
+        Local directory with the MUSIQ SavedModels in the sub-directories "ava" and
+        "paq2piq", from which the models are loaded without network access
+    use_gpu
+        Run the models on the GPU if one is available
+    gpu_memory_growth
+        Allocate GPU memory on demand instead of all at once, so that several worker
+        processes can share a GPU
+    warm_up_model
+        Run the model on synthetic images before the server accepts requests
+    ready_file
+        File that is created once the server accepts requests (by any worker) and
+        removed when the server stops, e.g. for a readiness probe
+    max_pending_requests
+        Maximum number of images that are queued or assessed (per process). Further
+        single-image calls are rejected with RESOURCE_EXHAUSTED and a retry hint,
+        streams are slowed down. Unlimited if 0.
+    max_pending_mb
+        Maximum total size of the images that are queued or assessed (per process),
+        unlimited if 0
+    max_concurrent_rpcs
+        Maximum number of calls that are handled or wait for a thread (per process),
+        further calls are rejected with RESOURCE_EXHAUSTED. Unlimited if 0.
+    engine
+        How the MUSIQ models are run: "signature" calls their signatures as loaded,
+        "xla" compiles the operations XLA supports and "frozen" folds the weights into
+        the graphs
+    precision
+        "float32" or "bfloat16", which lets oneDNN run operations in reduced precision
+        on CPUs that support it. The ratings differ slightly from those in "float32".
+    max_decode_megapixels
+        Pixel budget of the images passed to the models. Larger JPEGs are downscaled
+        while they are decoded, larger PNGs are resized. Unlimited if 0.
+    max_decode_mb
+        Memory for the decoded pixels of large images that are reduced at the same
+        time (per process), unlimited if 0
+    """
+    if isinstance(heads, str):
+        heads = heads.split(",")
+
+    if num_processes < 1:
+        raise ValueError("Expect num_processes to be at least 1.")
+
+    if engine not in INFERENCE_ENGINES or precision not in PRECISIONS:
+        raise ValueError(
+            f"Expect engine to be one of {INFERENCE_ENGINES} and precision one of "
+            f"{PRECISIONS}."
+        )
+
+    server_kwargs: Dict[str, Any] = dict(
+        max_workers=max_workers,
+        max_batch_size=max_batch_size,
+        max_batch_wait_ms=max_batch_wait_ms,
+        cache_size=cache_size,
+        cache_file=cache_file,
+        concurrent_heads=concurrent_heads,
+        heads=heads,
+        model=model,
+        fake_fixed_cost_ms=fake_fixed_cost_ms,
+        fake_per_image_cost_ms=fake_per_image_cost_ms,
+        intra_op_threads=intra_op_threads,
+        inter_op_threads=inter_op_threads,
+        max_image_size_mb=max_image_size_mb,
+        model_dir=model_dir,
+        use_gpu=use_gpu,
+        gpu_memory_growth=gpu_memory_growth,
+        warm_up_model=warm_up_model,
+        ready_file=ready_file,
+        max_pending_requests=max_pending_requests,
+        max_pending_mb=max_pending_mb,
+        max_concurrent_rpcs=max_concurrent_rpcs,
+        engine=engine,
+        precision=precision,
+        max_decode_megapixels=max_decode_megapixels,
+        max_decode_mb=max_decode_mb,
+    )
+
+    # A file left over by a server that was killed must not signal readiness
+    if ready_file is not None:
+        Path(ready_file).unlink(missing_ok=True)
+
+    try:
+        if num_processes == 1:
+            _run_server(port=port, reuse_port=False, **server_kwargs)
+        else:
+            _supervise(num_processes, port, reuse_port, server_kwargs)
+    finally:
+        if ready_file is not None:
+            Path(ready_file).unlink(missing_ok=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,325 @@
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Union,
+)
+
+import numpy as np
+import pandas as pd
+
+
+class RunningMoments:
+    """Mergeable online mean and variance (Welford/Chan et al.)."""
+
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64)
+
+        if values.size:
+            self.merge(
+                RunningMoments(
+                    values.size,
+                    float(values.mean()),
+                    float(((values - values.mean()) ** 2).sum()),
+                )
+            )
+
+    def merge(self, other: "RunningMoments") -> None:
+        count = self.count + other.count
+
+        if count == 0:
+            return
+
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+
+    @property
+    def std(self) -> float:
+        """Sample standard deviation, as computed by `pd.Series.std`."""
+        return float(np.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else np.nan
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"count": self.count, "mean": self.mean, "m2": self.m2}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RunningMoments":
+        return cls(data["count"], data["mean"], data["m2"])
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch with bounded memory (a deterministic KLL variant).
+
+    Values are kept in levels, where an item on level h stands for 2**h values. Once a
+    level holds more than `capacity` items, it is sorted and every other item is
+    promoted to the next level. As long as no level has been compacted, quantiles are
+    exact and match `pd.Series.quantile` with linear interpolation.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        if capacity < 2:
+            raise ValueError("Expect capacity to be at least 2.")
+
+        self.capacity = capacity
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self.min = np.inf
+        self.max = -np.inf
+        self._num_compactions = 0
+
+    @property
+    def count(self) -> int:
+        return int(
+            sum(level.size * 2**height for height, level in enumerate(self.levels))
+        )
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64)
+
+        if not values.size:
+            return
+
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compact()
+
+    def merge(self, other: "QuantileSketch") -> None:
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        for height, level in enumerate(other.levels):
+            if height == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[height] = np.concatenate([self.levels[height], level])
+
+        self._compact()
+
+    def quantiles(self, qs: Union[Sequence[float], np.ndarray]) -> np.ndarray:
+        """Estimate quantiles with linear interpolation between ranks."""
+        values = np.concatenate(self.levels)
+
+        if not values.size:
+            return np.full(len(qs), np.nan)
+
+        weights = np.concatenate(
+            [np.full(level.size, 2**height) for height, level in enumerate(self.levels)]
+        )
+        order = np.argsort(values, kind="stable")
+        values = values[order]
+        # Item i covers the ranks [last_ranks[i] - weights[i] + 1, last_ranks[i]]
+        last_ranks = np.cumsum(weights[order]) - 1
+
+        positions = np.asarray(qs, dtype=np.float64) * (last_ranks[-1])
+        lower_ranks = np.floor(positions)
+        lower = values[np.searchsorted(last_ranks, lower_ranks, side="left")]
+        upper = values[
+            np.searchsorted(
+                last_ranks, np.minimum(lower_ranks + 1, last_ranks[-1]), side="left"
+            )
+        ]
+        result = lower + (positions - lower_ranks) * (upper - lower)
+
+        # The extremes are tracked exactly
+        result[np.asarray(qs) <= 0] = self.min
+        result[np.asarray(qs) >= 1] = self.max
+
+        return result
+
+    def _compact(self) -> None:
+        height = 0
+
+        while height < len(self.levels):
+            level = self.levels[height]
+
+            if level.size > self.capacity:
+                level = np.sort(level)
+                # Keep an even number of items for promotion, alternating the offset so
+                # that the rounding errors of consecutive compactions cancel out
+                num_promoted = level.size - level.size % 2
+                offset = self._num_compactions % 2
+                self._num_compactions += 1
+
+                promoted = level[offset:num_promoted:2]
+                self.levels[height] = level[num_promoted:]
+
+                if height + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[height + 1] = np.concatenate(
+                    [self.levels[height + 1], promoted]
+                )
+
+            height += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "levels": [level.tolist() for level in self.levels],
+            "min": self.min,
+            "max": self.max,
+            "num_compactions": self._num_compactions,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "QuantileSketch":
+        sketch = cls(data["capacity"])
+        sketch.levels = [
+            np.asarray(level, dtype=np.float64) for level in data["levels"]
+        ]
+        sketch.min = data["min"]
+        sketch.max = data["max"]
+        sketch._num_compactions = data["num_compactions"]
+
+        return sketch
+
+
+def bin_ratings(ratings: pd.Series, interval_bounds: np.ndarray) -> pd.Series:
+    """Map ratings to bins 1 to len(interval_bounds) - 1 given the bin boundaries.
+
+    Ratings on a boundary between two bins are mapped to the lower bin. Ratings outside of
+    the boundaries are mapped to the lowest or highest bin.
+    """
+    bins = np.searchsorted(interval_bounds[1:-1], ratings.to_numpy(), side="left") + 1
+    return pd.Series(bins, index=ratings.index, name=ratings.name)
+
+
+class RatingDistribution:
+    """Mergeable summary of the distribution of ratings.
+
+    Holds the moments of each raw rating, used for normalization, and a quantile sketch
+    of the overall (normalized and averaged) rating, used for binning. Summaries of
+    several shards can be merged, and a summary can be persisted with `to_dict`.
+    """
+
+    def __init__(self, rating_names: Sequence[str], sketch_capacity: int = 1024):
+        self.rating_names = list(rating_names)
+        self.moments = {name: RunningMoments() for name in self.rating_names}
+        self.overall_sketch = QuantileSketch(sketch_capacity)
+
+    def update_moments(self, ratings: pd.DataFrame) -> None:
+        for name in self.rating_names:
+            self.moments[name].update(ratings[name].to_numpy())
+
+    def update_quantiles(self, ratings: pd.DataFrame) -> None:
+        """Add overall ratings; requires the moments of all ratings to be complete."""
+        self.overall_sketch.update(self.overall(ratings).to_numpy())
+
+    def merge(self, other: "RatingDistribution") -> None:
+        for name in self.rating_names:
+            self.moments[name].merge(other.moments[name])
+
+        self.overall_sketch.merge(other.overall_sketch)
+
+    def normalize(self, ratings: pd.DataFrame, keep_raw: bool = False) -> pd.DataFrame:
+        """Same output as `normalize_ratings`, based on the accumulated moments."""
+        for name in self.rating_names:
+            ratings[f"{name}_normalized"] = (
+                ratings[name] - self.moments[name].mean
+            ) / self.moments[name].std
+
+        ratings["overall"] = ratings[
+            [f"{name}_normalized" for name in self.rating_names]
+        ].mean(axis=1)
+
+        if not keep_raw:
+            ratings.drop(columns=self.rating_names, inplace=True)
+
+        return ratings
+
+    def overall(self, ratings: pd.DataFrame) -> pd.Series:
+        return self.normalize(ratings[self.rating_names].copy())["overall"]
+
+    def interval_bounds(self, num_bins: int) -> np.ndarray:
+        return self.overall_sketch.quantiles(
+            np.linspace(0.0, 1.0, num_bins + 1, endpoint=True)
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "rating_names": self.rating_names,
+            "moments": {
+                name: self.moments[name].to_dict() for name in self.rating_names
+            },
+            "overall_sketch": self.overall_sketch.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RatingDistribution":
+        distribution = cls(data["rating_names"])
+        distribution.moments = {
+            name: RunningMoments.from_dict(moments)
+            for name, moments in data["moments"].items()
+        }
+        distribution.overall_sketch = QuantileSketch.from_dict(data["overall_sketch"])
+
+        return distribution
+
+
+def fit_distribution(
+    read_chunks: Callable[[], Iterable[pd.DataFrame]], rating_names: Sequence[str]
+) -> RatingDistribution:
+    """Summarize the distribution of ratings that are read in chunks.
+
+    The chunks are read twice: for the moments of the raw ratings and for the quantiles
+    of the overall rating.
+    """
+    distribution = RatingDistribution(rating_names)
+
+    for chunk in read_chunks():
+        distribution.update_moments(chunk)
+
+    for chunk in read_chunks():
+        distribution.update_quantiles(chunk)
+
+    return distribution
+
+
+def normalize_and_bin_chunks(
+    read_chunks: Callable[[], Iterable[pd.DataFrame]],
+    rating_names: Sequence[str],
+    num_bins: int,
+    distribution: Optional[RatingDistribution] = None,
+    keep_raw: bool = False,
+) -> Iterator[pd.DataFrame]:
+    """Normalize and bin ratings that are read in chunks, without holding all of them.
+
+    The chunks are read three times: for the moments of the raw ratings, for the quantiles
+    of the overall rating and finally for normalizing and binning each chunk.
+
+    Parameters
+    ----------
+    read_chunks
+        Function returning a fresh iterable over chunks of raw ratings on each call
+    rating_names
+        Names of the ratings to normalize and combine by averaging
+    num_bins
+        Number of bins to sort the ratings into
+    distribution
+        Distribution to use instead of computing it from the chunks, e.g. merged from
+        several shards
+    keep_raw
+        Keep the raw ratings next to the normalized ratings
+
+    Returns
+    -------
+    Chunks with normalized ratings, overall rating and bin ("rating_new")
+    """
+    if distribution is None:
+        distribution = fit_distribution(read_chunks, rating_names)
+
+    interval_bounds = distribution.interval_bounds(num_bins)
+
+    for chunk in read_chunks():
+        chunk = distribution.normalize(chunk, keep_raw)
+        chunk["rating_new"] = bin_ratings(chunk["overall"], interval_bounds)
+        yield chunk
@@ -0,0 +1,74 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+class ClientStats:
+    """Latencies and transferred message bytes of the requests of a client run.
+
+    Requests are identified by a key (e.g. the request id), so that the latency of a
+    request is measured from sending it until its response is received, also when
+    responses arrive out of order.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._send_times: Dict[str, float] = {}
+        self._start_time: Optional[float] = None
+        self._end_time: Optional[float] = None
+
+        self.latencies_s: List[float] = []
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def request_sent(self, key: str, num_bytes: int) -> None:
+        now = time.perf_counter()
+
+        with self._lock:
+            if self._start_time is None:
+                self._start_time = now
+
+            self._send_times[key] = now
+            self.bytes_sent += num_bytes
+
+    def response_received(self, key: str, num_bytes: int) -> None:
+        now = time.perf_counter()
+
+        with self._lock:
+            send_time = self._send_times.pop(key, None)
+
+            if send_time is not None:
+                self.latencies_s.append(now - send_time)
+
+            self._end_time = now
+            self.bytes_received += num_bytes
+
+    def summary(self) -> Dict[str, Any]:
+        """Throughput, latency percentiles and transferred bytes."""
+        with self._lock:
+            duration_s = (
+                self._end_time - self._start_time
+                if self._start_time is not None and self._end_time is not None
+                else 0.0
+            )
+            latencies_ms = 1000 * np.array(self.latencies_s)
+
+            return {
+                "num_responses": len(self.latencies_s),
+                "duration_s": duration_s,
+                "images_per_s": (
+                    len(self.latencies_s) / duration_s if duration_s > 0 else 0.0
+                ),
+                "latency_ms": {
+                    f"p{percentile}": (
+                        float(np.percentile(latencies_ms, percentile))
+                        if len(latencies_ms)
+                        else None
+                    )
+                    for percentile in (50, 95, 99)
+                },
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+            }
@@ -0,0 +1,888 @@
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import signal
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import fire
+import numpy as np
+import pandas as pd
+
+from imageassessmentservice.arguments import as_tuple
+from imageassessmentservice.client import rate_images
+from imageassessmentservice.definitions import (
+    ASSESSMENT_HEADS,
+    DEFAULT_IMAGE_EXTENSIONS,
+    DEFAULT_PORT,
+)
+from imageassessmentservice.index import RatingsIndex
+from imageassessmentservice.messages import grpc_target
+from imageassessmentservice.process import (
+    ImageSorter,
+    load_digikam_image_data,
+    write_ratings,
+)
+from imageassessmentservice.scanner import FileSelector, scan_directory
+from imageassessmentservice.statistics import (
+    bin_ratings,
+    fit_distribution,
+    RatingDistribution,
+)
+
+# Files kept in the state folder; the index has the name that `infer_on_images` uses
+# with `--incremental` for "ratings.csv", so that both can share it
+INDEX_FILE_NAME = "ratings.index.sqlite"
+DISTRIBUTION_FILE_NAME = "distribution.json"
+
+# Events of inotify(7)
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_INOTIFY_MASK = _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+
+# Header of an inotify event: watch descriptor, mask, cookie and length of the name
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class FileState(NamedTuple):
+    size: int
+    mtime_ns: int
+
+
+def _file_state(path: Union[str, Path]) -> Optional[FileState]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return FileState(stat.st_size, stat.st_mtime_ns)
+
+
+def _walk_images(
+    selector: FileSelector,
+    folder: str,
+    descend: Callable[[str], bool] = lambda directory: True,
+) -> Iterator[Tuple[str, int, List[str]]]:
+    """Yield each folder below `folder` that is not excluded, with its modification
+    time and its images.
+
+    The modification time is taken before the folder is listed, so that changes while
+    it is listed are not missed. Sub-folders are only visited if `descend` is True.
+    """
+    pending = [folder]
+
+    while pending:
+        current = pending.pop()
+        state = _file_state(current)
+
+        if state is None:
+            continue
+
+        files, directories = scan_directory(current)
+        images = []
+
+        for file in files:
+            scanned_file = selector.select(file)
+
+            if scanned_file is not None and scanned_file.is_image:
+                images.append(file)
+
+        yield current, state.mtime_ns, images
+
+        pending.extend(
+            directory
+            for directory in directories
+            if not selector.is_excluded_folder(directory) and descend(directory)
+        )
+
+
+class PollingWatcher:
+    """Detects new and changed images by polling modification times.
+
+    Each poll stats the known folders and lists only those whose modification time
+    changed, which reveals added, removed and renamed files. Images that are modified in
+    place do not change the modification time of their folder and are found by a full
+    scan every `full_scan_interval_s`.
+
+    Parameters
+    ----------
+    selector
+        Selects the images below the watched folder
+    full_scan_interval_s
+        Time between full scans, which stat all images
+    clock
+        Monotonic clock in seconds
+    """
+
+    def __init__(
+        self,
+        selector: FileSelector,
+        full_scan_interval_s: float = 3600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.selector = selector
+        self.full_scan_interval_s = full_scan_interval_s
+        self._clock = clock
+        self._last_full_scan: Optional[float] = None
+        self._folder_mtimes: Dict[str, int] = {}
+        self._images: Dict[str, Dict[str, FileState]] = {}
+
+    def changes(self) -> List[Path]:
+        """Images that are new or changed since the last call, all images on the first
+        call."""
+        now = self._clock()
+
+        if (
+            self._last_full_scan is None
+            or now - self._last_full_scan >= self.full_scan_interval_s
+        ):
+            self._last_full_scan = now
+            return self._scan(self.selector.root, full=True)
+
+        changed: List[Path] = []
+
+        for folder, mtime_ns in list(self._folder_mtimes.items()):
+            state = _file_state(folder)
+
+            if state is None:
+                self._folder_mtimes.pop(folder, None)
+                self._images.pop(folder, None)
+            elif state.mtime_ns != mtime_ns:
+                changed.extend(self._scan(folder, full=False))
+
+        return changed
+
+    def _scan(self, folder: str, full: bool) -> List[Path]:
+        """List a folder and, for a full scan, all its sub-folders, otherwise only its
+        new sub-folders."""
+        changed: List[Path] = []
+
+        for current, mtime_ns, images in _walk_images(
+            self.selector,
+            folder,
+            lambda directory: full or directory not in self._folder_mtimes,
+        ):
+            known_images = self._images.get(current, {})
+            image_states = {}
+
+            for image in images:
+                state = _file_state(image)
+
+                if state is None:
+                    continue
+
+                image_states[image] = state
+
+                if known_images.get(image) != state:
+                    changed.append(Path(image))
+
+            self._folder_mtimes[current] = mtime_ns
+            self._images[current] = image_states
+
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """Detects new and changed images with inotify (Linux).
+
+    Each folder below the watched folder is watched for images that are created, written,
+    moved in or whose modification time is set. New folders are watched and listed as
+    they appear. If the kernel drops events, all folders are listed again.
+
+    Raises
+    ------
+    OSError
+        If inotify is not available or the folders exceed the limit of watches
+        (fs.inotify.max_user_watches)
+    """
+
+    def __init__(self, selector: FileSelector):
+        self.selector = selector
+
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux.")
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available.")
+
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "Cannot initialize inotify.")
+
+        self._folders: Dict[int, str] = {}
+        self._watching = False
+
+    def _watch(self, folder: str) -> List[Path]:
+        """Watch a folder and its sub-folders and list their images."""
+        images: List[Path] = []
+
+        for current, _, current_images in _walk_images(self.selector, folder):
+            watch_descriptor = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(current), _INOTIFY_MASK
+            )
+
+            if watch_descriptor < 0:
+                error = ctypes.get_errno()
+
+                if error == errno.ENOENT:
+                    continue
+
+                raise OSError(error, f"Cannot watch {current}: {os.strerror(error)}")
+
+            self._folders[watch_descriptor] = current
+            images.extend(map(Path, current_images))
+
+        return images
+
+    def changes(self) -> List[Path]:
+        """Images that are new or changed since the last call, all images on the first
+        call."""
+        if not self._watching:
+            self._watching = True
+            return self._watch(self.selector.root)
+
+        changed: List[Path] = []
+        overflow = False
+
+        while True:
+            try:
+                events = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            offset = 0
+
+            while offset < len(events):
+                watch_descriptor, mask, _, name_length = _INOTIFY_EVENT.unpack_from(
+                    events, offset
+                )
+                name = events[
+                    offset
+                    + _INOTIFY_EVENT.size : offset
+                    + _INOTIFY_EVENT.size
+                    + name_length
+                ].rstrip(b"\0")
+                offset += _INOTIFY_EVENT.size + name_length
+
+                if mask & _IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+
+                if mask & _IN_IGNORED:
+                    self._folders.pop(watch_descriptor, None)
+                    continue
+
+                folder = self._folders.get(watch_descriptor)
+
+                if folder is None or not name:
+                    continue
+
+                path = os.path.join(folder, os.fsdecode(name))
+
+                if mask & _IN_ISDIR:
+                    if mask & (_IN_CREATE | _IN_MOVED_TO) and not (
+                        self.selector.is_excluded_folder(path)
+                    ):
+                        changed.extend(self._watch(path))
+                else:
+                    scanned_file = self.selector.select(path)
+
+                    if scanned_file is not None and scanned_file.is_image:
+                        changed.append(scanned_file.path)
+
+        if overflow:
+            print("Missed file system events, listing all folders again.")
+            changed.extend(self._watch(self.selector.root))
+
+        return changed
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def create_watcher(
+    selector: FileSelector,
+    use_inotify: bool = True,
+    full_scan_interval_s: float = 3600.0,
+) -> Union[InotifyWatcher, PollingWatcher]:
+    """Watch with inotify if possible and by polling modification times otherwise."""
+    if use_inotify:
+        try:
+            return InotifyWatcher(selector)
+        except OSError as e:
+            print(f"Cannot use inotify ({e}), polling modification times instead.")
+
+    return PollingWatcher(selector, full_scan_interval_s)
+
+
+class Debouncer:
+    """Holds back files until they are no longer written, e.g. while they are copied
+    from a memory card.
+
+    A file is ready once its size and modification time did not change for `settle_s`.
+    Files that were last modified longer ago are ready at once, so that the images of
+    an existing library do not wait.
+
+    Parameters
+    ----------
+    settle_s
+        Time for which a file must not change before it is ready
+    clock
+        Monotonic clock in seconds
+    wall_clock
+        Clock in seconds since the epoch, against which modification times are compared
+    """
+
+    def __init__(
+        self,
+        settle_s: float = 5.0,
+        clock: Callable[[], float] = time.monotonic,
+        wall_clock: Callable[[], float] = time.time,
+    ):
+        self.settle_s = settle_s
+        self._clock = clock
+        self._wall_clock = wall_clock
+        # State of each pending file and since when it has this state
+        self._pending: Dict[Path, Tuple[FileState, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, paths: Iterable[Path]) -> None:
+        now = self._clock()
+
+        for path in paths:
+            state = _file_state(path)
+
+            if state is None:
+                self._pending.pop(path, None)
+            elif path not in self._pending or self._pending[path][0] != state:
+                self._pending[path] = (state, now)
+
+    def ready(self) -> List[Path]:
+        """Remove and return the files that are ready."""
+        now = self._clock()
+        wall_now = self._wall_clock()
+        ready_paths = []
+
+        for path, (state, since) in list(self._pending.items()):
+            current_state = _file_state(path)
+
+            if current_state is None:
+                del self._pending[path]
+            elif current_state != state:
+                self._pending[path] = (current_state, now)
+            elif (
+                now - since >= self.settle_s
+                or wall_now - state.mtime_ns / 1e9 >= self.settle_s
+            ):
+                del self._pending[path]
+                ready_paths.append(path)
+
+        return sorted(ready_paths)
+
+
+class _Retry(NamedTuple):
+    # Time (as given by `time.monotonic`) from which the image is rated again
+    retry_at: float
+    num_failures: int
+
+
+# Upper bound of the factor by which the retry interval grows
+_MAX_RETRY_BACKOFF = 64
+
+
+class WatchSession:
+    """Rates new and changed images below a folder and applies their bins as they arrive.
+
+    Raw ratings are kept in an index, so that images are only rated once, and bins are
+    taken from a persisted distribution of the ratings, so that a new image is binned
+    without looking at the rest of the library. If there is no distribution yet, the
+    images are rated first and the distribution is computed from the index once at
+    least `min_ratings` images are rated and no image is waiting to be rated.
+
+    The distribution is computed again from all ratings in the index once their number
+    has grown by a factor of `refit_growth`, e.g. while an existing library is rated
+    for the first time. New images are binned with the new distribution, while images
+    that were binned before keep their bins until they change.
+
+    Images that could not be rated, e.g. while the service is not available, are rated
+    again after `retry_interval_s`, which doubles with each further failure.
+
+    Parameters
+    ----------
+    watcher
+        Detects new and changed images, see `create_watcher`
+    debouncer
+        Holds back images that are still written
+    index
+        Index of the raw ratings
+    distribution_file
+        JSON file with the distribution of the ratings, see `RatingDistribution`
+    address
+        Address of the image assessment service
+    heads
+        Heads to run, the bins are based on these heads only
+    num_bins
+        Number of bins to sort the images into
+    digikam_db
+        Digikam database (digikam4.db) in which the bins are stored as ratings
+    album_root_prefix
+        Prefix of the album root paths stored in the Digikam database
+    image_sorter
+        Places the images in the folders of their bins
+    batch_size
+        Maximum number of images per call of the service
+    max_in_flight
+        Maximum number of images that are sent but not yet rated
+    min_ratings
+        Minimum number of ratings from which the distribution is computed
+    retry_interval_s
+        Time after which an image that could not be rated is rated again
+    refit_growth
+        Factor by which the number of ratings grows before the distribution is
+        computed again, never if 0
+    """
+
+    def __init__(
+        self,
+        watcher: Union[InotifyWatcher, PollingWatcher],
+        debouncer: Debouncer,
+        index: RatingsIndex,
+        distribution_file: Path,
+        address: str,
+        heads: Sequence[str] = ASSESSMENT_HEADS,
+        num_bins: int = 5,
+        digikam_db: Optional[Path] = None,
+        album_root_prefix: str = "/home",
+        image_sorter: Optional[ImageSorter] = None,
+        batch_size: int = 32,
+        max_in_flight: int = 16,
+        min_ratings: int = 100,
+        retry_interval_s: float = 60.0,
+        refit_growth: float = 2.0,
+    ):
+        if batch_size < 1:
+            raise ValueError("Expect batch_size to be at least 1.")
+
+        if refit_growth != 0 and refit_growth <= 1:
+            raise ValueError("Expect refit_growth to be 0 or greater than 1.")
+
+        self.watcher = watcher
+        self.debouncer = debouncer
+        self.index = index
+        self.distribution_file = distribution_file
+        self.address = address
+        self.heads = list(heads)
+        self.num_bins = num_bins
+        self.digikam_db = digikam_db
+        self.album_root_prefix = album_root_prefix
+        self.image_sorter = image_sorter
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.min_ratings = min_ratings
+        self.retry_interval_s = retry_interval_s
+        self.refit_growth = refit_growth
+
+        # Images that could not be rated and when to rate them again
+        self._retries: Dict[Path, _Retry] = {}
+        # Images that were rated while there was no distribution yet
+        self._unapplied_paths: List[Path] = []
+        self.distribution: Optional[RatingDistribution] = None
+        self._interval_bounds: Optional[np.ndarray] = None
+        # Counted once and then kept up to date, so that the index is not read on
+        # every poll. Images rated again are counted again until the next fit.
+        self._num_ratings = index.count(self.heads)
+
+        if distribution_file.exists():
+            self._set_distribution(
+                RatingDistribution.from_dict(json.loads(distribution_file.read_text()))
+            )
+
+    def _set_distribution(self, distribution: RatingDistribution) -> None:
+        if distribution.rating_names != self.heads:
+            raise ValueError(
+                f"Expect the distribution in {self.distribution_file} to be of the "
+                f"heads {self.heads}, not {distribution.rating_names}."
+            )
+
+        self.distribution = distribution
+        self._interval_bounds = distribution.interval_bounds(self.num_bins)
+
+    def step(self) -> int:
+        """Rate the images that are ready and apply their bins.
+
+        Returns
+        -------
+        Number of rated images
+        """
+        self.debouncer.add(self.watcher.changes())
+        now = time.monotonic()
+        due_paths = [
+            path for path, retry in self._retries.items() if retry.retry_at <= now
+        ]
+        paths_to_rate = []
+
+        # Images that did not change since they were rated, e.g. when an existing
+        # library is listed at the start, are skipped
+        for path in sorted(set(self.debouncer.ready()).union(due_paths)):
+            if self._is_stale(path):
+                paths_to_rate.append(path)
+            else:
+                self._retries.pop(path, None)
+
+        for start in range(0, len(paths_to_rate), self.batch_size):
+            self._rate(paths_to_rate[start : start + self.batch_size])
+
+        if not len(self.debouncer) and self._needs_distribution():
+            self._fit_distribution()
+
+        return len(paths_to_rate)
+
+    def _needs_distribution(self) -> bool:
+        if self.distribution is None:
+            return bool(self._unapplied_paths) and self._num_ratings >= self.min_ratings
+
+        return bool(self.refit_growth) and (
+            self._num_ratings
+            >= self.refit_growth * self.distribution.moments[self.heads[0]].count
+        )
+
+    def _is_stale(self, image_path: Path) -> bool:
+        try:
+            return self.index.is_stale(image_path, self.heads)
+        except OSError:
+            # Removed since it was ready
+            return False
+
+    def _rate(self, image_paths: List[Path]) -> None:
+        raw_ratings, images_with_issues = rate_images(
+            image_paths,
+            self.address,
+            self.max_in_flight,
+            self.index.add,
+            self.heads,
+            show_progress=False,
+        )
+        self.index.flush()
+
+        if images_with_issues:
+            print(
+                f"Could not rate {len(images_with_issues)} images, trying again "
+                "later."
+            )
+
+        for image_path in images_with_issues:
+            retry = self._retries.get(image_path)
+            num_failures = 1 if retry is None else retry.num_failures + 1
+            self._retries[image_path] = _Retry(
+                time.monotonic()
+                + self.retry_interval_s
+                * min(2 ** (num_failures - 1), _MAX_RETRY_BACKOFF),
+                num_failures,
+            )
+
+        if raw_ratings.empty:
+            return
+
+        for image_path in raw_ratings["image_path"]:
+            self._retries.pop(Path(image_path), None)
+
+        self._num_ratings += len(raw_ratings)
+
+        if self.distribution is None:
+            self._unapplied_paths.extend(map(Path, raw_ratings["image_path"]))
+            print(
+                f"Rated {len(raw_ratings)} images, waiting for the distribution of "
+                "the ratings to bin them."
+            )
+        else:
+            self._apply(raw_ratings)
+
+    def _read_rated_chunks(
+        self, image_paths: Optional[Iterable[Path]]
+    ) -> Iterator[pd.DataFrame]:
+        for chunk in self.index.iter_ratings(image_paths, self.heads):
+            chunk = chunk.dropna(subset=self.heads)
+
+            if not chunk.empty:
+                yield chunk
+
+    def _fit_distribution(self) -> None:
+        distribution = fit_distribution(
+            lambda: self._read_rated_chunks(None), self.heads
+        )
+        self._num_ratings = num_ratings = distribution.moments[self.heads[0]].count
+
+        if self.distribution is None and num_ratings < self.min_ratings:
+            return
+
+        # Replace the file at once, so that an interrupted write does not corrupt it
+        temporary_file = self.distribution_file.with_suffix(".tmp")
+        temporary_file.write_text(json.dumps(distribution.to_dict()))
+        os.replace(temporary_file, self.distribution_file)
+
+        self._set_distribution(distribution)
+        print(
+            f"Computed the distribution of {num_ratings} ratings and stored it in "
+            f"{self.distribution_file}."
+        )
+
+        if self._unapplied_paths:
+            for chunk in self._read_rated_chunks(self._unapplied_paths):
+                self._apply(chunk)
+
+            self._unapplied_paths = []
+
+    def _apply(self, raw_ratings: pd.DataFrame) -> None:
+        """Bin raw ratings and store the bins in the Digikam database and the folders."""
+        distribution, interval_bounds = self.distribution, self._interval_bounds
+
+        if distribution is None or interval_bounds is None:
+            raise RuntimeError("Cannot bin ratings without their distribution.")
+
+        ratings = distribution.normalize(
+            raw_ratings[["image_path", *self.heads]].dropna().copy()
+        )
+        ratings["rating_new"] = bin_ratings(ratings["overall"], interval_bounds)
+        ratings["image_path"] = ratings["image_path"].astype(str)
+
+        if self.digikam_db is not None:
+            image_data = load_digikam_image_data(
+                self.digikam_db, ratings["image_path"], self.album_root_prefix
+            )
+            merged_table = ratings.merge(
+                image_data, left_on="image_path", right_on="full_path"
+            )
+            update_summary = write_ratings(
+                self.digikam_db,
+                merged_table[["image_id", "rating_old", "rating_new"]].itertuples(
+                    index=False, name=None
+                ),
+            )
+            print(
+                f"Updated {update_summary.updated} ratings in the Digikam database, "
+                f"skipped {update_summary.skipped}, failed to update "
+                f"{update_summary.failed}."
+            )
+
+        if self.image_sorter is not None:
+            rated_images = [
+                (Path(image_path), int(rating))
+                for image_path, rating in zip(
+                    ratings["image_path"], ratings["rating_new"]
+                )
+            ]
+
+            # Images that were rated before may be placed in the folder of another bin
+            for image_path, rating in rated_images:
+                self.image_sorter.remove(
+                    image_path,
+                    (other for other in range(1, self.num_bins + 1) if other != rating),
+                )
+
+            sort_summary = self.image_sorter.sort_all(rated_images, show_progress=False)
+            print(
+                f"Placed {sort_summary.placed} images, skipped {sort_summary.skipped}, "
+                f"failed to place {sort_summary.failed}."
+            )
+
+    def run(self, poll_interval_s: float, stop: threading.Event) -> None:
+        """Rate images until `stop` is set."""
+        while True:
+            self.step()
+
+            if stop.wait(poll_interval_s):
+                return
+
+
+def watch(
+    source_folder: str,
+    state_folder: str,
+    address: str = "localhost",
+    port: int = DEFAULT_PORT,
+    digikam_db: Optional[str] = None,
+    album_root_prefix: str = "/home",
+    target_folder: Optional[str] = None,
+    strategy: str = "copy",
+    num_bins: int = 5,
+    heads: Sequence[str] = ASSESSMENT_HEADS,
+    extensions: Sequence[str] = DEFAULT_IMAGE_EXTENSIONS,
+    include: Sequence[str] = (),
+    exclude: Sequence[str] = (),
+    settle_s: float = 5.0,
+    poll_interval_s: float = 1.0,
+    full_scan_interval_s: float = 3600.0,
+    use_inotify: bool = True,
+    batch_size: int = 32,
+    max_in_flight: int = 16,
+    min_ratings: int = 100,
+    retry_interval_s: float = 60.0,
+    refit_growth: float = 2.0,
+) -> None:
+    """
+    Rate new and changed images continuously and store their bins.
+
+    Parameters
+    ----------
+    source_folder
+        Folder to watch for images
+    state_folder
+        Folder in which the index of the raw ratings and the distribution of the
+        ratings are kept, e.g. the folder of the ratings file of incremental runs of
+        the client, whose index is then reused
+    address
+        Host where the image assessment service is running
+    port
+        Port on which the image assessment service listens, unless `address`
+        contains a port
+    digikam_db
+        Digikam database (digikam4.db) in which the bins are stored as ratings
+    album_root_prefix
+        Prefix of the album root paths stored in the Digikam database
+    target_folder
+        Folder in which the images are placed in sub-folders according to their bins,
+        outside of the source folder
+    strategy
+        How images are placed in the target folder, see `process sort`
+    num_bins
+        Number of bins in which to sort the images
+    heads
+        Heads to run (comma-separated on the command line)
+    extensions
+        File extensions of the images to rate (comma-separated on the command line)
+    include
+        Glob patterns of the files to consider, all files if empty
+    exclude
+        Glob patterns of files and folders to skip
+    settle_s
+        Time for which an image must not change before it is rated, so that images
+        that are still being copied are not rated
+    poll_interval_s
+        Time between looking for new images
+    full_scan_interval_s
+        Time between full scans when polling, which find images modified in place
+    use_inotify
+        Use inotify on Linux, and fall back to polling modification times if it is not
+        available
+    batch_size
+        Maximum number of images sent to the service at once
+    max_in_flight
+        Maximum number of images that are sent but not yet rated
+    min_ratings
+        Minimum number of ratings from which the distribution of the ratings is
+        computed, if the state folder does not contain it yet
+    retry_interval_s
+        Time after which an image that could not be rated is rated again, doubled
+        after each further failure
+    refit_growth
+        Factor by which the number of ratings grows before their distribution is
+        computed again, never if 0
+    """
+    heads = as_tuple(heads)
+
+    if not heads or set(heads) - set(ASSESSMENT_HEADS):
+        raise ValueError(f"Expect heads to be a subset of {ASSESSMENT_HEADS}.")
+
+    source_folder_path = Path(source_folder).absolute()
+    state_folder_path = Path(state_folder)
+
+    if not source_folder_path.is_dir():
+        raise FileNotFoundError("Source folder does not exist or is a file.")
+
+    if digikam_db is None and target_folder is None:
+        raise ValueError("Expect a Digikam database or a target folder.")
+
+    if digikam_db is not None and (
+        Path(digikam_db).name != "digikam4.db" or not Path(digikam_db).exists()
+    ):
+        raise FileNotFoundError("Cannot find Digikam database file digikam4.db.")
+
+    image_sorter = None
+
+    if target_folder is not None:
+        target_folder_path = Path(target_folder).absolute()
+
+        if (
+            target_folder_path == source_folder_path
+            or source_folder_path in target_folder_path.parents
+        ):
+            raise ValueError(
+                "Expect the target folder to be outside the source folder."
+            )
+
+        image_sorter = ImageSorter(source_folder_path, target_folder_path, strategy)
+
+    state_folder_path.mkdir(parents=True, exist_ok=True)
+
+    selector = FileSelector(
+        source_folder_path,
+        as_tuple(extensions),
+        as_tuple(include),
+        as_tuple(exclude),
+    )
+    watcher = create_watcher(selector, use_inotify, full_scan_interval_s)
+    index = RatingsIndex(state_folder_path / INDEX_FILE_NAME)
+
+    stop = threading.Event()
+
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    try:
+        session = WatchSession(
+            watcher,
+            Debouncer(settle_s),
+            index,
+            state_folder_path / DISTRIBUTION_FILE_NAME,
+            grpc_target(address, port),
+            heads,
+            num_bins,
+            None if digikam_db is None else Path(digikam_db),
+            album_root_prefix,
+            image_sorter,
+            batch_size,
+            max_in_flight,
+            min_ratings,
+            retry_interval_s,
+            refit_growth,
+        )
+        print(f"Watching {source_folder_path} for new and changed images.")
+        session.run(poll_interval_s, stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        index.close()
+
+
+if __name__ == "__main__":
+    fire.Fire(watch)
@@ -5,8 +5,8 @@ from typing import List
 from setuptools import setup, find_packages
 
 
-def read_requirements() -> List[str]:
-    with open("requirements.txt", "r") as file:
+def read_requirements(file_name: str = "requirements.txt") -> List[str]:
+    with open(file_name, "r") as file:
         requirements = [line.rstrip("\n") for line in file.readlines()]
 
     return requirements
@@ -27,6 +27,11 @@ setup(
     long_description_content_type="text/markdown",
     requires=["setuptools", "grpc_tools"],
     install_requires=read_requirements(),
+    # The client does not need Tensorflow, only the server does
+    extras_require={
+        "server": read_requirements("requirements-server.txt"),
+        "parquet": read_requirements("requirements-parquet.txt"),
+    },
     setup_requires=["pytest-runner", "flake8"],
     tests_require=["pytest"],
     python_requires=">=3.8",
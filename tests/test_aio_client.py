@@ -0,0 +1,182 @@
+import socket
+from pathlib import Path
+from typing import Dict
+
+import grpc
+import pytest
+
+from imageassessmentservice.aio_client import rate_images_concurrently
+from imageassessmentservice.definitions import RETRY_PUSHBACK_METADATA_KEY
+from imageassessmentservice.imageassessment_pb2 import ImageAssessmentResponse
+from imageassessmentservice.models import FakeModel
+from imageassessmentservice.server import create_server, ImageAssessmentService
+
+
+def _rpc_error(
+    code: grpc.StatusCode, trailing_metadata: grpc.aio.Metadata = None
+) -> grpc.aio.AioRpcError:
+    return grpc.aio.AioRpcError(
+        code, grpc.aio.Metadata(), trailing_metadata or grpc.aio.Metadata()
+    )
+
+
+class FakeAsyncStub:
+    """Fails the first attempt for each image with UNAVAILABLE and empty images for good."""
+
+    attempts: Dict[str, int] = {}
+
+    def __init__(self, channel):
+        pass
+
+    async def Assess(self, request, timeout=None):
+        num_attempts = self.attempts.get(request.path, 0) + 1
+        self.attempts[request.path] = num_attempts
+
+        if num_attempts == 1:
+            raise _rpc_error(grpc.StatusCode.UNAVAILABLE)
+
+        if not request.image_bytes:
+            raise _rpc_error(grpc.StatusCode.INVALID_ARGUMENT)
+
+        return ImageAssessmentResponse(
+            path=request.path,
+            assessment_aesthetic=len(request.image_bytes),
+            assessment_technical=2.0 * len(request.image_bytes),
+        )
+
+
+@pytest.fixture
+def fake_stub(mocker):
+    FakeAsyncStub.attempts = {}
+    mocker.patch("imageassessmentservice.aio_client.ImageAssessmentStub", FakeAsyncStub)
+    return FakeAsyncStub
+
+
+def test_rate_images_concurrently(tmp_path: Path, fake_stub) -> None:
+    image_paths = []
+    for i in range(6):
+        image_path = tmp_path / f"image_{i}.jpg"
+        image_path.write_bytes(b"x" * i)
+        image_paths.append(image_path)
+
+    missing_image_path = tmp_path / "missing.jpg"
+
+    ratings, images_with_issues = rate_images_concurrently(
+        image_paths + [missing_image_path],
+        "localhost",
+        concurrency=3,
+        initial_backoff_s=0.001,
+    )
+
+    ratings = ratings.sort_values("image_path", ignore_index=True)
+    assert ratings["image_path"].tolist() == [str(path) for path in image_paths[1:]]
+    assert ratings["aesthetic"].tolist() == [1, 2, 3, 4, 5]
+    assert sorted(images_with_issues) == [image_paths[0], missing_image_path]
+
+    # Transient errors are retried, other errors are not
+    assert fake_stub.attempts[str(image_paths[0])] == 2
+    assert fake_stub.attempts[str(image_paths[1])] == 2
+    assert str(missing_image_path) not in fake_stub.attempts
+
+
+def test_rate_images_concurrently_gives_up_after_max_retries(
+    tmp_path: Path, fake_stub
+) -> None:
+    image_path = tmp_path / "image.jpg"
+    image_path.write_bytes(b"x")
+
+    ratings, images_with_issues = rate_images_concurrently(
+        [image_path], "localhost", max_retries=0
+    )
+
+    assert ratings.empty
+    assert images_with_issues == [image_path]
+
+
+class OverloadedAsyncStub(FakeAsyncStub):
+    """Rejects the first attempt for each image as overloaded, and large images for
+    good."""
+
+    async def Assess(self, request, timeout=None):
+        num_attempts = self.attempts.get(request.path, 0) + 1
+        self.attempts[request.path] = num_attempts
+
+        if "large" in request.path:
+            raise _rpc_error(grpc.StatusCode.RESOURCE_EXHAUSTED)
+
+        if num_attempts == 1:
+            raise _rpc_error(
+                grpc.StatusCode.RESOURCE_EXHAUSTED,
+                grpc.aio.Metadata((RETRY_PUSHBACK_METADATA_KEY, "10")),
+            )
+
+        return ImageAssessmentResponse(path=request.path, assessment_aesthetic=1.0)
+
+
+def test_rate_images_concurrently_retries_after_pushback(
+    tmp_path: Path, mocker
+) -> None:
+    OverloadedAsyncStub.attempts = {}
+    mocker.patch(
+        "imageassessmentservice.aio_client.ImageAssessmentStub", OverloadedAsyncStub
+    )
+    image_paths = [tmp_path / "image.jpg", tmp_path / "large.jpg"]
+
+    for image_path in image_paths:
+        image_path.write_bytes(b"x")
+
+    ratings, images_with_issues = rate_images_concurrently(
+        image_paths, "localhost", initial_backoff_s=10.0
+    )
+
+    # The retry waits for the hint of the server instead of the backoff
+    assert ratings["image_path"].tolist() == [str(image_paths[0])]
+    assert images_with_issues == [image_paths[1]]
+    assert OverloadedAsyncStub.attempts == {
+        str(image_paths[0]): 2,
+        str(image_paths[1]): 1,
+    }
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET6, socket.SOCK_STREAM) as s:
+        s.bind(("::", 0))
+        return s.getsockname()[1]
+
+
+def test_rate_images_concurrently_with_chunked_upload(tmp_path: Path) -> None:
+    # Images larger than the size limit of the server are rejected
+    service = ImageAssessmentService(
+        model=FakeModel(1.0, 1.0), max_batch_wait_ms=0, max_image_size_mb=0.01
+    )
+    port = _free_port()
+    server = create_server(service, port, max_workers=4)
+
+    image_paths = []
+    for size in [1, 5000, 10000, 20000]:
+        image_path = tmp_path / f"image_{size}.jpg"
+        image_path.write_bytes(b"x" * size)
+        image_paths.append(image_path)
+
+    try:
+        ratings, images_with_issues = rate_images_concurrently(
+            image_paths, f"localhost:{port}", concurrency=2, upload_chunk_kb=1
+        )
+    finally:
+        server.stop(grace=None)
+        service.scheduler.stop()
+
+    assert sorted(ratings["image_path"]) == sorted(
+        str(path) for path in image_paths[:3]
+    )
+    assert images_with_issues == [image_paths[3]]
+
+    # The fake model derives the ratings from the image content
+    expected_ratings = FakeModel().assess_batch(
+        [path.read_bytes() for path in image_paths[:3]]
+    )
+    assert sorted(ratings["aesthetic"]) == sorted(
+        assessment.aesthetic
+        for assessment in expected_ratings
+        if assessment.aesthetic is not None
+    )
@@ -0,0 +1,138 @@
+import random
+import socket
+from pathlib import Path
+
+import pytest
+
+from imageassessmentservice.aio_client import rate_images_concurrently
+from imageassessmentservice.balancer import LoadBalancer
+from imageassessmentservice.models import FakeModel
+from imageassessmentservice.server import create_server, ImageAssessmentService
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.mark.parametrize("policy", ["least_outstanding", "power_of_two"])
+def test_pick_spreads_requests(policy: str) -> None:
+    load_balancer = LoadBalancer(["a:1", "b:1", "c:1"], policy, rng=random.Random(0))
+
+    for i in range(30):
+        endpoint = load_balancer.pick()
+        load_balancer.request_started(endpoint, str(i), 10)
+
+    outstanding = [endpoint.outstanding for endpoint in load_balancer.endpoints]
+    assert sum(outstanding) == 30
+    assert max(outstanding) - min(outstanding) <= (
+        0 if policy == "least_outstanding" else 3
+    )
+
+
+def test_failed_endpoint_is_ejected() -> None:
+    clock = FakeClock()
+    load_balancer = LoadBalancer(["a:1", "b:1"], ejection_s=10.0, clock=clock)
+    endpoint_a, endpoint_b = load_balancer.endpoints
+
+    for _ in range(2):
+        load_balancer.request_started(endpoint_a, "0", 10)
+        load_balancer.request_failed(endpoint_a, "0", eject=True)
+
+    assert load_balancer.healthy_endpoints() == [endpoint_b]
+    assert load_balancer.pick() is endpoint_b
+
+    # Consecutive failures double the ejection time
+    clock.now = 15.0
+    assert load_balancer.healthy_endpoints() == [endpoint_b]
+    clock.now = 20.0
+    assert load_balancer.healthy_endpoints() == [endpoint_a, endpoint_b]
+
+    # Endpoints that failed for a request are only used if there is no other
+    assert load_balancer.pick(exclude=[endpoint_a]) is endpoint_b
+    assert load_balancer.pick(exclude=[endpoint_a, endpoint_b]) in (
+        endpoint_a,
+        endpoint_b,
+    )
+
+    # If all endpoints are ejected, the one that returns first is used
+    load_balancer.request_started(endpoint_b, "1", 10)
+    load_balancer.request_failed(endpoint_b, "1", eject=True)
+    load_balancer.request_started(endpoint_a, "2", 10)
+    load_balancer.request_failed(endpoint_a, "2", eject=True)
+    assert load_balancer.pick() is endpoint_b
+
+    summary = load_balancer.summary()
+    assert summary["a:1"]["num_failures"] == 3
+    assert summary["a:1"]["num_ejections"] == 3
+
+
+def test_slow_endpoint_is_ejected() -> None:
+    clock = FakeClock()
+    load_balancer = LoadBalancer(
+        ["a:1", "b:1"], min_latency_samples=3, slow_factor=3.0, clock=clock
+    )
+    endpoint_a, endpoint_b = load_balancer.endpoints
+
+    for i in range(3):
+        for endpoint, latency_s in [(endpoint_a, 0.1), (endpoint_b, 1.0)]:
+            load_balancer.request_started(endpoint, str(i), 10)
+            clock.now += latency_s
+            load_balancer.request_succeeded(endpoint, str(i), 10)
+
+    assert load_balancer.healthy_endpoints() == [endpoint_a]
+    assert endpoint_b.num_ejections == 1
+    assert endpoint_b.num_failures == 0
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET6, socket.SOCK_STREAM) as s:
+        s.bind(("::", 0))
+        return s.getsockname()[1]
+
+
+def test_rate_images_with_several_servers(tmp_path: Path) -> None:
+    services = [
+        ImageAssessmentService(model=FakeModel(1.0, 1.0), max_batch_wait_ms=0)
+        for _ in range(2)
+    ]
+    ports = [_free_port() for _ in range(3)]
+    # Nothing listens on the last port
+    servers = [
+        create_server(service, port, max_workers=4)
+        for service, port in zip(services, ports)
+    ]
+
+    image_paths = []
+    for i in range(20):
+        image_path = tmp_path / f"image_{i}.jpg"
+        image_path.write_bytes(b"x" * (i + 1))
+        image_paths.append(image_path)
+
+    targets = [f"localhost:{port}" for port in ports]
+    load_balancer = LoadBalancer(targets)
+
+    try:
+        ratings, images_with_issues = rate_images_concurrently(
+            image_paths,
+            targets,
+            concurrency=4,
+            timeout_s=10.0,
+            load_balancer=load_balancer,
+        )
+    finally:
+        for server, service in zip(servers, services):
+            server.stop(grace=None)
+            service.scheduler.stop()
+
+    assert images_with_issues == []
+    assert sorted(ratings["image_path"]) == sorted(str(path) for path in image_paths)
+
+    summary = load_balancer.summary()
+    assert summary[targets[0]]["num_responses"] > 0
+    assert summary[targets[1]]["num_responses"] > 0
+    assert summary[targets[2]]["num_responses"] == 0
+    assert summary[targets[2]]["num_ejections"] >= 1
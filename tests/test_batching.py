@@ -0,0 +1,215 @@
+import threading
+import time
+from typing import List, Optional, Sequence
+
+import pytest
+
+from imageassessmentservice.batching import (
+    BatchScheduler,
+    DeadlineExpiredError,
+    QueueFullError,
+)
+from imageassessmentservice.definitions import ASSESSMENT_HEADS
+from imageassessmentservice.models import Assessment, AssessmentModel
+
+
+class RecordingModel(AssessmentModel):
+    """Stub model that rates images by their length and records the batch sizes."""
+
+    def __init__(self, release: Optional[threading.Event] = None):
+        self.batch_sizes: List[int] = []
+        self.batch_heads: List[Sequence[str]] = []
+        self.images: List[bytes] = []
+        self.release = release
+        self.entered = threading.Event()
+
+    def assess_batch(
+        self, images: Sequence[bytes], heads: Sequence[str] = ASSESSMENT_HEADS
+    ) -> List[Assessment]:
+        self.entered.set()
+
+        if self.release is not None:
+            self.release.wait()
+
+        self.batch_sizes.append(len(images))
+        self.batch_heads.append(heads)
+        self.images.extend(images)
+        return [Assessment(len(image), 2 * len(image)) for image in images]
+
+
+def test_batch_scheduler_routes_results() -> None:
+    scheduler = BatchScheduler(RecordingModel(), max_batch_size=4)
+
+    futures = [scheduler.submit(b"x" * i) for i in range(1, 11)]
+
+    assert [future.result(timeout=5) for future in futures] == [
+        Assessment(i, 2 * i) for i in range(1, 11)
+    ]
+    scheduler.stop()
+
+
+def test_batch_scheduler_respects_max_batch_size() -> None:
+    release = threading.Event()
+    model = RecordingModel(release)
+    scheduler = BatchScheduler(model, max_batch_size=4, max_batch_wait_ms=0)
+
+    # The first request blocks the model while the remaining requests queue up
+    first_future = scheduler.submit(b"first")
+    assert model.entered.wait(timeout=5)
+    futures = [scheduler.submit(b"x") for _ in range(8)]
+    release.set()
+
+    first_future.result(timeout=5)
+    for future in futures:
+        future.result(timeout=5)
+
+    assert model.batch_sizes == [1, 4, 4]
+    scheduler.stop()
+
+
+def test_batch_scheduler_respects_max_wait_time() -> None:
+    model = RecordingModel()
+    scheduler = BatchScheduler(model, max_batch_size=16, max_batch_wait_ms=20)
+
+    start = time.monotonic()
+    scheduler.assess(b"x", timeout=5)
+
+    assert time.monotonic() - start < 1.0
+    assert model.batch_sizes == [1]
+    scheduler.stop()
+
+
+def test_batch_scheduler_propagates_errors() -> None:
+    class FailingModel(AssessmentModel):
+        def assess_batch(
+            self, images: Sequence[bytes], heads: Sequence[str] = ASSESSMENT_HEADS
+        ) -> List[Assessment]:
+            raise ValueError("Cannot decode image")
+
+    scheduler = BatchScheduler(FailingModel())
+
+    with pytest.raises(ValueError):
+        scheduler.assess(b"x", timeout=5)
+
+    scheduler.stop()
+
+    with pytest.raises(RuntimeError):
+        scheduler.submit(b"x")
+
+
+def test_batch_scheduler_rejects_requests_stopped_while_admitted(mocker) -> None:
+    scheduler = BatchScheduler(RecordingModel())
+    admit = scheduler.admit
+
+    def _admit_and_stop(num_bytes: int) -> None:
+        admit(num_bytes)
+        scheduler.stop()
+
+    mocker.patch.object(scheduler, "admit", side_effect=_admit_and_stop)
+
+    # The request is not left in the queue after the background thread has finished
+    with pytest.raises(RuntimeError):
+        scheduler.submit(b"x")
+
+    assert scheduler.stats()["pending"] == 0
+    assert scheduler.stats()["pending_bytes"] == 0
+
+
+def test_batch_scheduler_selects_heads() -> None:
+    release = threading.Event()
+    model = RecordingModel(release)
+    scheduler = BatchScheduler(model, max_batch_size=4, max_batch_wait_ms=0)
+
+    first_future = scheduler.submit(b"first", ["technical"])
+    assert model.entered.wait(timeout=5)
+    aesthetic_future = scheduler.submit(b"x", ["aesthetic"])
+    technical_future = scheduler.submit(b"xx", ["technical"])
+    release.set()
+
+    assert first_future.result(timeout=5) == Assessment(technical=10.0)
+    assert aesthetic_future.result(timeout=5) == Assessment(aesthetic=1)
+    assert technical_future.result(timeout=5) == Assessment(technical=4.0)
+    assert model.batch_heads == [["technical"], ["aesthetic", "technical"]]
+
+    with pytest.raises(ValueError):
+        scheduler.submit(b"x", ["composition"])
+
+    scheduler.stop()
+
+
+def test_batch_scheduler_rejects_when_full() -> None:
+    release = threading.Event()
+    model = RecordingModel(release)
+    scheduler = BatchScheduler(
+        model, max_batch_wait_ms=0, max_pending_requests=2, max_pending_mb=0.001
+    )
+
+    futures = [scheduler.submit(b"x")]
+    assert model.entered.wait(timeout=5)
+    futures.append(scheduler.submit(b"x"))
+
+    with pytest.raises(QueueFullError) as exc_info:
+        scheduler.submit(b"x")
+
+    assert exc_info.value.retry_after_s > 0.0
+    release.set()
+
+    for future in futures:
+        future.result(timeout=5)
+
+    # Slots are released before the results are delivered
+    scheduler.assess(b"x", timeout=5)
+
+    # A single image above the byte limit is accepted if nothing else is pending
+    assert scheduler.assess(b"x" * 2000, timeout=5) == Assessment(2000, 4000)
+    assert scheduler.stats() == {
+        "pending": 0,
+        "pending_bytes": 0,
+        "rejected": 1,
+        "expired": 0,
+    }
+    scheduler.stop()
+
+
+def test_batch_scheduler_prefers_higher_priority() -> None:
+    release = threading.Event()
+    model = RecordingModel(release)
+    scheduler = BatchScheduler(model, max_batch_size=1, max_batch_wait_ms=0)
+
+    futures = [scheduler.submit(b"first")]
+    assert model.entered.wait(timeout=5)
+    futures += [
+        scheduler.submit(b"bulk_1"),
+        scheduler.submit(b"bulk_2"),
+        scheduler.submit(b"interactive", priority=1),
+    ]
+    release.set()
+
+    for future in futures:
+        future.result(timeout=5)
+
+    assert model.images == [b"first", b"interactive", b"bulk_1", b"bulk_2"]
+    scheduler.stop()
+
+
+def test_batch_scheduler_drops_expired_requests() -> None:
+    release = threading.Event()
+    model = RecordingModel(release)
+    scheduler = BatchScheduler(model, max_batch_size=1, max_batch_wait_ms=0)
+
+    first_future = scheduler.submit(b"first")
+    assert model.entered.wait(timeout=5)
+    expired_future = scheduler.submit(b"expired", deadline=time.monotonic() + 0.05)
+    future = scheduler.submit(b"x", deadline=time.monotonic() + 60.0)
+    time.sleep(0.1)
+    release.set()
+
+    first_future.result(timeout=5)
+    future.result(timeout=5)
+
+    with pytest.raises(DeadlineExpiredError):
+        expired_future.result(timeout=5)
+
+    assert model.images == [b"first", b"x"]
+    assert scheduler.stats()["expired"] == 1
+    scheduler.stop()
@@ -0,0 +1,119 @@
+import json
+from pathlib import Path
+
+import pytest
+import tensorflow as tf
+
+from benchmarks import engines, preprocessing
+from benchmarks.pipeline import run_benchmark
+from benchmarks.startup import measure_startup
+
+
+def test_pipeline_benchmark(tmp_path: Path) -> None:
+    output_file = tmp_path / "bench.json"
+
+    run_benchmark(
+        num_images=4,
+        width=64,
+        height=48,
+        fake_fixed_cost_ms=1,
+        fake_per_image_cost_ms=0,
+        output_file=str(output_file),
+    )
+
+    report = json.loads(output_file.read_text())
+
+    assert report["config"]["num_images"] == 4
+    assert [result["client"] for result in report["results"]] == ["stream", "asyncio"]
+    for result in report["results"]:
+        assert result["num_failed"] == 0
+        assert result["num_responses"] == 4
+        assert result["bytes_sent"] > 0
+        assert result["latency_ms"]["p99"] is not None
+
+
+@pytest.mark.parametrize(
+    "module", ["imageassessmentservice.client", "imageassessmentservice.process"]
+)
+def test_client_does_not_import_tensorflow(module: str) -> None:
+    result = measure_startup(module)
+
+    assert not result["imports_tensorflow"]
+    assert result["import_s"] > 0
+
+
+class _BrightnessRating(tf.Module):
+    """Stand-in for a MUSIQ model that rates images by their brightness."""
+
+    def __init__(self, scale: float):
+        super().__init__()
+        self.scale = tf.Variable(scale)
+
+    @tf.function(input_signature=[tf.TensorSpec([], tf.string)])
+    def __call__(self, image_bytes_tensor: tf.Tensor):
+        image = tf.cast(tf.io.decode_jpeg(image_bytes_tensor, channels=3), tf.float32)
+        return {"output_0": self.scale * tf.reduce_mean(image) / 255.0}
+
+
+def test_engines_benchmark(tmp_path: Path) -> None:
+    for subdir, scale in [("ava", 10.0), ("paq2piq", 100.0)]:
+        module = _BrightnessRating(scale)
+        tf.saved_model.save(
+            module,
+            str(tmp_path / subdir),
+            signatures={"serving_default": module.__call__},
+        )
+
+    output_file = tmp_path / "engines.json"
+
+    engines.run_benchmark(
+        str(tmp_path),
+        num_images=4,
+        width=64,
+        height=48,
+        engines="frozen",
+        precisions="float32",
+        repetitions=2,
+        output_file=str(output_file),
+    )
+
+    report = json.loads(output_file.read_text())
+    baseline, frozen = report["results"]
+
+    assert (baseline["engine"], frozen["engine"]) == ("signature", "frozen")
+    assert baseline["images_per_s"] > 0
+    assert frozen["within_tolerance"]
+    assert frozen["drift"]["aesthetic"]["max_abs_diff"] < 1e-5
+    assert frozen["drift"]["technical"]["rank_correlation"] == pytest.approx(1.0)
+
+
+def test_preprocessing_benchmark(tmp_path: Path) -> None:
+    for subdir, scale in [("ava", 10.0), ("paq2piq", 100.0)]:
+        module = _BrightnessRating(scale)
+        tf.saved_model.save(
+            module,
+            str(tmp_path / subdir),
+            signatures={"serving_default": module.__call__},
+        )
+
+    output_file = tmp_path / "preprocessing.json"
+
+    preprocessing.run_benchmark(
+        num_images=4,
+        width=640,
+        height=480,
+        max_size=320,
+        workers=2,
+        model_dir=str(tmp_path),
+        output_file=str(output_file),
+    )
+
+    result = json.loads(output_file.read_text())["result"]
+
+    assert result["num_images"] == 4
+    assert result["pixels_saved"] == pytest.approx(0.75)
+    assert result["bytes_saved"] > 0
+    assert result["preprocessed_decode_s"] > 0
+    # Downscaling hardly changes the brightness
+    assert result["drift"]["aesthetic"]["max_abs_diff"] < 0.1
+    assert result["within_tolerance"]
@@ -0,0 +1,53 @@
+from pathlib import Path
+
+from imageassessmentservice.cache import ResultCache
+from imageassessmentservice.models import Assessment
+
+
+def test_result_cache_lru() -> None:
+    cache = ResultCache("model", max_entries=2)
+
+    cache.put(b"image1", Assessment(1.0, 10.0))
+    cache.put(b"image2", Assessment(2.0, 20.0))
+
+    # Touch image1 so that image2 is evicted by the next insertion
+    assert cache.get(b"image1") == Assessment(1.0, 10.0)
+    cache.put(b"image3", Assessment(3.0, 30.0))
+
+    assert cache.get(b"image2") is None
+    assert cache.get(b"image1") == Assessment(1.0, 10.0)
+    assert cache.get(b"image3") == Assessment(3.0, 30.0)
+    assert cache.stats() == {"hits": 3, "misses": 1, "entries": 2}
+
+
+def test_result_cache_persistence(tmp_path: Path) -> None:
+    database_file = tmp_path / "cache.sqlite"
+
+    cache = ResultCache("model_v1", max_entries=1, database_file=database_file)
+    cache.put(b"image1", Assessment(1.0, 10.0))
+    cache.put(b"image2", Assessment(2.0, 20.0))
+
+    # Evicted from memory, but still in the database
+    assert cache.get(b"image1") == Assessment(1.0, 10.0)
+    cache.close()
+
+    restarted_cache = ResultCache("model_v1", database_file=database_file)
+    assert restarted_cache.get(b"image2") == Assessment(2.0, 20.0)
+    restarted_cache.close()
+
+    # Assessments of other models are not reused
+    other_model_cache = ResultCache("model_v2", database_file=database_file)
+    assert other_model_cache.get(b"image2") is None
+    other_model_cache.close()
+
+
+def test_result_cache_merges_heads() -> None:
+    cache = ResultCache("model")
+
+    cache.put(b"image", Assessment(technical=10.0))
+    assert cache.get(b"image", ["technical"]) == Assessment(technical=10.0)
+    assert cache.get(b"image") is None
+
+    cache.put(b"image", Assessment(aesthetic=1.0))
+    assert cache.get(b"image") == Assessment(1.0, 10.0)
+    assert cache.get(b"image", ["aesthetic"]) == Assessment(aesthetic=1.0)
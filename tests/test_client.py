@@ -1,13 +1,20 @@
+import io
+import grpc
 import pandas as pd
+import numpy as np
 import pytest
 from typing import List
 from pathlib import Path
+from PIL import Image
 
 from imageassessmentservice.client import (
     normalize_ratings,
     map_ratings_to_bins,
     infer_on_images,
+    rate_images,
 )
+from imageassessmentservice.imageassessment_pb2 import ImageAssessmentResponse
+from imageassessmentservice.output import read_ratings
 
 
 def test_normalize_ratings() -> None:
@@ -36,14 +43,14 @@ def test_normalize_ratings() -> None:
     [
         ([0, 1, 2], 2, [1, 1, 2]),
         ([0, 1, 2, 3.1, 4], 3, [1, 1, 2, 3, 3]),
+        ([1, 1, 1, 2], 2, [1, 1, 1, 2]),
+        ([2, 0, 1], 2, [2, 1, 1]),
     ],
 )
 def test_map_ratings_to_bins(
     ratings: List[int], num_bins: int, expected: List[int]
 ) -> None:
-    ratings = pd.Series(ratings)
-
-    mapped_ratings = map_ratings_to_bins(num_bins, ratings)
+    mapped_ratings = map_ratings_to_bins(num_bins, pd.Series(ratings))
 
     assert mapped_ratings.tolist() == expected
 
@@ -122,3 +129,311 @@ def test_infer_on_images(tmp_path: Path, mocker) -> None:
     )
 
     pd.testing.assert_frame_equal(ratings_result, expected_result)
+
+
+class FakeStreamingStub:
+    """Answers stream requests in reverse order of arrival, failing on empty images."""
+
+    def __init__(self, channel):
+        self.max_pending = 0
+
+    def AssessStream(self, request_iterator):
+        pending = []
+
+        for request in request_iterator:
+            pending.append(request)
+            self.max_pending = max(self.max_pending, len(pending))
+
+            if len(pending) == 2:
+                yield from self._respond(reversed(pending))
+                pending = []
+
+        yield from self._respond(pending)
+
+    @staticmethod
+    def _respond(requests):
+        for request in requests:
+            yield ImageAssessmentResponse(
+                path=request.path,
+                request_id=request.request_id,
+                assessment_aesthetic=len(request.image_bytes),
+                assessment_technical=2.0 * len(request.image_bytes),
+                error="" if request.image_bytes else "Empty image",
+            )
+
+
+def test_rate_images(tmp_path: Path, mocker) -> None:
+    mocker.patch("imageassessmentservice.client.ImageAssessmentStub", FakeStreamingStub)
+
+    image_paths = []
+    for i in range(5):
+        image_path = tmp_path / f"image_{i}.jpg"
+        image_path.write_bytes(b"x" * i)
+        image_paths.append(image_path)
+
+    missing_image_path = tmp_path / "missing.jpg"
+
+    ratings, images_with_issues = rate_images(
+        image_paths + [missing_image_path], "localhost", max_in_flight=2
+    )
+
+    ratings = ratings.sort_values("image_path", ignore_index=True)
+    assert ratings["image_path"].tolist() == [str(path) for path in image_paths[1:]]
+    assert ratings["aesthetic"].tolist() == [1, 2, 3, 4]
+    assert ratings["technical"].tolist() == [2, 4, 6, 8]
+    assert sorted(images_with_issues) == [image_paths[0], missing_image_path]
+
+
+def test_rate_images_without_progress(tmp_path: Path, mocker, capsys) -> None:
+    mocker.patch("imageassessmentservice.client.ImageAssessmentStub", FakeStreamingStub)
+    insecure_channel = mocker.spy(grpc, "insecure_channel")
+
+    image_path = tmp_path / "image.jpg"
+    image_path.write_bytes(b"x")
+
+    ratings, _ = rate_images([image_path], "localhost", show_progress=False)
+
+    assert ratings["aesthetic"].tolist() == [1]
+    captured = capsys.readouterr()
+    assert captured.out == "" and captured.err == ""
+    # The channel is closed once the ratings are received
+    with pytest.raises(ValueError):
+        insecure_channel.spy_return.unary_unary("/method")(b"")
+
+
+def test_infer_on_images_incremental(tmp_path: Path, mocker) -> None:
+    input_folder = tmp_path / "input"
+    input_folder.mkdir()
+    ratings_output_file = tmp_path / "ratings.csv"
+
+    rated_paths = []
+
+    def _fake_rate_images(
+        image_paths, address, max_in_flight, rating_callback, heads, image_loader
+    ):
+        ratings = []
+        for image_path in image_paths:
+            rated_paths.append(image_path)
+            rating = {
+                "image_path": str(image_path),
+                "aesthetic": float(image_path.stat().st_size),
+                "technical": float(image_path.stat().st_size),
+            }
+            rating_callback(rating)
+            ratings.append(rating)
+
+        return pd.DataFrame(ratings), []
+
+    mocker.patch(
+        "imageassessmentservice.client.rate_images", side_effect=_fake_rate_images
+    )
+
+    for i in range(1, 3):
+        (input_folder / f"image{i}.jpg").write_bytes(b"x" * i)
+
+    infer_on_images(str(input_folder), str(ratings_output_file), incremental=True)
+    assert sorted(path.name for path in rated_paths) == ["image1.jpg", "image2.jpg"]
+
+    # Second run only rates the new image, but bins all images
+    rated_paths.clear()
+    (input_folder / "image3.jpg").write_bytes(b"x" * 3)
+
+    infer_on_images(
+        str(input_folder), str(ratings_output_file), num_bins=3, incremental=True
+    )
+    assert [path.name for path in rated_paths] == ["image3.jpg"]
+
+    ratings_result = pd.read_csv(ratings_output_file).sort_values("image_path")
+    assert ratings_result["rating_new"].tolist() == [1, 2, 3]
+
+
+def test_normalize_ratings_single_head() -> None:
+    ratings = pd.DataFrame(
+        {"image_path": ["path1", "path2", "path3"], "technical": [3, 4, 5]}
+    )
+
+    normalized_ratings = normalize_ratings(ratings, ["technical"])
+
+    assert "aesthetic_normalized" not in normalized_ratings
+    assert normalized_ratings["overall"].tolist() == [-1, 0, 1]
+
+
+@pytest.mark.parametrize("dedup", ["representative", "score_all"])
+def test_infer_on_images_dedup(tmp_path: Path, mocker, dedup: str) -> None:
+    input_folder = tmp_path / "input"
+    input_folder.mkdir()
+    ratings_output_file = tmp_path / "ratings.csv"
+
+    # A burst of three near-identical frames and two distinct images
+    images = {
+        "burst_1.jpg": (0, 0.0, 3.0),
+        "burst_2.jpg": (0, 2.0, 1.0),
+        "burst_3.jpg": (0, 1.0, 2.0),
+        "other_1.jpg": (5, 0.0, 4.0),
+        "other_2.jpg": (7, 0.0, 0.0),
+    }
+
+    for name, (seed, noise, _) in images.items():
+        rng = np.random.default_rng(seed)
+        base = Image.fromarray(rng.integers(0, 256, (6, 6, 3), dtype=np.uint8))
+        pixels = np.asarray(
+            base.resize((96, 96), Image.Resampling.BILINEAR), dtype=float
+        )
+        pixels += np.random.default_rng(seed + 1000).normal(0, noise, pixels.shape)
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(
+            input_folder / name, quality=95
+        )
+
+    rated_paths = []
+
+    def _fake_rate_images(
+        image_paths, address, max_in_flight, rating_callback, heads, image_loader
+    ):
+        ratings = []
+        for image_path in image_paths:
+            rated_paths.append(image_path)
+            rating = images[image_path.name][2]
+            ratings.append(
+                {
+                    "image_path": str(image_path),
+                    "aesthetic": rating,
+                    "technical": rating,
+                }
+            )
+
+        return pd.DataFrame(ratings), []
+
+    mocker.patch(
+        "imageassessmentservice.client.rate_images", side_effect=_fake_rate_images
+    )
+
+    infer_on_images(
+        str(input_folder),
+        str(ratings_output_file),
+        num_bins=3,
+        dedup=dedup,
+        dedup_max_distance=6,
+    )
+
+    ratings_result = pd.read_csv(ratings_output_file).sort_values("image_path")
+    ratings_result["image_path"] = ratings_result["image_path"].map(
+        lambda path: Path(path).name
+    )
+
+    assert ratings_result["image_path"].tolist() == list(images)
+    assert ratings_result["group_id"].tolist() == [0, 0, 0, 1, 2]
+
+    if dedup == "representative":
+        burst_sizes = {
+            name: (input_folder / name).stat().st_size
+            for name in images
+            if name.startswith("burst")
+        }
+        assert sorted(path.name for path in rated_paths) == [
+            max(burst_sizes, key=lambda name: burst_sizes[name]),
+            "other_1.jpg",
+            "other_2.jpg",
+        ]
+        assert "group_rank" not in ratings_result
+    else:
+        assert len(rated_paths) == len(images)
+        # The burst is binned by its best frame, the other images are binned around it
+        assert ratings_result["rating_new"].tolist() == [2, 2, 2, 3, 1]
+        assert ratings_result["group_rank"].tolist() == [1, 3, 2, 1, 1]
+
+
+def test_infer_on_images_preprocess(tmp_path: Path, mocker) -> None:
+    input_folder = tmp_path / "input"
+    input_folder.mkdir()
+    ratings_output_file = tmp_path / "ratings.csv"
+
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, (300, 400, 3), dtype=np.uint8))
+    image.save(input_folder / "image1.jpg")
+    image.save(input_folder / "image2.png")
+
+    sent_sizes = {}
+
+    def _fake_rate_images(
+        image_paths, address, max_in_flight, rating_callback, heads, image_loader
+    ):
+        ratings = []
+        for i, image_path in enumerate(image_paths):
+            with Image.open(io.BytesIO(image_loader(image_path))) as sent_image:
+                sent_sizes[image_path.name] = (sent_image.format, sent_image.size)
+
+            ratings.append(
+                {"image_path": str(image_path), "aesthetic": i, "technical": i}
+            )
+
+        return pd.DataFrame(ratings), []
+
+    mocker.patch(
+        "imageassessmentservice.client.rate_images", side_effect=_fake_rate_images
+    )
+
+    infer_on_images(
+        str(input_folder),
+        str(ratings_output_file),
+        preprocess=True,
+        preprocess_max_size=200,
+        preprocess_workers=1,
+    )
+
+    assert sent_sizes == {
+        "image1.jpg": ("JPEG", (200, 150)),
+        "image2.png": ("JPEG", (200, 150)),
+    }
+    assert len(pd.read_csv(ratings_output_file)) == 2
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_infer_on_images_parquet(tmp_path: Path, mocker, incremental: bool) -> None:
+    input_folder = tmp_path / "input"
+    input_folder.mkdir()
+    ratings_output_file = tmp_path / "ratings.parquet"
+
+    for i in range(1, 4):
+        (input_folder / f"image{i}.jpg").write_bytes(b"x" * i)
+    (input_folder / "notes.txt").write_bytes(b"notes")
+
+    def _fake_rate_images(
+        image_paths, address, max_in_flight, rating_callback, heads, image_loader
+    ):
+        ratings = []
+        for image_path in image_paths:
+            rating = {
+                "image_path": str(image_path),
+                "aesthetic": float(image_path.stat().st_size),
+                "technical": 2.0 * image_path.stat().st_size,
+                "model_id": "fake-1",
+            }
+            if rating_callback is not None:
+                rating_callback(rating)
+            ratings.append(rating)
+
+        return pd.DataFrame(ratings), []
+
+    mocker.patch(
+        "imageassessmentservice.client.rate_images", side_effect=_fake_rate_images
+    )
+
+    infer_on_images(
+        str(input_folder), str(ratings_output_file), num_bins=3, incremental=incremental
+    )
+
+    # Paths are categorical, sorting them as strings gives the order of the images
+    ratings_result = (
+        read_ratings(ratings_output_file)
+        .astype({"image_path": str})
+        .sort_values("image_path")
+    )
+    assert ratings_result["image_path"].tolist() == [
+        str(input_folder / name)
+        for name in ["image1.jpg", "image2.jpg", "image3.jpg", "notes.txt"]
+    ]
+    assert ratings_result["rating_new"].tolist() == [1, 2, 3, -1]
+    assert ratings_result["aesthetic"].tolist()[:3] == [1.0, 2.0, 3.0]
+    assert ratings_result["overall"].tolist()[:3] == pytest.approx([-1.0, 0.0, 1.0])
+    assert ratings_result["size"].tolist() == [1, 2, 3, 5]
+    assert ratings_result["model_id"].tolist()[:3] == ["fake-1"] * 3
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from imageassessmentservice.batching import DeadlineExpiredError
+from imageassessmentservice.decoding import ImageDecoder
+from imageassessmentservice.headers import image_size
+
+
+def _image(width: int, height: int, encode=tf.io.encode_jpeg) -> bytes:
+    rng = np.random.default_rng(0)
+    return encode(rng.integers(0, 256, (height, width, 3), dtype=np.uint8)).numpy()
+
+
+def test_image_size() -> None:
+    assert image_size(_image(64, 48)) == ("jpeg", 64, 48)
+    assert image_size(_image(64, 48, tf.io.encode_png)) == ("png", 64, 48)
+    assert image_size(b"image") is None
+
+
+@pytest.mark.parametrize(
+    "max_pixels,encode,policy,target_size,dct_ratio",
+    [
+        (0, tf.io.encode_jpeg, "full_resolution", (400, 300), 1),
+        (120000, tf.io.encode_jpeg, "full_resolution", (400, 300), 1),
+        (30000, tf.io.encode_jpeg, "dct_downscaled", (200, 150), 2),
+        (7500, tf.io.encode_jpeg, "dct_downscaled", (100, 75), 4),
+        (1200, tf.io.encode_jpeg, "resized", (39, 30), 8),
+        (30000, tf.io.encode_png, "resized", (200, 150), 1),
+    ],
+)
+def test_decode_plan(
+    max_pixels: int, encode, policy: str, target_size, dct_ratio: int
+) -> None:
+    decoder = ImageDecoder(max_pixels)
+    image_bytes = _image(400, 300, encode)
+
+    plan = decoder.plan(image_bytes)
+
+    assert plan.policy == policy
+    assert (plan.target_width, plan.target_height) == target_size
+    assert plan.dct_ratio == dct_ratio
+
+    decoded = tf.io.decode_jpeg(decoder.decode(image_bytes, plan))
+
+    assert tuple(decoded.shape) == (target_size[1], target_size[0], 3)
+    assert decoder.stats()[policy] == 1
+
+
+def test_decode_unknown_or_broken_image() -> None:
+    decoder = ImageDecoder(100)
+
+    plan = decoder.plan(b"image")
+    assert plan.policy == "full_resolution"
+    assert decoder.decode(b"image", plan) == b"image"
+
+    # Valid header, but truncated image data
+    truncated = _image(400, 300)[:400]
+    with pytest.raises(ValueError):
+        decoder.decode(truncated, decoder.plan(truncated))
+
+
+def test_decode_memory_budget() -> None:
+    decoder = ImageDecoder(30000, max_decode_mb=0.1)
+    image_bytes = _image(400, 300)
+    plan = decoder.plan(image_bytes)
+
+    # The decoded pixels of the image (90 kB) do not fit next to a reservation of
+    # 50 kB, so decoding waits until the reservation is released
+    decoded = threading.Event()
+
+    with decoder.reserve(50000):
+        with pytest.raises(DeadlineExpiredError):
+            decoder.decode(image_bytes, plan, deadline=time.monotonic() + 0.05)
+
+        thread = threading.Thread(
+            target=lambda: decoded.set() if decoder.decode(image_bytes, plan) else None
+        )
+        thread.start()
+        time.sleep(0.05)
+        assert not decoded.is_set()
+
+    thread.join(timeout=5.0)
+    assert decoded.is_set()
+
+    stats = decoder.stats()
+    assert stats["expired"] == 1
+    assert stats["dct_downscaled"] == 1
+    assert stats["peak_decode_mb"] == pytest.approx(90000 / 1024**2)
@@ -0,0 +1,118 @@
+import io
+import struct
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from imageassessmentservice.dedup import (
+    choose_representatives,
+    dhash,
+    group_near_duplicates,
+    hamming_distance,
+    hash_images,
+    perceptual_hash,
+)
+
+
+def _smooth_image(seed: int, noise: float = 0.0, size: int = 96) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    base = Image.fromarray(rng.integers(0, 256, (6, 6, 3), dtype=np.uint8))
+    pixels = np.asarray(
+        base.resize((size, size), Image.Resampling.BILINEAR), dtype=float
+    )
+    pixels += np.random.default_rng(seed + 1000).normal(0, noise, pixels.shape)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def _exif_with_thumbnail(thumbnail: Image.Image) -> bytes:
+    """EXIF data with an empty first directory and a JPEG thumbnail in the second."""
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, "JPEG")
+    thumbnail_bytes = buffer.getvalue()
+
+    ifd1_offset = 8 + 2 + 4
+    thumbnail_offset = ifd1_offset + 2 + 2 * 12 + 4
+    tiff = (
+        b"II*\x00"
+        + struct.pack("<I", 8)
+        + struct.pack("<HI", 0, ifd1_offset)
+        + struct.pack("<H", 2)
+        + struct.pack("<HHII", 0x0201, 4, 1, thumbnail_offset)
+        + struct.pack("<HHII", 0x0202, 4, 1, len(thumbnail_bytes))
+        + struct.pack("<I", 0)
+        + thumbnail_bytes
+    )
+    return b"Exif\x00\x00" + tiff
+
+
+def test_dhash_of_similar_images() -> None:
+    image_hash = dhash(_smooth_image(0))
+
+    assert hamming_distance(image_hash, dhash(_smooth_image(0, noise=2.0))) <= 4
+    assert hamming_distance(image_hash, dhash(_smooth_image(1))) > 10
+    assert 0 <= image_hash < 2**64
+
+
+def test_perceptual_hash_uses_exif_thumbnail(tmp_path: Path) -> None:
+    thumbnail = _smooth_image(1, size=32)
+    image_path = tmp_path / "image.jpg"
+    _smooth_image(0).save(image_path, "JPEG", exif=_exif_with_thumbnail(thumbnail))
+
+    image_hash = perceptual_hash(image_path)
+    assert image_hash is not None
+    assert hamming_distance(image_hash, dhash(thumbnail)) <= 2
+    assert hamming_distance(image_hash, dhash(_smooth_image(0))) > 10
+
+    not_an_image_path = tmp_path / "not_an_image.jpg"
+    not_an_image_path.write_bytes(b"text")
+    assert perceptual_hash(not_an_image_path) is None
+
+
+def test_group_near_duplicates() -> None:
+    hashes = {
+        Path("a.jpg"): 0b0000,
+        Path("b.jpg"): 0b0011,
+        # Within the distance of b, but not of a
+        Path("c.jpg"): 0b1111,
+        Path("d.jpg"): 2**64 - 1,
+        Path("e.jpg"): None,
+        Path("f.jpg"): 2**64 - 2,
+    }
+
+    assert group_near_duplicates(hashes, max_distance=2) == {
+        Path("a.jpg"): 0,
+        Path("b.jpg"): 0,
+        Path("c.jpg"): 0,
+        Path("d.jpg"): 1,
+        Path("e.jpg"): 2,
+        Path("f.jpg"): 1,
+    }
+    assert len(set(group_near_duplicates(hashes, max_distance=0).values())) == 6
+
+
+def test_hash_images_and_choose_representatives(tmp_path: Path) -> None:
+    image_paths = []
+
+    for i, (seed, noise) in enumerate([(0, 0.0), (0, 2.0), (0, 1.0), (5, 0.0)]):
+        image_path = tmp_path / f"image_{i}.jpg"
+        _smooth_image(seed, noise).save(image_path, "JPEG", quality=95)
+        image_paths.append(image_path)
+
+    hashes = dict(hash_images(iter(image_paths), max_workers=2))
+    group_ids = group_near_duplicates(hashes, max_distance=6)
+
+    assert group_ids == {
+        image_paths[0]: 0,
+        image_paths[1]: 0,
+        image_paths[2]: 0,
+        image_paths[3]: 1,
+    }
+
+    representatives = choose_representatives(group_ids)
+    burst_sizes = [image_path.stat().st_size for image_path in image_paths[:3]]
+
+    assert representatives == {
+        0: image_paths[burst_sizes.index(max(burst_sizes))],
+        1: image_paths[3],
+    }
@@ -0,0 +1,63 @@
+import os
+import sqlite3
+from pathlib import Path
+
+from imageassessmentservice.index import RatingsIndex
+
+
+def test_ratings_index(tmp_path: Path) -> None:
+    image_paths = [tmp_path / f"image{i}.jpg" for i in range(3)]
+    for image_path in image_paths:
+        image_path.write_bytes(b"image")
+
+    index = RatingsIndex(tmp_path / "ratings.index.sqlite", flush_interval=1)
+    assert index.stale_paths(image_paths) == image_paths
+
+    for image_path in image_paths[:2]:
+        index.add({"image_path": str(image_path), "aesthetic": 1.0, "technical": 2.0})
+    index.close()
+
+    # Changing the modification time marks an image as stale
+    stat = image_paths[1].stat()
+    os.utime(image_paths[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    reopened_index = RatingsIndex(tmp_path / "ratings.index.sqlite")
+    assert reopened_index.stale_paths(image_paths) == image_paths[1:]
+    assert reopened_index.count() == 2
+
+    ratings = reopened_index.load_ratings(image_paths[::2])
+    assert ratings["image_path"].tolist() == [str(image_paths[0])]
+    reopened_index.close()
+
+
+def test_ratings_index_keeps_file_state_and_model_id(tmp_path: Path) -> None:
+    image_path = tmp_path / "image.jpg"
+    image_path.write_bytes(b"image")
+
+    # Index of an earlier version without the id of the models
+    connection = sqlite3.connect(tmp_path / "ratings.index.sqlite")
+    connection.execute("""CREATE TABLE Ratings (
+            image_path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            aesthetic REAL,
+            technical REAL
+        );""")
+    connection.close()
+
+    index = RatingsIndex(tmp_path / "ratings.index.sqlite")
+    index.add({"image_path": str(image_path), "aesthetic": 1.0, "model_id": "fake-1"})
+    index.add({"image_path": str(image_path), "technical": 2.0})
+
+    ratings = index.load_ratings([image_path])
+    (chunk,) = index.iter_ratings(
+        [image_path], extra_columns=("size", "mtime_ns", "model_id")
+    )
+    index.close()
+
+    assert ratings.to_dict("records") == [
+        {"image_path": str(image_path), "aesthetic": 1.0, "technical": 2.0}
+    ]
+    assert chunk[["size", "mtime_ns", "model_id"]].to_dict("records") == [
+        {"size": 5, "mtime_ns": image_path.stat().st_mtime_ns, "model_id": "fake-1"}
+    ]
@@ -0,0 +1,42 @@
+from pathlib import Path
+
+import pytest
+
+from imageassessmentservice.imageassessment_pb2 import AssessmentHead
+from imageassessmentservice.messages import grpc_target, iter_image_chunks
+
+
+@pytest.mark.parametrize(
+    "address, expected_target",
+    [
+        ("localhost", "localhost:50051"),
+        ("localhost:50052", "localhost:50052"),
+        ("10.0.0.1", "10.0.0.1:50051"),
+        ("::1", "[::1]:50051"),
+        ("[::1]", "[::1]:50051"),
+        ("[::1]:50052", "[::1]:50052"),
+    ],
+)
+def test_grpc_target(address: str, expected_target: str) -> None:
+    assert grpc_target(address) == expected_target
+
+
+@pytest.mark.parametrize("size, num_chunks", [(0, 1), (4, 1), (10, 3), (12, 3)])
+def test_iter_image_chunks(tmp_path: Path, size: int, num_chunks: int) -> None:
+    image_path = tmp_path / "image.jpg"
+    image_path.write_bytes(bytes(range(size)))
+
+    chunks = list(iter_image_chunks(image_path, ["technical"], "1", chunk_size=4))
+
+    assert len(chunks) == num_chunks
+    assert chunks[0].path == str(image_path)
+    assert chunks[0].request_id == "1"
+    assert list(chunks[0].heads) == [AssessmentHead.TECHNICAL]
+    assert chunks[0].total_size == size
+    assert all(not chunk.path and not chunk.total_size for chunk in chunks[1:])
+    assert b"".join(chunk.data for chunk in chunks) == bytes(range(size))
+
+
+def test_iter_image_chunks_missing_file(tmp_path: Path) -> None:
+    with pytest.raises(FileNotFoundError):
+        iter_image_chunks(tmp_path / "missing.jpg", ["technical"])
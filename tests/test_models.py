@@ -0,0 +1,41 @@
+from imageassessmentservice.models import Assessment, FakeModel, StageTimings
+
+
+def test_assessment_heads() -> None:
+    assessment = Assessment(1.0, 10.0)
+
+    assert assessment.select(["technical"]) == Assessment(technical=10.0)
+    assert assessment.select(["technical"]).has_heads(["technical"])
+    assert not assessment.select(["technical"]).has_heads(["aesthetic"])
+    assert Assessment(technical=10.0).merge(Assessment(aesthetic=1.0)) == assessment
+
+
+def test_fake_model_is_deterministic() -> None:
+    model = FakeModel(fixed_cost_ms=0, per_image_cost_ms=0)
+
+    first_assessments = model.assess_batch([b"image1", b"image2"])
+    second_assessments = model.assess_batch([b"image2"], ["technical"])
+
+    assert first_assessments[0] != first_assessments[1]
+    assert second_assessments == [first_assessments[1].select(["technical"])]
+    aesthetic, technical = (
+        first_assessments[0].aesthetic,
+        first_assessments[0].technical,
+    )
+    assert aesthetic is not None and 1.0 <= aesthetic <= 10.0
+    assert technical is not None and 0.0 <= technical <= 100.0
+    assert model.timings.summary()["batch"]["count"] == 2
+
+
+def test_stage_timings() -> None:
+    timings = StageTimings()
+
+    timings.add("decode", 0.002)
+    timings.add("decode", 0.004)
+    with timings.measure("inference"):
+        pass
+
+    summary = timings.summary()
+
+    assert summary["decode"] == {"count": 2, "mean_ms": 3.0, "max_ms": 4.0}
+    assert summary["inference"]["count"] == 1
@@ -0,0 +1,62 @@
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from imageassessmentservice.output import ParquetRatingsWriter, read_ratings
+
+
+def test_parquet_ratings_writer(tmp_path: Path) -> None:
+    image_paths = [tmp_path / f"image{i}.jpg" for i in range(5)]
+    for i, image_path in enumerate(image_paths[:4]):
+        image_path.write_bytes(b"x" * i)
+
+    ratings_file = tmp_path / "ratings.parquet"
+
+    with ParquetRatingsWriter(ratings_file, ["aesthetic"], row_group_size=2) as writer:
+        writer.write(
+            pd.DataFrame(
+                {
+                    "image_path": image_paths[:3],
+                    "aesthetic": [1.0, 2.0, 3.0],
+                    "aesthetic_normalized": [-1.0, 0.0, 1.0],
+                    "overall": [-1.0, 0.0, 1.0],
+                    "rating_new": [1, 2, 3],
+                    "model_id": ["fake-1"] * 3,
+                }
+            )
+        )
+        # Images without ratings, one of which no longer exists
+        writer.write(pd.DataFrame({"image_path": image_paths[3:], "rating_new": -1}))
+
+    parquet_file = pq.ParquetFile(ratings_file)
+    assert parquet_file.metadata.num_rows == 5
+    assert parquet_file.metadata.num_row_groups == 3
+    assert str(parquet_file.schema_arrow.field("aesthetic").type) == "float"
+    assert str(parquet_file.schema_arrow.field("rating_new").type) == "int16"
+
+    ratings = read_ratings(ratings_file)
+    assert isinstance(ratings["image_path"].dtype, pd.CategoricalDtype)
+    assert ratings["image_path"].tolist() == [str(path) for path in image_paths]
+    assert ratings["rating_new"].tolist() == [1, 2, 3, -1, -1]
+    assert ratings["aesthetic"].tolist()[:3] == [1.0, 2.0, 3.0]
+    assert ratings["aesthetic"].isna().tolist() == [False] * 3 + [True] * 2
+    assert ratings["model_id"].tolist()[:3] == ["fake-1"] * 3
+    assert ratings["size"].tolist()[:4] == [0, 1, 2, 3]
+    assert pd.isna(ratings["size"].iloc[4])
+    assert ratings["mtime"].iloc[0] == pd.Timestamp(
+        image_paths[0].stat().st_mtime_ns, unit="ns", tz="UTC"
+    )
+
+    # Only the requested columns are read
+    projected_ratings = read_ratings(ratings_file, ["image_path", "rating_new"])
+    assert projected_ratings.columns.tolist() == ["image_path", "rating_new"]
+
+
+def test_read_ratings_csv(tmp_path: Path) -> None:
+    ratings_file = tmp_path / "ratings.csv"
+    pd.DataFrame({"image_path": ["image.jpg"], "rating_new": [2]}).to_csv(ratings_file)
+
+    ratings = read_ratings(ratings_file, ["image_path", "rating_new"])
+
+    assert ratings.to_dict("list") == {"image_path": ["image.jpg"], "rating_new": [2]}
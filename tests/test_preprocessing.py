@@ -0,0 +1,154 @@
+import io
+import struct
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from imageassessmentservice.preprocessing import (
+    find_raw_previews,
+    preprocess_image,
+    Preprocessor,
+)
+
+
+def _jpeg_bytes(width: int, height: int, orientation: int = 1) -> bytes:
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+    exif = Image.Exif()
+
+    if orientation != 1:
+        exif[0x0112] = orientation
+
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", exif=exif.tobytes())
+
+    return buffer.getvalue()
+
+
+def _ifd(entries: List[Tuple[int, int, int]], next_offset: int) -> bytes:
+    """Image file directory with LONG tags, given as tag, value and count."""
+    ifd = struct.pack("<H", len(entries))
+
+    for tag, value, count in entries:
+        ifd += struct.pack("<HHII", tag, 4, count, value)
+
+    return ifd + struct.pack("<I", next_offset)
+
+
+def _raw_file(small_preview: bytes, large_preview: bytes, orientation: int) -> bytes:
+    """TIFF-based RAW file with a preview in a strip of the first directory, like CR2,
+    a preview in the second directory and lossless JPEG raw data in a sub-directory."""
+    raw_data = b"\xff\xd8\xff\xc3\x00\x0b\x08\x10\x00\x10\x00\x01\x01\x11\x00"
+
+    ifd0_offset = 8
+    ifd1_offset = ifd0_offset + 2 + 5 * 12 + 4
+    sub_ifd_offset = ifd1_offset + 2 + 2 * 12 + 4
+    small_offset = sub_ifd_offset + 2 + 3 * 12 + 4
+    large_offset = small_offset + len(small_preview)
+    raw_offset = large_offset + len(large_preview)
+
+    return (
+        b"II*\x00"
+        + struct.pack("<I", ifd0_offset)
+        + _ifd(
+            [
+                (0x0103, 6, 1),
+                (0x0111, small_offset, 1),
+                (0x0112, orientation, 1),
+                (0x0117, len(small_preview), 1),
+                (0x014A, sub_ifd_offset, 1),
+            ],
+            ifd1_offset,
+        )
+        + _ifd([(0x0201, large_offset, 1), (0x0202, len(large_preview), 1)], 0)
+        + _ifd([(0x0103, 7, 1), (0x0111, raw_offset, 1), (0x0117, len(raw_data), 1)], 0)
+        + small_preview
+        + large_preview
+        + raw_data
+    )
+
+
+def test_preprocess_image_downscales_and_rotates(tmp_path: Path) -> None:
+    image_path = tmp_path / "image.jpg"
+    image_path.write_bytes(_jpeg_bytes(400, 300, orientation=6))
+
+    result = preprocess_image(image_path, max_size=200)
+
+    with Image.open(io.BytesIO(result.image_bytes)) as image:
+        assert image.format == "JPEG"
+        assert image.size == (150, 200)
+
+    assert result.original_bytes == image_path.stat().st_size
+    assert result.original_pixels == 400 * 300
+    assert result.pixels == 150 * 200
+
+
+def test_preprocess_image_passes_on_small_jpegs(tmp_path: Path) -> None:
+    image_path = tmp_path / "image.jpg"
+    image_path.write_bytes(_jpeg_bytes(100, 80))
+
+    assert preprocess_image(image_path, max_size=200).image_bytes == (
+        image_path.read_bytes()
+    )
+
+    png_path = tmp_path / "image.png"
+    Image.open(image_path).save(png_path)
+
+    with Image.open(io.BytesIO(preprocess_image(png_path).image_bytes)) as image:
+        assert image.format == "JPEG"
+        assert image.size == (100, 80)
+
+
+@pytest.mark.parametrize("max_size,expected_size", [(300, (225, 300)), (40, (30, 40))])
+def test_preprocess_raw_image(
+    tmp_path: Path, max_size: int, expected_size: Tuple[int, int]
+) -> None:
+    raw_path = tmp_path / "image.CR2"
+    raw_path.write_bytes(_raw_file(_jpeg_bytes(40, 30), _jpeg_bytes(400, 300), 6))
+
+    previews, orientation = find_raw_previews(raw_path.read_bytes())
+
+    # The lossless JPEG raw data is not a preview
+    assert sorted((preview.width, preview.height) for preview in previews) == [
+        (40, 30),
+        (400, 300),
+    ]
+    assert orientation == 6
+
+    # The smallest preview that covers the maximum size is used
+    result = preprocess_image(raw_path, max_size=max_size)
+
+    with Image.open(io.BytesIO(result.image_bytes)) as image:
+        assert image.size == expected_size
+
+
+def test_preprocessor(tmp_path: Path) -> None:
+    image_paths = []
+
+    for i in range(5):
+        image_path = tmp_path / f"image_{i}.jpg"
+        image_path.write_bytes(_jpeg_bytes(400, 300))
+        image_paths.append(image_path)
+
+    broken_path = tmp_path / "broken.jpg"
+    broken_path.write_bytes(b"not an image")
+
+    with Preprocessor(max_size=100, max_workers=2, lookahead=2) as preprocessor:
+        assert list(preprocessor.prefetch(iter(image_paths))) == image_paths
+
+        for image_path in image_paths:
+            with Image.open(io.BytesIO(preprocessor.load(image_path))) as image:
+                assert image.size == (100, 75)
+
+        with pytest.raises(OSError):
+            preprocessor.load(broken_path)
+
+        summary = preprocessor.summary()
+
+    assert summary["num_images"] == 5
+    assert summary["original_megapixels"] == pytest.approx(5 * 0.12)
+    assert summary["pixels_saved"] == pytest.approx(1 - 100 * 75 / (400 * 300))
+    assert 0 < summary["bytes_saved"] < 1
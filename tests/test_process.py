@@ -1,11 +1,21 @@
+import os
+import sqlite3
 from pathlib import Path
+from typing import List, Tuple
 
 import pandas as pd
+import pytest
 
+from imageassessmentservice.output import ParquetRatingsWriter
 from imageassessmentservice.process import (
     build_target_path,
     ImageSorter,
+    load_digikam_image_data,
+    RatingUpdateSummary,
+    SortSummary,
     sort_to_folders,
+    store_to_digikam_db,
+    write_ratings,
 )
 
 
@@ -61,3 +71,212 @@ def test_sort_to_folders(tmp_path: Path) -> None:
     assert (target_path / "1" / "sub_1" / "image_1.jpg").exists()
     assert (target_path / "3" / "sub_2" / "image_2.jpg").exists()
     assert (target_path / "-1" / "sub_3" / "image_3.jpg").exists()
+
+
+@pytest.mark.parametrize("strategy", ["copy", "hardlink", "symlink", "reflink"])
+def test_image_sorter_sort_all(tmp_path: Path, strategy: str) -> None:
+    source_path = tmp_path / "source"
+    target_path = tmp_path / "target"
+
+    image_paths = []
+
+    for i in range(4):
+        image_path = source_path / f"sub_{i % 2}" / f"image_{i}.jpg"
+        image_path.parent.mkdir(parents=True, exist_ok=True)
+        image_path.write_bytes(bytes([i]) * 16)
+
+        image_paths.append(image_path)
+
+    rated_images = list(zip(image_paths, [1, 2, 1, -1]))
+    image_sorter = ImageSorter(source_path, target_path, strategy, max_workers=2)
+
+    assert image_sorter.sort_all(rated_images) == SortSummary(4, 0, 0)
+
+    sorted_image_path = target_path / "2" / "sub_1" / "image_1.jpg"
+    assert sorted_image_path.read_bytes() == image_paths[1].read_bytes()
+    assert sorted_image_path.is_symlink() == (strategy == "symlink")
+    if strategy == "hardlink":
+        assert sorted_image_path.samefile(image_paths[1])
+
+    # Placing the images again is a no-op, unless an image has changed
+    image_paths[0].write_bytes(b"changed")
+    os.utime(image_paths[0], ns=(0, 0))
+
+    assert image_sorter.sort_all(rated_images) == SortSummary(
+        0 if strategy in ("hardlink", "symlink") else 1,
+        4 if strategy in ("hardlink", "symlink") else 3,
+        0,
+    )
+    assert (target_path / "1" / "sub_0" / "image_0.jpg").read_bytes() == b"changed"
+
+
+def test_image_sorter_invalid_strategy(tmp_path: Path) -> None:
+    with pytest.raises(ValueError):
+        ImageSorter(tmp_path, tmp_path, "move")
+
+
+def _create_digikam_db(
+    database_file_path: Path, album_root: str, images: List[Tuple[str, str, int]]
+) -> None:
+    """Create a minimal Digikam database with images given as (album, name, rating)."""
+    connection = sqlite3.connect(database_file_path)
+    connection.executescript("""
+        CREATE TABLE AlbumRoots (id INTEGER PRIMARY KEY, specificPath TEXT);
+        CREATE TABLE Albums (id INTEGER PRIMARY KEY, albumRoot INTEGER, relativePath TEXT);
+        CREATE TABLE Images (id INTEGER PRIMARY KEY, album INTEGER, name TEXT);
+        CREATE TABLE ImageInformation (imageid INTEGER PRIMARY KEY, rating INTEGER);
+        """)
+    connection.execute("INSERT INTO AlbumRoots VALUES (1, ?);", (album_root,))
+
+    albums = sorted({album for album, _, _ in images})
+    for album_id, album in enumerate(albums, start=1):
+        connection.execute("INSERT INTO Albums VALUES (?, 1, ?);", (album_id, album))
+
+    for image_id, (album, name, rating) in enumerate(images, start=1):
+        connection.execute(
+            "INSERT INTO Images VALUES (?, ?, ?);",
+            (image_id, albums.index(album) + 1, name),
+        )
+        connection.execute(
+            "INSERT INTO ImageInformation VALUES (?, ?);", (image_id, rating)
+        )
+
+    connection.commit()
+    connection.close()
+
+
+def _load_digikam_ratings(database_file_path: Path) -> List[Tuple[int, int]]:
+    connection = sqlite3.connect(database_file_path)
+    ratings = connection.execute(
+        "SELECT imageid, rating FROM ImageInformation ORDER BY imageid;"
+    ).fetchall()
+    connection.close()
+
+    return ratings
+
+
+@pytest.mark.parametrize("fast_pragmas", [False, True])
+def test_write_ratings(tmp_path: Path, fast_pragmas: bool) -> None:
+    database_file_path = tmp_path / "digikam4.db"
+    _create_digikam_db(
+        database_file_path,
+        "/photos",
+        [("/2023", f"image_{i}.jpg", 0) for i in range(5)],
+    )
+
+    summary = write_ratings(
+        database_file_path,
+        [(1, 0, 3), (2, 0, 0), (3, 0, -1), (4, 0, 5), (5, 0, 1)],
+        batch_size=2,
+        fast_pragmas=fast_pragmas,
+    )
+
+    assert summary == RatingUpdateSummary(updated=3, skipped=2, failed=0)
+    assert _load_digikam_ratings(database_file_path) == [
+        (1, 3),
+        (2, 0),
+        (3, 0),
+        (4, 5),
+        (5, 1),
+    ]
+
+    connection = sqlite3.connect(database_file_path)
+    (journal_mode,) = connection.execute("PRAGMA journal_mode;").fetchone()
+    connection.close()
+    assert journal_mode == "delete"
+
+
+def test_write_ratings_restores_journal_mode_on_error(tmp_path: Path, mocker) -> None:
+    database_file_path = tmp_path / "digikam4.db"
+    _create_digikam_db(database_file_path, "/photos", [("/2023", "image_1.jpg", 0)])
+    mocker.patch(
+        "imageassessmentservice.process._execute_batch",
+        side_effect=sqlite3.OperationalError("disk I/O error"),
+    )
+
+    with pytest.raises(sqlite3.OperationalError):
+        write_ratings(database_file_path, [(1, 0, 3)], fast_pragmas=True)
+
+    connection = sqlite3.connect(database_file_path)
+    (journal_mode,) = connection.execute("PRAGMA journal_mode;").fetchone()
+    connection.close()
+    assert journal_mode == "delete"
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".parquet"])
+def test_store_to_digikam_db(tmp_path: Path, suffix: str) -> None:
+    database_file_path = tmp_path / "digikam4.db"
+    _create_digikam_db(
+        database_file_path,
+        "/user/photos",
+        [("/2023", "image_1.jpg", 2), ("/2023/trip", "image_2.jpg", 0)],
+    )
+
+    ratings_file = tmp_path / f"ratings{suffix}"
+    ratings = pd.DataFrame(
+        {
+            "image_path": [
+                "/home/user/photos/2023/image_1.jpg",
+                "/home/user/photos/2023/trip/image_2.jpg",
+                "/home/user/photos/2023/other.jpg",
+            ],
+            "rating_new": [2, 4, 1],
+        }
+    )
+
+    if suffix == ".parquet":
+        with ParquetRatingsWriter(ratings_file, ["aesthetic"]) as writer:
+            writer.write(ratings)
+    else:
+        ratings.to_csv(ratings_file)
+
+    store_to_digikam_db(str(database_file_path), str(ratings_file))
+
+    assert _load_digikam_ratings(database_file_path) == [(1, 2), (2, 4)]
+
+
+def test_write_ratings_counts_failures(tmp_path: Path) -> None:
+    database_file_path = tmp_path / "digikam4.db"
+    _create_digikam_db(
+        database_file_path,
+        "/photos",
+        [("/2023", f"image_{i}.jpg", 0) for i in range(3)],
+    )
+
+    connection = sqlite3.connect(database_file_path)
+    connection.execute(
+        """CREATE TRIGGER reject_image_2 BEFORE UPDATE ON ImageInformation
+        WHEN old.imageid = 2 BEGIN SELECT RAISE(ABORT, 'locked'); END;"""
+    )
+    connection.commit()
+    connection.close()
+
+    summary = write_ratings(database_file_path, [(1, 0, 1), (2, 0, 2), (3, 0, 3)])
+
+    assert summary == RatingUpdateSummary(updated=2, skipped=0, failed=1)
+    assert _load_digikam_ratings(database_file_path) == [(1, 1), (2, 0), (3, 3)]
+
+
+def test_load_digikam_image_data(tmp_path: Path) -> None:
+    database_file_path = tmp_path / "digikam4.db"
+    _create_digikam_db(
+        database_file_path,
+        "/photos",
+        [("/2023", "image_1.jpg", 2), ("/2024", "image_1.jpg", 3), ("/", "a.jpg", 1)],
+    )
+
+    all_images = load_digikam_image_data(database_file_path, album_root_prefix="/mnt")
+    assert sorted(all_images["full_path"]) == [
+        "/mnt/photos/2023/image_1.jpg",
+        "/mnt/photos/2024/image_1.jpg",
+        "/mnt/photos/a.jpg",
+    ]
+
+    selected_images = load_digikam_image_data(
+        database_file_path,
+        ["/mnt/photos/2024/image_1.jpg", "/mnt/photos/missing.jpg"],
+        album_root_prefix="/mnt",
+    )
+    assert selected_images.to_dict("records") == [
+        {"image_id": 2, "rating_old": 3, "full_path": "/mnt/photos/2024/image_1.jpg"}
+    ]
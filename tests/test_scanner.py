@@ -0,0 +1,74 @@
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
+import pytest
+
+from imageassessmentservice.scanner import scan_files, ScannedFile
+
+
+@pytest.fixture
+def image_folder(tmp_path: Path) -> Path:
+    for relative_path in [
+        "image_1.jpg",
+        "a/image_2.JPEG",
+        "a/b/image_3.jpg",
+        "a/b/notes.txt",
+        "a/@eaDir/image_1.jpg",
+        "c/image_4.png",
+        "c/d/e/image_5.jpg",
+    ]:
+        file_path = tmp_path / relative_path
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.touch()
+
+    (tmp_path / "empty").mkdir()
+
+    return tmp_path
+
+
+def _relative(
+    folder: Path, scanned_files: Iterable[ScannedFile]
+) -> List[Tuple[str, bool]]:
+    return sorted(
+        (scanned_file.path.relative_to(folder).as_posix(), scanned_file.is_image)
+        for scanned_file in scanned_files
+    )
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_scan_files(image_folder: Path, max_workers: int) -> None:
+    scanned_files = list(scan_files(image_folder, max_workers=max_workers))
+
+    assert all(isinstance(scanned_file, ScannedFile) for scanned_file in scanned_files)
+    assert _relative(image_folder, scanned_files) == [
+        ("a/@eaDir/image_1.jpg", True),
+        ("a/b/image_3.jpg", True),
+        ("a/b/notes.txt", False),
+        ("a/image_2.JPEG", True),
+        ("c/d/e/image_5.jpg", True),
+        ("c/image_4.png", False),
+        ("image_1.jpg", True),
+    ]
+
+
+def test_scan_files_filters(image_folder: Path) -> None:
+    scanned_files = scan_files(
+        image_folder,
+        extensions=["png", ".jpg"],
+        include=["a/*", "c/*"],
+        exclude=["@eaDir", "c/d"],
+    )
+
+    assert _relative(image_folder, scanned_files) == [
+        ("a/b/image_3.jpg", True),
+        ("a/b/notes.txt", False),
+        ("a/image_2.JPEG", False),
+        ("c/image_4.png", True),
+    ]
+
+
+def test_scan_files_stops_early(image_folder: Path) -> None:
+    scanned_files = scan_files(image_folder, max_workers=2)
+
+    assert isinstance(next(scanned_files), ScannedFile)
+    scanned_files.close()
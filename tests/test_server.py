@@ -1,8 +1,42 @@
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Sequence, Tuple
+
+import grpc
 import numpy as np
+import pytest
 import tensorflow as tf
 
-from imageassessmentservice.server import ImageAssessmentService
-from imageassessmentservice.imageassessment_pb2 import ImageAssessmentRequest
+from imageassessmentservice.server import (
+    _assemble_chunks,
+    create_server,
+    ImageAssessmentService,
+    ImageTooLargeError,
+    MusiqModel,
+    warm_up,
+)
+from imageassessmentservice.imageassessment_pb2 import (
+    AssessmentHead,
+    DecodePolicy,
+    ImageAssessmentRequest,
+    ImageChunk,
+)
+from imageassessmentservice.imageassessment_pb2_grpc import ImageAssessmentStub
+from imageassessmentservice.batching import (
+    BatchScheduler,
+    DeadlineExpiredError,
+    QueueFullError,
+)
+from imageassessmentservice.cache import ResultCache
+from imageassessmentservice.decoding import ImageDecoder
+from imageassessmentservice.definitions import (
+    ASSESSMENT_HEADS,
+    RETRY_PUSHBACK_METADATA_KEY,
+)
+from imageassessmentservice.models import Assessment, AssessmentModel
 
 
 def test_assess() -> None:
@@ -19,3 +53,474 @@ def test_assess() -> None:
     assert response.path == "path/to/image.jpg"
     assert response.assessment_aesthetic > 2.5
     assert response.assessment_technical > 50.0
+
+
+class ConstantModel(AssessmentModel):
+    def assess_batch(
+        self, images: Sequence[bytes], heads: Sequence[str] = ASSESSMENT_HEADS
+    ) -> List[Assessment]:
+        return [Assessment(5.0, 75.0) for _ in images]
+
+
+def test_assess_with_stub_model() -> None:
+    service = ImageAssessmentService(model=ConstantModel())
+
+    request = ImageAssessmentRequest(path="path/to/image.jpg", image_bytes=b"image")
+
+    response = service.Assess(request, None)
+
+    assert response.path == "path/to/image.jpg"
+    assert response.assessment_aesthetic == 5.0
+    assert response.assessment_technical == 75.0
+
+
+def test_assess_stream() -> None:
+    class FailingOnEmptyModel(AssessmentModel):
+        def assess_batch(
+            self, images: Sequence[bytes], heads: Sequence[str] = ASSESSMENT_HEADS
+        ) -> List[Assessment]:
+            if any(len(image) == 0 for image in images):
+                raise ValueError("Empty image")
+
+            return [Assessment(len(image), 10.0 * len(image)) for image in images]
+
+    service = ImageAssessmentService(model=FailingOnEmptyModel(), max_batch_size=1)
+
+    requests = [
+        ImageAssessmentRequest(
+            path=f"image_{i}.jpg", image_bytes=b"x" * i, request_id=str(i)
+        )
+        for i in range(4)
+    ]
+
+    responses = {
+        response.request_id: response
+        for response in service.AssessStream(iter(requests), None)
+    }
+
+    assert sorted(responses) == ["0", "1", "2", "3"]
+    assert responses["0"].error
+    for i in range(1, 4):
+        assert responses[str(i)].path == f"image_{i}.jpg"
+        assert responses[str(i)].assessment_aesthetic == i
+        assert responses[str(i)].assessment_technical == 10.0 * i
+        assert not responses[str(i)].error
+
+
+def test_assess_with_cache() -> None:
+    class CountingModel(ConstantModel):
+        num_images = 0
+
+        def assess_batch(
+            self, images: Sequence[bytes], heads: Sequence[str] = ASSESSMENT_HEADS
+        ) -> List[Assessment]:
+            self.num_images += len(images)
+            return super().assess_batch(images, heads)
+
+    model = CountingModel()
+    cache = ResultCache(model.model_id)
+    service = ImageAssessmentService(model=model, cache=cache)
+
+    for path in ["image.jpg", "copy_of_image.jpg"]:
+        response = service.Assess(
+            ImageAssessmentRequest(path=path, image_bytes=b"image"), None
+        )
+
+        assert response.path == path
+        assert response.assessment_aesthetic == 5.0
+        assert response.assessment_technical == 75.0
+
+    assert model.num_images == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_assess_when_cache_fails(mocker) -> None:
+    cache = ResultCache("constant")
+    mocker.patch.object(cache, "put", side_effect=sqlite3.OperationalError("locked"))
+    service = ImageAssessmentService(model=ConstantModel(), cache=cache)
+
+    future = service.submit(b"image")
+
+    assert future.result(timeout=5) == Assessment(5.0, 75.0)
+    service.scheduler.stop()
+
+
+def _slow_predict_fn(rating: float, duration_s: float):
+    def _predict(image_bytes_tensor: tf.Tensor):
+        time.sleep(duration_s)
+        return {"output_0": tf.constant(rating)}
+
+    return _predict
+
+
+@pytest.mark.parametrize("concurrent_heads", [True, False])
+def test_musiq_model_runs_heads_concurrently(concurrent_heads: bool) -> None:
+    model = MusiqModel(
+        _slow_predict_fn(5.0, 0.2),
+        _slow_predict_fn(75.0, 0.2),
+        concurrent_heads=concurrent_heads,
+    )
+
+    assert model.assess_batch([b"image"]) == [Assessment(5.0, 75.0)]
+
+    timings = model.timings.summary()
+    assert set(timings) == {"prepare", "aesthetic", "technical", "total"}
+    assert timings["aesthetic"]["mean_ms"] >= 200
+    assert timings["technical"]["mean_ms"] >= 200
+
+    if concurrent_heads:
+        assert timings["total"]["mean_ms"] < 350
+    else:
+        assert timings["total"]["mean_ms"] >= 400
+
+
+class _ConstantRating(tf.Module):
+    def __init__(self, rating: float):
+        super().__init__()
+        self.rating = rating
+
+    @tf.function(input_signature=[tf.TensorSpec([], tf.string)])
+    def __call__(self, image_bytes_tensor: tf.Tensor):
+        return {"output_0": tf.constant(self.rating)}
+
+
+def test_musiq_model_from_local_dir(tmp_path: Path) -> None:
+    for subdir, rating in [("ava", 5.0), ("paq2piq", 75.0)]:
+        module = _ConstantRating(rating)
+        tf.saved_model.save(
+            module,
+            str(tmp_path / subdir),
+            signatures={"serving_default": module.__call__},
+        )
+
+    model = MusiqModel.from_tf_hub(model_dir=str(tmp_path))
+    assert model.assess_batch([b"image"]) == [Assessment(5.0, 75.0)]
+
+    assert model.model_id == "musiq-ava-1+musiq-paq2piq-1"
+
+    model = MusiqModel.from_tf_hub(heads=["technical"], model_dir=str(tmp_path))
+    assert model.heads == ("technical",)
+
+    # Ratings of other engines and precisions are told apart in the result cache
+    model = MusiqModel(model.predict_fns["technical"], None, engine="xla")
+    assert model.model_id == "musiq-ava-1+musiq-paq2piq-1+xla"
+    model = MusiqModel(
+        model.predict_fns["aesthetic"], None, engine="frozen", precision="bfloat16"
+    )
+    assert model.model_id == "musiq-ava-1+musiq-paq2piq-1+frozen+bfloat16"
+
+    with pytest.raises(ValueError, match="Unknown heads"):
+        MusiqModel.from_tf_hub(heads=["colorfulness"], model_dir=str(tmp_path))
+
+
+def test_warm_up() -> None:
+    images = []
+
+    def _predict(image_bytes_tensor: tf.Tensor):
+        images.append(tf.io.decode_jpeg(image_bytes_tensor))
+        return {"output_0": tf.constant(5.0)}
+
+    model = MusiqModel(_predict, None)
+
+    assert warm_up(model, image_sizes=[(64, 48), (48, 64)]) > 0.0
+    assert [image.shape for image in images] == [(48, 64, 3), (64, 48, 3)]
+    # The warm-up does not distort the timings of the requests
+    assert model.timings.summary() == {}
+
+
+def test_assess_selected_heads() -> None:
+    model = MusiqModel(None, _slow_predict_fn(75.0, 0.0))
+    service = ImageAssessmentService(model=model)
+
+    response = service.Assess(
+        ImageAssessmentRequest(
+            path="image.jpg", image_bytes=b"image", heads=[AssessmentHead.TECHNICAL]
+        ),
+        None,
+    )
+    assert not response.HasField("assessment_aesthetic")
+    assert response.assessment_technical == 75.0
+
+    # The aesthetic model is not loaded
+    responses = list(
+        service.AssessStream(
+            iter(
+                [
+                    ImageAssessmentRequest(
+                        path="image.jpg",
+                        image_bytes=b"image",
+                        heads=[AssessmentHead.AESTHETIC],
+                    )
+                ]
+            ),
+            None,
+        )
+    )
+    assert responses[0].error
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET6, socket.SOCK_STREAM) as s:
+        s.bind(("::", 0))
+        return s.getsockname()[1]
+
+
+def test_create_server_reuse_port() -> None:
+    port = _free_port()
+    services = [ImageAssessmentService(model=ConstantModel()) for _ in range(2)]
+    servers = [
+        create_server(service, port, max_workers=2, reuse_port=True)
+        for service in services
+    ]
+
+    try:
+        with grpc.insecure_channel(f"localhost:{port}") as channel:
+            response = ImageAssessmentStub(channel).Assess(
+                ImageAssessmentRequest(path="image.jpg", image_bytes=b"image")
+            )
+        assert response.assessment_aesthetic == 5.0
+
+        # Without SO_REUSEPORT, a port that is in use cannot be shared
+        with pytest.raises(RuntimeError):
+            create_server(services[0], port, max_workers=2)
+    finally:
+        for server, service in zip(servers, services):
+            server.stop(grace=None)
+            service.scheduler.stop()
+
+
+def test_assemble_chunks() -> None:
+    chunks = [
+        ImageChunk(path="image.jpg", total_size=5, data=b"ab"),
+        ImageChunk(data=b"cd"),
+        ImageChunk(data=b"e"),
+    ]
+
+    image_bytes, first_chunk = _assemble_chunks(iter(chunks), max_image_size=5)
+
+    assert image_bytes == b"abcde"
+    assert first_chunk.path == "image.jpg"
+
+    with pytest.raises(ImageTooLargeError):
+        _assemble_chunks(iter(chunks), max_image_size=4)
+
+    with pytest.raises(ValueError, match="more bytes"):
+        _assemble_chunks(iter(chunks + [ImageChunk(data=b"f")]), max_image_size=5)
+
+    with pytest.raises(ValueError, match="4 of 5"):
+        _assemble_chunks(iter(chunks[:2]), max_image_size=5)
+
+    with pytest.raises(ValueError):
+        _assemble_chunks(iter([]), max_image_size=5)
+
+    # The upload holds its announced size in the budget of the scheduler, which is
+    # returned if the upload fails
+    scheduler = BatchScheduler(ConstantModel(), max_pending_mb=1.0)
+    _assemble_chunks(iter(chunks), max_image_size=5, scheduler=scheduler)
+    assert scheduler.stats()["pending_bytes"] == 5
+
+    with pytest.raises(ValueError, match="4 of 5"):
+        _assemble_chunks(iter(chunks[:2]), max_image_size=5, scheduler=scheduler)
+
+    assert scheduler.stats()["pending_bytes"] == 5
+    scheduler.stop()
+
+
+class AbortingContext:
+    def abort(self, code: grpc.StatusCode, details: str) -> None:
+        raise RuntimeError(code)
+
+    def time_remaining(self) -> None:
+        return None
+
+
+def test_assess_upload() -> None:
+    service = ImageAssessmentService(model=ConstantModel(), max_image_size_mb=1.0)
+
+    response = service.AssessUpload(
+        iter(
+            [
+                ImageChunk(path="image.jpg", request_id="1", total_size=2, data=b"a"),
+                ImageChunk(data=b"b"),
+            ]
+        ),
+        AbortingContext(),
+    )
+
+    assert response.path == "image.jpg"
+    assert response.request_id == "1"
+    assert response.assessment_technical == 75.0
+    # The reservation of the upload is returned once the image is assessed
+    assert service.scheduler.stats()["pending"] == 0
+    assert service.scheduler.stats()["pending_bytes"] == 0
+
+    with pytest.raises(RuntimeError, match="RESOURCE_EXHAUSTED"):
+        service.AssessUpload(
+            iter([ImageChunk(path="image.jpg", total_size=2 * 1024**2)]),
+            AbortingContext(),
+        )
+
+
+class BlockingModel(ConstantModel):
+    def __init__(self):
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def assess_batch(
+        self, images: Sequence[bytes], heads: Sequence[str] = ASSESSMENT_HEADS
+    ) -> List[Assessment]:
+        self.entered.set()
+        self.release.wait()
+        return super().assess_batch(images, heads)
+
+
+def test_admission_control() -> None:
+    model = BlockingModel()
+    service = ImageAssessmentService(
+        model=model, max_batch_size=1, max_batch_wait_ms=0, max_pending_requests=2
+    )
+    port = _free_port()
+    server = create_server(service, port, max_workers=4)
+
+    def _assess(timeout: float) -> grpc.Future:
+        return stub.Assess.future(
+            ImageAssessmentRequest(path="image.jpg", image_bytes=b"image"),
+            timeout=timeout,
+        )
+
+    try:
+        with grpc.insecure_channel(f"localhost:{port}") as channel:
+            stub = ImageAssessmentStub(channel)
+            first_call = _assess(timeout=10.0)
+            assert model.entered.wait(timeout=5)
+
+            # Queued behind the first image until its deadline has passed
+            expiring_call = _assess(timeout=0.2)
+            time.sleep(0.1)
+
+            with pytest.raises(grpc.RpcError) as exc_info:
+                _assess(timeout=10.0).result()
+
+            assert exc_info.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+            assert (
+                int(
+                    dict(exc_info.value.trailing_metadata())[
+                        RETRY_PUSHBACK_METADATA_KEY
+                    ]
+                )
+                >= 100
+            )
+
+            with pytest.raises(grpc.RpcError) as exc_info:
+                expiring_call.result()
+
+            assert exc_info.value.code() == grpc.StatusCode.DEADLINE_EXCEEDED
+
+            model.release.set()
+            assert first_call.result().assessment_aesthetic == 5.0
+            assert _assess(timeout=10.0).result().assessment_aesthetic == 5.0
+    finally:
+        server.stop(grace=None)
+        service.scheduler.stop()
+
+    assert service.scheduler.stats()["rejected"] == 1
+    assert service.scheduler.stats()["expired"] == 1
+
+
+def test_assess_stream_waits_for_room() -> None:
+    service = ImageAssessmentService(
+        model=ConstantModel(),
+        max_batch_wait_ms=0,
+        max_pending_requests=1,
+        cache=ResultCache("constant"),
+    )
+    requests = [
+        ImageAssessmentRequest(path=f"image_{i}.jpg", image_bytes=b"image%d" % i)
+        for i in range(5)
+    ]
+
+    # Images of a stream are not rejected but wait until the queue has room
+    responses = list(service.AssessStream(iter(requests), None))
+
+    assert sorted(response.path for response in responses) == [
+        request.path for request in requests
+    ]
+    assert not any(response.error for response in responses)
+    # Waiting images are looked up in the cache and decoded once
+    assert service.cache is not None
+    assert service.cache.stats()["misses"] == len(requests)
+    assert service.decoder.stats()["full_resolution"] == len(requests)
+    service.scheduler.stop()
+
+
+def test_rejected_images_are_not_decoded() -> None:
+    model = BlockingModel()
+    service = ImageAssessmentService(
+        model=model,
+        max_batch_wait_ms=0,
+        max_pending_requests=1,
+        decoder=ImageDecoder(max_pixels=30000),
+    )
+    large_image = tf.io.encode_jpeg(np.zeros((300, 400, 3), dtype=np.uint8)).numpy()
+
+    future = service.submit(large_image)
+    assert model.entered.wait(timeout=5)
+
+    for _ in range(3):
+        with pytest.raises(QueueFullError):
+            service.submit(large_image)
+
+    with pytest.raises(DeadlineExpiredError):
+        service.submit(large_image, deadline=time.monotonic() - 1.0)
+
+    model.release.set()
+    future.result(timeout=5)
+
+    assert service.decoder.stats()["dct_downscaled"] == 1
+    service.scheduler.stop()
+
+
+def test_assess_large_image_is_downscaled() -> None:
+    class SizeRecordingModel(ConstantModel):
+        def __init__(self):
+            self.image_shapes: List[Tuple[int, ...]] = []
+
+        def assess_batch(
+            self, images: Sequence[bytes], heads: Sequence[str] = ASSESSMENT_HEADS
+        ) -> List[Assessment]:
+            self.image_shapes.extend(
+                tuple(tf.io.decode_jpeg(image).shape) for image in images
+            )
+            return super().assess_batch(images, heads)
+
+    model = SizeRecordingModel()
+    service = ImageAssessmentService(
+        model=model,
+        cache=ResultCache("constant"),
+        decoder=ImageDecoder(max_pixels=30000),
+    )
+
+    small_image = tf.io.encode_jpeg(np.zeros((100, 200, 3), dtype=np.uint8)).numpy()
+    large_image = tf.io.encode_jpeg(np.zeros((300, 400, 3), dtype=np.uint8)).numpy()
+
+    responses = [
+        service.Assess(ImageAssessmentRequest(path=path, image_bytes=image), None)
+        for path, image in [
+            ("small.jpg", small_image),
+            ("large.jpg", large_image),
+            ("large_copy.jpg", large_image),
+        ]
+    ]
+
+    assert [response.decode_policy for response in responses] == [
+        DecodePolicy.FULL_RESOLUTION,
+        DecodePolicy.DCT_DOWNSCALED,
+        DecodePolicy.DCT_DOWNSCALED,
+    ]
+    # The copy is answered from the cache, which is keyed by the received image
+    assert model.image_shapes == [(100, 200, 3), (150, 200, 3)]
+    assert service.decoder.stats()["dct_downscaled"] == 1
+    assert {response.model_id for response in responses} == {
+        f"{model.model_id}+max30000px"
+    }
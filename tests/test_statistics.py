@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from imageassessmentservice.client import map_ratings_to_bins, normalize_ratings
+from imageassessmentservice.statistics import (
+    QuantileSketch,
+    RatingDistribution,
+    RunningMoments,
+    normalize_and_bin_chunks,
+)
+
+
+def test_running_moments_merge() -> None:
+    values = np.random.default_rng(0).normal(3.0, 2.0, 1000)
+
+    moments = RunningMoments()
+    for shard in np.array_split(values, 7):
+        shard_moments = RunningMoments()
+        shard_moments.update(shard)
+        moments.merge(shard_moments)
+
+    assert moments.count == 1000
+    assert moments.mean == pytest.approx(values.mean())
+    assert moments.std == pytest.approx(pd.Series(values).std())
+
+
+def test_quantile_sketch_is_exact_for_small_inputs() -> None:
+    values = pd.Series([0, 1, 2, 3.1, 4])
+    sketch = QuantileSketch()
+    sketch.update(values.to_numpy())
+
+    qs = np.linspace(0, 1, 7)
+    np.testing.assert_allclose(sketch.quantiles(qs), values.quantile(qs))
+
+
+def test_quantile_sketch_approximates_large_inputs() -> None:
+    values = np.random.default_rng(0).normal(0.0, 1.0, 200000)
+
+    sketch = QuantileSketch(capacity=256)
+    for shard in np.array_split(values, 10):
+        shard_sketch = QuantileSketch(capacity=256)
+        shard_sketch.update(shard)
+        sketch.merge(QuantileSketch.from_dict(shard_sketch.to_dict()))
+
+    assert sketch.count == values.size
+    assert sum(level.size for level in sketch.levels) < 256 * len(sketch.levels)
+
+    qs = np.array([0.0, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0])
+    # Compare ranks, as the rank error is what the sketch bounds
+    estimated_ranks = (
+        np.searchsorted(np.sort(values), sketch.quantiles(qs)) / values.size
+    )
+    np.testing.assert_allclose(estimated_ranks, qs, atol=0.02)
+
+
+def test_normalize_and_bin_chunks_matches_in_memory_result() -> None:
+    rng = np.random.default_rng(0)
+    ratings = pd.DataFrame(
+        {
+            "image_path": [f"image_{i}.jpg" for i in range(100)],
+            "aesthetic": rng.uniform(1, 10, 100),
+            "technical": rng.uniform(0, 100, 100),
+        }
+    )
+
+    expected = normalize_ratings(ratings.copy(), ["aesthetic", "technical"])
+    expected["rating_new"] = map_ratings_to_bins(5, expected["overall"])
+
+    result = pd.concat(
+        normalize_and_bin_chunks(
+            lambda: (
+                ratings.iloc[start : start + 17].copy() for start in range(0, 100, 17)
+            ),
+            ["aesthetic", "technical"],
+            5,
+        )
+    )
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_rating_distribution_roundtrip() -> None:
+    ratings = pd.DataFrame({"aesthetic": [1.0, 2.0, 3.0], "technical": [3.0, 4.0, 6.0]})
+
+    distribution = RatingDistribution(["aesthetic", "technical"])
+    distribution.update_moments(ratings)
+    distribution.update_quantiles(ratings)
+
+    restored = RatingDistribution.from_dict(distribution.to_dict())
+
+    np.testing.assert_allclose(
+        restored.interval_bounds(2), distribution.interval_bounds(2)
+    )
+    pd.testing.assert_series_equal(
+        restored.overall(ratings), distribution.overall(ratings)
+    )
@@ -0,0 +1,34 @@
+import pytest
+
+from imageassessmentservice.stats import ClientStats
+
+
+def test_client_stats() -> None:
+    stats = ClientStats()
+
+    for key in ["a", "b", "c"]:
+        stats.request_sent(key, 100)
+
+    # Responses can arrive in any order, unknown keys are only counted as bytes
+    for key in ["c", "a", "b", "unknown"]:
+        stats.response_received(key, 10)
+
+    summary = stats.summary()
+
+    assert summary["num_responses"] == 3
+    assert summary["bytes_sent"] == 300
+    assert summary["bytes_received"] == 40
+    assert summary["images_per_s"] > 0
+    assert (
+        summary["latency_ms"]["p50"]
+        <= summary["latency_ms"]["p95"]
+        <= summary["latency_ms"]["p99"]
+    )
+
+
+def test_client_stats_without_requests() -> None:
+    summary = ClientStats().summary()
+
+    assert summary["num_responses"] == 0
+    assert summary["images_per_s"] == pytest.approx(0.0)
+    assert summary["latency_ms"]["p50"] is None
@@ -0,0 +1,262 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import List
+
+import pandas as pd
+import pytest
+
+from imageassessmentservice.index import RatingsIndex
+from imageassessmentservice.process import ImageSorter
+from imageassessmentservice.scanner import FileSelector
+from imageassessmentservice.statistics import RatingDistribution
+from imageassessmentservice.watch import (
+    Debouncer,
+    InotifyWatcher,
+    PollingWatcher,
+    WatchSession,
+)
+
+
+class FakeClock:
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _names(paths: List[Path]) -> List[str]:
+    return sorted(path.name for path in paths)
+
+
+def test_polling_watcher(tmp_path: Path) -> None:
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a" / "image1.jpg").write_bytes(b"x")
+    (tmp_path / "notes.txt").write_bytes(b"x")
+
+    clock = FakeClock()
+    watcher = PollingWatcher(FileSelector(tmp_path), 3600.0, clock)
+
+    assert _names(watcher.changes()) == ["image1.jpg"]
+    assert watcher.changes() == []
+
+    # New images in known and new folders
+    (tmp_path / "image2.jpg").write_bytes(b"x")
+    (tmp_path / "a" / "b").mkdir()
+    (tmp_path / "a" / "b" / "image3.jpg").write_bytes(b"x")
+    assert _names(watcher.changes()) == ["image2.jpg", "image3.jpg"]
+
+    # Images modified in place are found by the next full scan
+    image1 = tmp_path / "a" / "image1.jpg"
+    stat = image1.stat()
+    os.utime(image1, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert watcher.changes() == []
+
+    clock.now = 3600.0
+    assert _names(watcher.changes()) == ["image1.jpg"]
+
+
+def test_inotify_watcher(tmp_path: Path) -> None:
+    (tmp_path / "image1.jpg").write_bytes(b"x")
+
+    try:
+        watcher = InotifyWatcher(FileSelector(tmp_path, exclude=["@eaDir"]))
+    except OSError:
+        pytest.skip("inotify is not available")
+
+    try:
+        assert _names(watcher.changes()) == ["image1.jpg"]
+
+        (tmp_path / "image2.jpg").write_bytes(b"x")
+        (tmp_path / "notes.txt").write_bytes(b"x")
+        (tmp_path / "a").mkdir()
+        (tmp_path / "a" / "image3.jpg").write_bytes(b"x")
+        (tmp_path / "@eaDir").mkdir()
+        (tmp_path / "@eaDir" / "image4.jpg").write_bytes(b"x")
+
+        changed: List[Path] = []
+        for _ in range(50):
+            changed.extend(watcher.changes())
+            if {"image2.jpg", "image3.jpg"} <= set(_names(changed)):
+                break
+            time.sleep(0.01)
+
+        assert set(_names(changed)) == {"image2.jpg", "image3.jpg"}
+    finally:
+        watcher.close()
+
+
+def test_debouncer(tmp_path: Path) -> None:
+    clock = FakeClock()
+    wall_clock = FakeClock(time.time())
+    debouncer = Debouncer(5.0, clock, wall_clock)
+
+    old_image = tmp_path / "old.jpg"
+    old_image.write_bytes(b"x")
+    os.utime(old_image, (wall_clock.now - 3600, wall_clock.now - 3600))
+    new_image = tmp_path / "new.jpg"
+    new_image.write_bytes(b"x")
+
+    debouncer.add([old_image, new_image, tmp_path / "missing.jpg"])
+
+    # Images modified long ago are ready at once
+    assert debouncer.ready() == [old_image]
+    assert len(debouncer) == 1
+
+    # An image that is still written is held back until it stops changing
+    clock.now = 4.0
+    wall_clock.now += 4.0
+    new_image.write_bytes(b"xx")
+    os.utime(new_image, (wall_clock.now, wall_clock.now))
+    assert debouncer.ready() == []
+
+    clock.now = 8.0
+    wall_clock.now += 4.0
+    assert debouncer.ready() == []
+
+    clock.now = 9.0
+    assert debouncer.ready() == [new_image]
+    assert len(debouncer) == 0
+
+
+def test_watch_session(tmp_path: Path, mocker) -> None:
+    source_folder = tmp_path / "source"
+    source_folder.mkdir()
+    target_folder = tmp_path / "target"
+
+    def _write_image(name: str, size: int) -> Path:
+        image_path = source_folder / name
+        image_path.write_bytes(b"x" * size)
+        # Old enough not to be held back
+        os.utime(image_path, (time.time() - 3600, time.time() - 3600))
+        return image_path
+
+    for i in range(1, 4):
+        _write_image(f"image{i}.jpg", i)
+
+    rated_paths = []
+
+    def _fake_rate_images(
+        image_paths, address, max_in_flight, rating_callback, heads, show_progress
+    ):
+        ratings = []
+        for image_path in image_paths:
+            rated_paths.append(image_path.name)
+            rating = {
+                "image_path": str(image_path),
+                "aesthetic": float(image_path.stat().st_size),
+            }
+            rating_callback(rating)
+            ratings.append(rating)
+
+        return pd.DataFrame(ratings), []
+
+    mocker.patch(
+        "imageassessmentservice.watch.rate_images", side_effect=_fake_rate_images
+    )
+
+    def _session() -> WatchSession:
+        return WatchSession(
+            PollingWatcher(FileSelector(source_folder)),
+            Debouncer(5.0),
+            RatingsIndex(tmp_path / "ratings.index.sqlite"),
+            tmp_path / "distribution.json",
+            "localhost",
+            heads=["aesthetic"],
+            num_bins=3,
+            image_sorter=ImageSorter(source_folder, target_folder),
+            batch_size=2,
+            min_ratings=3,
+        )
+
+    session = _session()
+
+    # The distribution is computed once the existing images are rated
+    assert session.step() == 3
+    assert (tmp_path / "distribution.json").exists()
+    assert sorted(path.name for path in target_folder.glob("*/*.jpg")) == [
+        "image1.jpg",
+        "image2.jpg",
+        "image3.jpg",
+    ]
+    assert (target_folder / "3" / "image3.jpg").exists()
+    assert session.step() == 0
+    session.index.close()
+
+    # After a restart, only new and changed images are rated and binned with the
+    # stored distribution
+    rated_paths.clear()
+    session = _session()
+    _write_image("image4.jpg", 10)
+    _write_image("image1.jpg", 2)
+
+    assert session.step() == 2
+    assert sorted(rated_paths) == ["image1.jpg", "image4.jpg"]
+    assert (target_folder / "3" / "image4.jpg").exists()
+    # The changed image moved to the bin of its new rating
+    assert (target_folder / "2" / "image1.jpg").exists()
+    assert not (target_folder / "1" / "image1.jpg").exists()
+
+    # Once the number of ratings doubled, the distribution is computed again
+    _write_image("image5.jpg", 5)
+    _write_image("image6.jpg", 6)
+
+    assert session.step() == 2
+    assert session.distribution is not None
+    assert session.distribution.moments["aesthetic"].count == 6
+    assert (
+        RatingDistribution.from_dict(
+            json.loads((tmp_path / "distribution.json").read_text())
+        )
+        .moments["aesthetic"]
+        .count
+        == 6
+    )
+    session.index.close()
+
+
+def test_watch_session_retries_failed_images(tmp_path: Path, mocker) -> None:
+    image_path = tmp_path / "source" / "image.jpg"
+    image_path.parent.mkdir()
+    image_path.write_bytes(b"x")
+    os.utime(image_path, (time.time() - 3600, time.time() - 3600))
+
+    attempts = []
+
+    def _failing_rate_images(image_paths, *args, **kwargs):
+        attempts.extend(image_paths)
+        return pd.DataFrame(), list(image_paths)
+
+    mocker.patch(
+        "imageassessmentservice.watch.rate_images", side_effect=_failing_rate_images
+    )
+
+    def _session(retry_interval_s: float) -> WatchSession:
+        return WatchSession(
+            PollingWatcher(FileSelector(image_path.parent)),
+            Debouncer(5.0),
+            RatingsIndex(tmp_path / f"ratings{retry_interval_s}.index.sqlite"),
+            tmp_path / "distribution.json",
+            "localhost",
+            retry_interval_s=retry_interval_s,
+        )
+
+    session = _session(0.0)
+
+    for _ in range(3):
+        session.step()
+
+    assert attempts == [image_path] * 3
+    session.index.close()
+
+    # Images are not retried before the retry interval has passed
+    attempts.clear()
+    session = _session(3600.0)
+
+    for _ in range(3):
+        session.step()
+
+    assert attempts == [image_path]
+    session.index.close()